@@ -0,0 +1,934 @@
+"""Benchmarks for the password vault.
+
+Run `python benchmark.py <scenario> [options]`; `--help` lists the scenarios.
+Every scenario works on throwaway vaults in a temporary directory.
+
+`suite` is the one to run routinely: it covers the main paths at sizes up
+to 1M entries, and with `--json` and `--compare` tells whether a change
+made any of them slower than an earlier run.
+"""
+import argparse
+import collections
+import os
+import random
+import shutil
+import tempfile
+import time
+import tracemalloc
+from contextlib import contextmanager
+
+
+@contextmanager
+def scratch_dir():
+    directory = tempfile.mkdtemp(prefix="easypass-bench-")
+    try:
+        yield directory
+    finally:
+        shutil.rmtree(directory, ignore_errors=True)
+
+
+def synthetic_accounts(count, start=0):
+    for i in range(start, start + count):
+        yield f"account-{i:07d}", f"Pw!{i * 7919 % 1000003:07d}"
+
+
+def realistic_account_names(count, seed=1):
+    # Service/user style names with plenty of shared substrings, which is
+    # harder on a search index than sequential numbers.
+    rng = random.Random(seed)
+    syllables = ["ka", "lo", "mi", "ra", "ten", "gor", "vu", "shi", "pal", "dex",
+                 "on", "qui", "zen", "bra", "tor", "el", "fy", "nu", "sa", "wer"]
+    services = ["gmail", "github", "bank", "vpn", "jira", "aws", "slack", "db",
+                "router", "ssh", "wiki", "mail", "ldap", "ci", "cloud", "shop"]
+    names = set()
+    while len(names) < count:
+        user = "".join(rng.choice(syllables) for _ in range(rng.randint(2, 4)))
+        names.add(f"{rng.choice(services)}-{user}{rng.randint(0, 999)}")
+    return sorted(names, key=lambda _: rng.random())
+
+
+def percentile(samples, fraction):
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * fraction))]
+
+
+def report(label, seconds, operations=None):
+    line = f"{label:<40} {seconds * 1000:>10.1f} ms"
+    if operations:
+        line += f"  ({operations / seconds:,.0f} ops/s)"
+    print(line)
+
+
+def bench_transaction(args):
+    from vault import PasswordManager
+
+    with scratch_dir() as directory:
+        manager = PasswordManager(os.path.join(directory, "single.ini"))
+        start = time.perf_counter()
+        for account, password in synthetic_accounts(args.count):
+            manager.add_password(account, password)
+        single = time.perf_counter() - start
+        manager.storage.close()
+
+        manager = PasswordManager(os.path.join(directory, "batched.ini"))
+        start = time.perf_counter()
+        manager.add_many(synthetic_accounts(args.count))
+        batched = time.perf_counter() - start
+        manager.storage.close()
+
+    report(f"{args.count} x add_password()", single, args.count)
+    report(f"add_many() of {args.count}", batched, args.count)
+    print(f"batched commit is {single / batched:.1f}x faster")
+
+
+def bench_search(args):
+    from search_index import AccountIndex
+    from vault import PasswordManager
+
+    names = realistic_account_names(args.count)
+    start = time.perf_counter()
+    index = AccountIndex(names)
+    report(f"build index over {args.count} accounts", time.perf_counter() - start)
+
+    # Type out fragments of existing names one keystroke at a time, the way
+    # the search box drives the index. A keystroke is the search plus the
+    # first screenful of the results (the rows the list shows, and its
+    # buffer), which is all the window asks for.
+    rng = random.Random(2)
+    fragments = []
+    for name in rng.sample(names, args.queries):
+        begin = rng.randint(0, max(0, len(name) - 6))
+        fragments.append(name[begin:begin + rng.randint(4, 8)])
+
+    def type_out(search, fragment, keystrokes, everything=None):
+        for end in range(1, len(fragment) + 1):
+            start = time.perf_counter()
+            results = search(fragment[:end])
+            results[:args.page]
+            keystrokes.append(time.perf_counter() - start)
+            if everything is not None:
+                start = time.perf_counter()
+                len(results)
+                everything.append(keystrokes[-1] + time.perf_counter() - start)
+
+    # Typing the moment the window is up: the index is still being built
+    # in the background, so these keystrokes scan the names instead
+    with scratch_dir() as directory:
+        manager = PasswordManager(os.path.join(directory, "search.vault"))
+        manager.add_many({name: "x" for name in names})
+        manager.build_index_in_background()
+        early = []
+        for fragment in fragments:
+            if manager.index_built:  # search() noticed it is done
+                break
+            type_out(manager.search, fragment, early)
+        manager.close()
+
+    keystrokes = []
+    everything = []
+    for fragment in fragments:
+        type_out(index.search, fragment, keystrokes, everything)
+
+    for label, samples in (
+        ("while building", early),
+        ("keystrokes", keystrokes),
+        ("all matches", everything),
+    ):
+        if samples:
+            print(f"{len(samples):>6} {label:<14} median {percentile(samples, 0.5) * 1e6:>6.0f} us, "
+                  f"p99 {percentile(samples, 0.99) * 1e6:>6.0f} us, "
+                  f"max {max(samples) * 1e6:>6.0f} us")
+
+    start = time.perf_counter()
+    for i in range(1000):
+        index.add(f"bench-new-{i}")
+    for i in range(1000):
+        index.discard(f"bench-new-{i}")
+    report("1000 incremental adds + deletes", time.perf_counter() - start, 2000)
+
+
+def bench_encryption(args):
+    from vault import PasswordManager
+
+    for count in args.sizes:
+        with scratch_dir() as directory:
+            path = os.path.join(directory, f"vault-{count}.ini")
+            manager = PasswordManager(path)
+            manager.add_many(synthetic_accounts(count))
+            manager.enable_encryption("benchmark master password")
+            manager.storage.close()
+
+            start = time.perf_counter()
+            manager = PasswordManager(path, master_password="benchmark master password")
+            opened = time.perf_counter() - start
+
+            start = time.perf_counter()
+            manager.PASSWORDS[f"account-{count // 2:07d}"]
+            first_read = time.perf_counter() - start
+
+            edits = 100
+            start = time.perf_counter()
+            for account, password in synthetic_accounts(edits):
+                manager.edit_password(account, password + "!")
+            per_save = (time.perf_counter() - start) / edits
+
+            start = time.perf_counter()
+            manager.save_passwords()
+            full_save = time.perf_counter() - start
+            manager.storage.close()
+
+        print(f"{count:>7} entries: open + unlock {opened * 1000:8.1f} ms, "
+              f"decrypt one {first_read * 1e6:6.0f} us, "
+              f"edit_password {per_save * 1000:6.2f} ms, "
+              f"full save {full_save * 1000:8.1f} ms")
+
+
+def bench_startup(args):
+    from storage import IniStorage, JournalStorage
+    from vault import PasswordManager
+
+    # Long values make the difference between vault size and name count show.
+    padding = "x" * args.value_size
+    for count in args.sizes:
+        with scratch_dir() as directory:
+            path = os.path.join(directory, f"vault-{count}.ini")
+            manager = PasswordManager(path, storage=JournalStorage(path))
+            manager.add_many(
+                (account, password + padding)
+                for account, password in synthetic_accounts(count)
+            )
+            manager.save_passwords()
+            manager.close()
+            size = os.path.getsize(path)
+
+            tracemalloc.start()
+            start = time.perf_counter()
+            manager = PasswordManager(path, storage=JournalStorage(path))
+            lazy = time.perf_counter() - start
+            lazy_memory = tracemalloc.get_traced_memory()[0]
+            tracemalloc.stop()
+            manager.close()
+
+            # The full parse, as before the index existed
+            tracemalloc.start()
+            start = time.perf_counter()
+            storage = IniStorage(path)
+            os.unlink(storage.index_path)
+            storage.load()
+            eager = time.perf_counter() - start
+            eager_memory = tracemalloc.get_traced_memory()[0]
+            tracemalloc.stop()
+
+        print(f"{count:>7} entries ({size / 1e6:6.1f} MB): "
+              f"indexed load {lazy * 1000:7.1f} ms / {lazy_memory / 1e6:6.1f} MB, "
+              f"full parse {eager * 1000:7.1f} ms / {eager_memory / 1e6:6.1f} MB")
+
+
+def bench_format(args):
+    from storage import BinaryStorage, IniStorage
+
+    passwords = dict(synthetic_accounts(args.count))
+    lookups = random.Random(3).sample(sorted(passwords), 1000)
+    print(f"{args.count} entries     serialize       parse        open  1000 lookups     size")
+    with scratch_dir() as directory:
+        for label, storage in (
+            ("INI", IniStorage(os.path.join(directory, "vault.ini"))),
+            ("binary", BinaryStorage(os.path.join(directory, "vault.vault"))),
+        ):
+            start = time.perf_counter()
+            storage.save(passwords)
+            serialize = time.perf_counter() - start
+
+            # Everything, values included, the way a load used to work
+            if label == "INI":
+                os.unlink(storage.index_path)
+            start = time.perf_counter()
+            records = storage.load()
+            for _ in records.items():
+                pass
+            parse = time.perf_counter() - start
+            records.close()
+            if label == "INI":
+                storage.save(passwords)  # Puts the index back
+
+            start = time.perf_counter()
+            records = storage.load()
+            opened = time.perf_counter() - start
+            start = time.perf_counter()
+            for account in lookups:
+                records[account]
+            looked_up = time.perf_counter() - start
+            records.close()
+
+            print(f"{label:<13} {serialize * 1000:>9.1f} ms {parse * 1000:>8.1f} ms "
+                  f"{opened * 1000:>8.1f} ms {looked_up * 1000:>10.1f} ms "
+                  f"{os.path.getsize(storage.path) / 1e6:>6.1f} MB")
+
+
+def _stress_worker(path, worker, operations, compact_every):
+    from storage import BinaryStorage, JournalStorage
+    from vault import PasswordManager
+
+    storage = JournalStorage(path, snapshot=BinaryStorage(path), compact_every=compact_every)
+    manager = PasswordManager(path, storage=storage)
+    for i in range(operations):
+        # Each worker adds its own accounts and later edits them, while the
+        # others do the same to the shared vault.
+        account = f"w{worker}-{i % (operations // 2)}"
+        if i < operations // 2:
+            manager.add_password(account, f"{worker}:{i}:v1")
+        else:
+            manager.edit_password(account, f"{worker}:{i}:v2")
+    manager.close()
+
+
+def bench_stress(args):
+    import multiprocessing
+
+    from vault import PasswordManager
+
+    with scratch_dir() as directory:
+        path = os.path.join(directory, "shared.vault")
+        start = time.perf_counter()
+        workers = [
+            multiprocessing.Process(
+                target=_stress_worker,
+                args=(path, worker, args.operations, args.compact_every),
+            )
+            for worker in range(args.processes)
+        ]
+        for process in workers:
+            process.start()
+        for process in workers:
+            process.join()
+        elapsed = time.perf_counter() - start
+
+        manager = PasswordManager(path)
+        half = args.operations // 2
+        lost = [
+            f"w{worker}-{i}"
+            for worker in range(args.processes)
+            for i in range(half)
+            if manager.PASSWORDS.get(f"w{worker}-{i}") != f"{worker}:{half + i}:v2"
+        ]
+        manager.close()
+
+    total = args.processes * args.operations
+    report(f"{args.processes} processes x {args.operations} writes", elapsed, total)
+    if lost or any(process.exitcode for process in workers):
+        print(f"FAILED: {len(lost)} updates lost, e.g. {lost[:5]}")
+        raise SystemExit(1)
+    print("no updates lost")
+
+
+def bench_cli(args):
+    import subprocess
+    import sys
+
+    from vault import PasswordManager
+
+    cli = os.path.join(os.path.dirname(os.path.abspath(__file__)), "cli.py")
+    with scratch_dir() as directory:
+        path = os.path.join(directory, "cli.ini")
+        manager = PasswordManager(path)
+        manager.add_many(synthetic_accounts(args.count))
+        manager.save_passwords()
+        manager.close()
+
+        # The CLI has to stay clear of the GUI's imports to start fast
+        loaded = subprocess.run(
+            [sys.executable, "-c",
+             "import sys, cli; print(' '.join(m for m in ('tkinter', 'pyperclip') if m in sys.modules))"],
+            cwd=os.path.dirname(cli), capture_output=True, text=True, check=True,
+        ).stdout.strip()
+        if loaded:
+            print(f"FAILED: importing cli loads {loaded}")
+            raise SystemExit(1)
+
+        for command in (["list"], ["get", "account-0000001"]):
+            samples = []
+            for _ in range(args.runs):
+                start = time.perf_counter()
+                subprocess.run(
+                    [sys.executable, cli, "--vault", path, *command],
+                    stdout=subprocess.DEVNULL, check=True,
+                )
+                samples.append(time.perf_counter() - start)
+            print(f"cli {command[0]:<5} on {args.count} accounts, cold start: "
+                  f"median {percentile(samples, 0.5) * 1000:6.1f} ms, "
+                  f"p99 {percentile(samples, 0.99) * 1000:6.1f} ms")
+
+        start = time.perf_counter()
+        subprocess.run([sys.executable, "-c", "pass"], check=True)
+        print(f"(a bare interpreter starts in {(time.perf_counter() - start) * 1000:.1f} ms)")
+
+
+def bench_import(args):
+    import csv
+
+    import vault_transfer
+    from vault import PasswordManager
+
+    with scratch_dir() as directory:
+        source = os.path.join(directory, "export.csv")
+        with open(source, "w", newline="", encoding="utf-8") as export:
+            writer = csv.writer(export)
+            writer.writerow(["name", "url", "username", "password", "note"])
+            for account, password in synthetic_accounts(args.count):
+                writer.writerow([account, f"https://{account}.example", "user", password, ""])
+        size = os.path.getsize(source)
+
+        manager = PasswordManager(os.path.join(directory, "import.ini"))
+        # A tenth of the file is already in the vault, to exercise the dedupe
+        manager.add_many(
+            (f"{account} (user)", password)
+            for account, password in synthetic_accounts(args.count // 10)
+        )
+        tracemalloc.start()
+        start = time.perf_counter()
+        result = vault_transfer.import_file(manager, source)
+        imported = time.perf_counter() - start
+        import_peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+
+        target = os.path.join(directory, "export-again.csv")
+        tracemalloc.start()
+        start = time.perf_counter()
+        vault_transfer.export_file(manager, target, "chrome")
+        exported = time.perf_counter() - start
+        export_peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+        manager.close()
+
+    print(f"file: {args.count} rows, {size / 1e6:.1f} MB; {result}")
+    report(f"import, peak {import_peak / 1e6:.0f} MB", imported, args.count)
+    report(f"export, peak {export_peak / 1e6:.0f} MB", exported, args.count)
+
+
+def _daemon_process(path, directory):
+    from vault import PasswordManager
+    from vault_daemon import VaultDaemon
+
+    VaultDaemon(PasswordManager(path), directory=directory).run()
+
+
+def _daemon_client(directory, count, requests, seed, results):
+    from vault_client import VaultClient
+
+    rng = random.Random(seed)
+    client = VaultClient(directory)
+    client.ping()  # Connect before the clock starts
+    latencies = []
+    started = time.perf_counter()
+    for _ in range(requests):
+        account = f"account-{rng.randrange(count):07d}"
+        start = time.perf_counter()
+        client.get(account)
+        latencies.append(time.perf_counter() - start)
+    results.put((started, time.perf_counter(), latencies))
+    client.close()
+
+
+def bench_daemon(args):
+    import multiprocessing
+
+    from vault import PasswordManager
+
+    with scratch_dir() as directory:
+        path = os.path.join(directory, "daemon.ini")
+        manager = PasswordManager(path)
+        manager.add_many(synthetic_accounts(args.count))
+        manager.save_passwords()
+        manager.close()
+
+        runtime = os.path.join(directory, "run")
+        daemon = multiprocessing.Process(target=_daemon_process, args=(path, runtime))
+        daemon.start()
+        token_path = os.path.join(runtime, "daemon.token")
+        while not os.path.exists(token_path):
+            if not daemon.is_alive():
+                raise SystemExit("the daemon didn't start")
+            time.sleep(0.01)
+
+        try:
+            for clients in args.clients:
+                results = multiprocessing.Queue()
+                workers = [
+                    multiprocessing.Process(
+                        target=_daemon_client,
+                        args=(runtime, args.count, args.requests, seed, results),
+                    )
+                    for seed in range(clients)
+                ]
+                for process in workers:
+                    process.start()
+                runs = [results.get() for _ in workers]
+                for process in workers:
+                    process.join()
+
+                # perf_counter is the system-wide monotonic clock on Linux,
+                # so the workers' timestamps can be compared
+                elapsed = max(run[1] for run in runs) - min(run[0] for run in runs)
+                latencies = [latency for run in runs for latency in run[2]]
+                print(f"{clients:>4} clients: {len(latencies) / elapsed:>9,.0f} lookups/s, "
+                      f"median {percentile(latencies, 0.5) * 1e6:6.0f} us, "
+                      f"p99 {percentile(latencies, 0.99) * 1e6:6.0f} us")
+        finally:
+            daemon.terminate()
+            daemon.join()
+
+
+def bench_writeback(args):
+    # How long edits keep the caller (the Tk thread, in the GUI) waiting,
+    # with and without the background writer.
+    from vault import PasswordManager
+    from vault_writer import WriteBehindStorage
+
+    with scratch_dir() as directory:
+        for label, background in (("synchronous", False), ("write-behind", True)):
+            manager = PasswordManager(os.path.join(directory, f"{label}.ini"))
+            manager.add_many(synthetic_accounts(args.count))
+            writer = WriteBehindStorage(manager) if background else None
+            if writer is not None:
+                manager.storage = writer
+            latencies = []
+            start = time.perf_counter()
+            for account, password in synthetic_accounts(args.edits):
+                begin = time.perf_counter()
+                manager.edit_password(account, password + "!")
+                latencies.append(time.perf_counter() - begin)
+            returned = time.perf_counter() - start
+            if writer is not None:
+                writer.flush()
+            done = time.perf_counter() - start
+            manager.close()
+            print(f"{label:>12}: {args.edits} edits return in {returned * 1000:7.1f} ms "
+                  f"(p99 {percentile(latencies, 0.99) * 1e6:6.0f} us), "
+                  f"on disk after {done * 1000:7.1f} ms")
+
+
+def bench_audit(args):
+    import hashlib
+    import vault_audit
+
+    rng = random.Random(3)
+    # Every tenth vault password is in the list, and a few are shared
+    vault = {
+        account: password if i % 50 else "shared-password"
+        for i, (account, password) in enumerate(synthetic_accounts(args.count))
+    }
+    hashes = {"%040X" % rng.getrandbits(160) for _ in range(args.breached)}
+    hashes.update(
+        hashlib.sha1(password.encode()).hexdigest().upper()
+        for password in list(vault.values())[::10]
+    )
+    with scratch_dir() as directory:
+        source = os.path.join(directory, "pwned.txt")
+        index_path = os.path.join(directory, "pwned.idx")
+        with open(source, "w") as listing:
+            listing.writelines(f"{digest}:{rng.randint(1, 999)}\n" for digest in sorted(hashes))
+
+        start = time.perf_counter()
+        vault_audit.BreachIndex.build(source, index_path)
+        report(f"index {len(hashes):,} breached hashes", time.perf_counter() - start, len(hashes))
+
+        start = time.perf_counter()
+        with vault_audit.BreachIndex(index_path) as breach_index:
+            result = vault_audit.audit_vault(vault, breach_index)
+        report(f"audit {args.count:,} accounts", time.perf_counter() - start, args.count)
+    print(f"{len(result.weak)} weak, {len(result.reused)} reused groups, "
+          f"{len(result.breached)} breached")
+
+
+# Phases of the suite, in the order they run on each vault
+SUITE_PHASES = ("load", "read_all", "single", "bulk", "save", "ui")
+
+
+def _max_rss():
+    # Peak resident memory of this process so far, in bytes
+    try:
+        import resource
+    except ImportError:  # Windows
+        return None
+    import sys
+
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak if sys.platform == "darwin" else peak * 1024
+
+
+def _ui_available():
+    try:
+        import tkinter
+
+        tkinter.Tk().destroy()
+    except Exception:  # No tkinter, or no display
+        return False
+    return True
+
+
+def _suite_vault(path, count):
+    from storage import BinaryStorage
+
+    BinaryStorage(path).save(dict(synthetic_accounts(count)))
+
+
+def _suite_child(path, count, ui, trace, results):
+    # One vault per process, so every size starts from the same baseline
+    # and the peak memory is its own.
+    from vault import PasswordManager
+
+    phases = {}
+
+    @contextmanager
+    def phase(name, operations=1):
+        if trace:
+            tracemalloc.reset_peak()
+        start = time.perf_counter()
+        yield
+        elapsed = time.perf_counter() - start
+        phases[name] = {
+            "seconds": elapsed,
+            "per_operation": elapsed / operations,
+            "operations": operations,
+            "peak_rss": _max_rss(),
+        }
+        if trace:
+            phases[name]["peak_traced"] = tracemalloc.get_traced_memory()[1]
+
+    if trace:
+        tracemalloc.start()
+    with phase("load"):
+        manager = PasswordManager(path)
+    passwords = manager.PASSWORDS
+    with phase("read_all", count):
+        for account in passwords:
+            passwords[account]
+    accounts = random.Random(4).sample(range(count), min(count, 10000))
+    # Each one a transaction of its own, journaled and fsync'd
+    singles = accounts[:100]
+    with phase("single", len(singles)):
+        for i in singles:
+            manager.edit_password(f"account-{i:07d}", "single-edit")
+    with phase("bulk", len(accounts)):
+        manager.update_many((f"account-{i:07d}", "bulk-edit") for i in accounts)
+    with phase("save"):
+        manager.save_passwords()
+    if ui:
+        # Building the window and drawing it once, listbox included
+        from password_manager import PasswordManagerGUI
+
+        with phase("ui"):
+            gui = PasswordManagerGUI(manager)
+            gui.root.update()
+        gui.on_closing()
+    else:
+        manager.close()
+    results.put(phases)
+
+
+def _compare(results, baseline, threshold, out):
+    # Slower than the baseline by more than `threshold` is a regression
+    previous = {entry["entries"]: entry["phases"] for entry in baseline["sizes"]}
+    regressions = []
+    print(f"\ncompared with {baseline.get('started', 'the baseline')}:", file=out)
+    for entry in results["sizes"]:
+        old_phases = previous.get(entry["entries"])
+        if old_phases is None:
+            continue
+        for name, measured in entry["phases"].items():
+            old = old_phases.get(name)
+            if old is None or not old["seconds"]:
+                continue
+            ratio = measured["seconds"] / old["seconds"]
+            flag = ""
+            if ratio > 1 + threshold:
+                flag = "  REGRESSION"
+                regressions.append((entry["entries"], name))
+            print(f"{entry['entries']:>9,} {name:<9} {ratio:6.2f}x{flag}", file=out)
+    return regressions
+
+
+def bench_suite(args):
+    import json
+    import multiprocessing
+    import platform
+    import sys
+
+    # With the JSON on stdout, the table goes to stderr
+    out = sys.stderr if args.json == "-" else sys.stdout
+    ui = not args.no_ui and _ui_available()
+    results = {
+        "started": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "ui": ui,
+        "tracemalloc": args.tracemalloc,
+        "sizes": [],
+    }
+    if not ui:
+        print("no display: the ui phase is skipped (run under xvfb-run to include it)", file=out)
+    print(f"{'entries':>9} " + " ".join(f"{name:>10}" for name in SUITE_PHASES) + "   peak RSS", file=out)
+    context = multiprocessing.get_context("spawn")
+    for count in args.sizes:
+        with scratch_dir() as directory:
+            path = os.path.join(directory, f"vault-{count}.vault")
+            # Made in a process of its own too: Linux carries the peak RSS
+            # over to the children, so this one has to stay small
+            maker = context.Process(target=_suite_vault, args=(path, count))
+            maker.start()
+            maker.join()
+            queue = context.Queue()
+            child = context.Process(
+                target=_suite_child, args=(path, count, ui, args.tracemalloc, queue)
+            )
+            child.start()
+            phases = queue.get()
+            child.join()
+        results["sizes"].append({"entries": count, "phases": phases})
+        # Whole phases in ms, except single edits: ms per edit
+        cells = [
+            f"{phases[name]['per_operation' if name == 'single' else 'seconds'] * 1000:>10.1f}"
+            if name in phases else f"{'-':>10}"
+            for name in SUITE_PHASES
+        ]
+        peak = max(phase["peak_rss"] or 0 for phase in phases.values())
+        print(f"{count:>9,} " + " ".join(cells) + f" {peak / 1e6:>8.1f} MB", file=out)
+    print("(ms; single is per edit)", file=out)
+
+    if args.json:
+        output = json.dumps(results, indent=2)
+        if args.json == "-":
+            print(output)
+        else:
+            with open(args.json, "w") as target:
+                target.write(output + "\n")
+    if args.compare:
+        with open(args.compare) as source:
+            baseline = json.load(source)
+        if _compare(results, baseline, args.threshold, out):
+            sys.exit(1)
+
+
+def bench_switch(args):
+    # What the pool saves when switching between encrypted vaults: the
+    # load and the key derivation of a cold open
+    from vault import PasswordManager
+    from vault_pool import VaultPool
+
+    with scratch_dir() as directory:
+        paths = [os.path.join(directory, f"{name}.vault") for name in ("team", "personal")]
+        for path in paths:
+            manager = PasswordManager(path)
+            manager.add_many(synthetic_accounts(args.count))
+            manager.enable_encryption("master")
+            manager.close()
+
+        samples = []
+        for i in range(args.switches):
+            start = time.perf_counter()
+            manager = PasswordManager(paths[i % 2], master_password="master")
+            manager.PASSWORDS["account-0000001"]
+            samples.append(time.perf_counter() - start)
+            manager.close()
+        print(f"cold open + unlock: median {percentile(samples, 0.5) * 1000:8.2f} ms")
+
+        pool = VaultPool()
+        for path in paths:
+            pool.open(path).unlock("master")
+        samples = []
+        for i in range(args.switches):
+            start = time.perf_counter()
+            manager = pool.open(paths[i % 2])
+            pool.use(manager)
+            manager.PASSWORDS["account-0000001"]
+            samples.append(time.perf_counter() - start)
+        pool.close()
+        print(f"switch via the pool: median {percentile(samples, 0.5) * 1000:8.2f} ms")
+
+
+def bench_idle(args):
+    # Needs a display (run under xvfb-run on headless machines). Fails, with
+    # exit status 1, if an idle window runs any Tk timer at all or uses more
+    # than --max-cpu of a core.
+    import sys
+    import tkinter
+
+    if not _ui_available():
+        print("no display: run under xvfb-run", file=sys.stderr)
+        sys.exit(2)
+    from password_manager import PasswordManager, PasswordManagerGUI
+
+    # Every timer the app starts, whichever part of it starts it
+    fired = []
+    after = tkinter.Misc.after
+
+    def counting_after(widget, ms, func=None, *args):
+        if func is None:
+            return after(widget, ms)
+
+        def timer(*args):
+            fired.append((time.perf_counter(), getattr(func, "__name__", repr(func))))
+            return func(*args)
+
+        return after(widget, ms, timer, *args)
+
+    tkinter.Misc.after = counting_after
+    try:
+        with scratch_dir() as directory:
+            manager = PasswordManager(os.path.join(directory, "idle.ini"))
+            manager.add_many(synthetic_accounts(100))
+            gui = PasswordManagerGUI(manager)
+            # Let startup and the re-checks it triggers settle first. These
+            # two timers are ours, so they go around the counting.
+            after(gui.root, args.settle * 1000, gui.root.quit)
+            gui.root.mainloop()
+
+            settled = len(fired)
+            cpu = time.process_time()
+            after(gui.root, args.seconds * 1000, gui.root.quit)
+            gui.root.mainloop()
+            cpu = time.process_time() - cpu
+            pending = gui.root.tk.splitlist(gui.root.tk.call("after", "info"))
+            gui.on_closing()
+    finally:
+        tkinter.Misc.after = after
+
+    idle = fired[settled:]
+    print(f"idle for {args.seconds} s: {len(idle)} timers fired, "
+          f"{len(pending)} pending, {cpu * 1000:.1f} ms CPU ({cpu / args.seconds:.2%} of a core)")
+    for name, count in collections.Counter(name for _, name in idle).most_common():
+        print(f"  {name}: {count}")
+    if idle or pending or cpu > args.max_cpu * args.seconds:
+        print("FAIL: the idle window should sleep until something happens")
+        sys.exit(1)
+    print("ok")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    scenarios = parser.add_subparsers(dest="scenario", required=True)
+
+    transaction = scenarios.add_parser(
+        "transaction", help="single add_password() calls vs one add_many() commit"
+    )
+    transaction.add_argument("--count", type=int, default=10000)
+    transaction.set_defaults(func=bench_transaction)
+
+    search = scenarios.add_parser(
+        "search", help="type-ahead latency of the account search index"
+    )
+    search.add_argument("--count", type=int, default=100000)
+    search.add_argument("--queries", type=int, default=500)
+    search.add_argument("--page", type=int, default=60, help="results shown per keystroke")
+    search.set_defaults(func=bench_search)
+
+    encryption = scenarios.add_parser(
+        "encryption", help="open and save cost of encrypted vaults"
+    )
+    encryption.add_argument(
+        "--sizes", type=int, nargs="+", default=[1000, 10000, 100000]
+    )
+    encryption.set_defaults(func=bench_encryption)
+
+    startup = scenarios.add_parser(
+        "startup", help="indexed lazy load vs full INI parse"
+    )
+    startup.add_argument("--sizes", type=int, nargs="+", default=[1000, 10000, 100000])
+    startup.add_argument("--value-size", type=int, default=200)
+    startup.set_defaults(func=bench_startup)
+
+    format_ = scenarios.add_parser(
+        "format", help="serialize, parse and lookup cost of the INI and binary formats"
+    )
+    format_.add_argument("--count", type=int, default=100000)
+    format_.set_defaults(func=bench_format)
+
+    stress = scenarios.add_parser(
+        "stress", help="several processes writing one vault; checks nothing is lost"
+    )
+    stress.add_argument("--processes", type=int, default=4)
+    stress.add_argument("--operations", type=int, default=400)
+    stress.add_argument("--compact-every", type=int, default=50)
+    stress.set_defaults(func=bench_stress)
+
+    cli = scenarios.add_parser(
+        "cli", help="cold-start time of the command line tool"
+    )
+    cli.add_argument("--count", type=int, default=10000)
+    cli.add_argument("--runs", type=int, default=50)
+    cli.set_defaults(func=bench_cli)
+
+    import_ = scenarios.add_parser(
+        "import", help="streaming import and export of a browser CSV export"
+    )
+    import_.add_argument("--count", type=int, default=1000000)
+    import_.set_defaults(func=bench_import)
+
+    daemon = scenarios.add_parser(
+        "daemon", help="lookup throughput and latency of the daemon under concurrent clients"
+    )
+    daemon.add_argument("--count", type=int, default=10000)
+    daemon.add_argument("--clients", type=int, nargs="+", default=[1, 4, 16, 64])
+    daemon.add_argument("--requests", type=int, default=2000, help="lookups per client")
+    daemon.set_defaults(func=bench_daemon)
+
+    writeback = scenarios.add_parser(
+        "writeback", help="time edits keep the caller waiting, synchronous vs background writes"
+    )
+    writeback.add_argument("--count", type=int, default=10000)
+    writeback.add_argument("--edits", type=int, default=2000)
+    writeback.set_defaults(func=bench_writeback)
+
+    audit = scenarios.add_parser(
+        "audit", help="building the breach index and auditing a vault against it"
+    )
+    audit.add_argument("--count", type=int, default=100000)
+    audit.add_argument("--breached", type=int, default=2000000, help="hashes in the breach list")
+    audit.set_defaults(func=bench_audit)
+
+    suite = scenarios.add_parser(
+        "suite",
+        help="load, save, edits, bulk edits and window build time plus peak memory, "
+        "from 100 to 1M entries",
+    )
+    suite.add_argument(
+        "--sizes", type=int, nargs="+", default=[100, 1000, 10000, 100000, 1000000]
+    )
+    suite.add_argument("--json", metavar="FILE", help="write the results as JSON ('-': stdout)")
+    suite.add_argument(
+        "--compare", metavar="FILE", help="compare with an earlier --json run; exit 1 on regressions"
+    )
+    suite.add_argument(
+        "--threshold", type=float, default=0.2, help="slowdown that counts as a regression (0.2: 20%%)"
+    )
+    suite.add_argument("--no-ui", action="store_true", help="only the vault core, never Tk")
+    suite.add_argument(
+        "--tracemalloc",
+        action="store_true",
+        help="also record each phase's peak Python allocations (slows every phase down)",
+    )
+    suite.set_defaults(func=bench_suite)
+
+    switch = scenarios.add_parser(
+        "switch", help="switching between two encrypted vaults, cold vs kept open in a VaultPool"
+    )
+    switch.add_argument("--count", type=int, default=10000)
+    switch.add_argument("--switches", type=int, default=20)
+    switch.set_defaults(func=bench_switch)
+
+    idle = scenarios.add_parser(
+        "idle", help="checks an idle main window runs no timers and uses next to no CPU"
+    )
+    idle.add_argument("--seconds", type=int, default=10)
+    idle.add_argument("--settle", type=int, default=5)
+    idle.add_argument(
+        "--max-cpu", type=float, default=0.01, help="share of a core it may use (0.01: 1%%)"
+    )
+    idle.set_defaults(func=bench_idle)
+
+    args = parser.parse_args(argv)
+    args.func(args)
+
+
+if __name__ == "__main__":
+    main()
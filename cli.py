@@ -0,0 +1,485 @@
+"""Command line access to the password vault, for scripts and CI jobs.
+
+Run `python cli.py <command> [options]`; `--help` lists the commands.
+This never imports tkinter or pyperclip, so it starts in a few tens of
+milliseconds; `--timing` prints where that time went to stderr.
+
+`get` and `list` are answered by the vault daemon (`cli.py daemon`) when one
+is running for the same vault, which skips opening the vault altogether.
+
+Passwords are read from stdin (or prompted for on a terminal) rather than
+taken as arguments, so they don't end up in `ps` output or shell history.
+The master password of an encrypted vault comes from the
+EASYPASS_MASTER_PASSWORD environment variable, or is prompted for; `encrypt`
+turns a plaintext vault into an encrypted one.
+"""
+import time
+
+_STARTED = time.perf_counter()
+
+import argparse
+import os
+import sys
+
+import metrics
+from storage import VaultConflictError, VaultFormatError
+from vault import PasswordManager
+from vault_client import DaemonError, DaemonUnavailableError, VaultClient
+from vault_crypto import VaultLockedError, WrongMasterPasswordError
+
+MASTER_PASSWORD_VARIABLE = "EASYPASS_MASTER_PASSWORD"
+BREACH_INDEX_VARIABLE = "EASYPASS_BREACH_INDEX"
+
+
+class CommandError(Exception):
+    pass
+
+
+def read_secret(prompt):
+    if sys.stdin.isatty():
+        import getpass
+
+        return getpass.getpass(prompt)
+    line = sys.stdin.readline()
+    if not line:
+        raise CommandError("expected a password on stdin")
+    return line.rstrip("\r\n")
+
+
+def read_master_password():
+    master_password = os.environ.get(MASTER_PASSWORD_VARIABLE)
+    if master_password is None:
+        master_password = read_secret("Master password: ")
+    return master_password
+
+
+def read_new_master_password():
+    # Asked twice on a terminal, as a typo would lock the vault for good
+    master_password = os.environ.get(MASTER_PASSWORD_VARIABLE)
+    if master_password is None:
+        master_password = read_secret("New master password: ")
+        if sys.stdin.isatty() and read_secret("Repeat it: ") != master_password:
+            raise CommandError("the passwords don't match")
+    if not master_password:
+        raise CommandError("the master password can't be empty")
+    return master_password
+
+
+def unlock(manager):
+    # Only commands that read or write values pay for the key derivation.
+    if manager.locked:
+        try:
+            manager.unlock(read_master_password())
+        except WrongMasterPasswordError as error:
+            raise CommandError(str(error)) from None
+
+
+def require_account(manager, account):
+    if account not in manager.PASSWORDS:
+        raise CommandError(f"no such account: {account}")
+
+
+def cmd_list(manager, args):
+    accounts = manager.PASSWORDS
+    if args.query:
+        # One search doesn't pay for building the index; the daemon keeps one
+        from search_index import scan
+
+        accounts = scan(accounts, args.query)
+    sys.stdout.writelines(account + "\n" for account in accounts)
+
+
+def output_password(args, password):
+    if not args.copy:
+        print(password)
+        return
+    # Stays running until the clipboard is cleared; Ctrl-C clears it early
+    from clipboard import ClipboardError, ClipboardManager, SystemClipboard
+
+    clipboard = ClipboardManager(SystemClipboard(), clear_after=0)
+    try:
+        clipboard.copy(password)
+        if args.clear_after:
+            print(f"Copied {args.account}, clearing in {args.clear_after:g} s", file=sys.stderr)
+            try:
+                time.sleep(args.clear_after)
+            except KeyboardInterrupt:
+                pass
+            clipboard.clear()
+    except ClipboardError as error:
+        raise CommandError(f"clipboard: {error}") from None
+
+
+def cmd_get(manager, args):
+    require_account(manager, args.account)
+    unlock(manager)
+    output_password(args, manager.PASSWORDS[args.account])
+
+
+def new_password(args, prompt):
+    # With --generate the password is printed, so the caller can use it
+    if not args.generate:
+        return read_secret(prompt)
+    import password_generator
+
+    try:
+        if args.passphrase:
+            words = args.words or password_generator.DEFAULT_WORDS
+            password = password_generator.generate_passphrase(words)
+            bits = password_generator.passphrase_entropy(words)
+        else:
+            length = args.length or password_generator.DEFAULT_LENGTH
+            classes = args.classes.split(",") if args.classes else tuple(password_generator.CLASSES)
+            unknown = [name for name in classes if name not in password_generator.CLASSES]
+            if unknown:
+                raise ValueError(
+                    f"unknown character class: {', '.join(unknown)} "
+                    f"(pick from {','.join(password_generator.CLASSES)})"
+                )
+            password = password_generator.generate_password(length, classes)
+            bits = password_generator.password_entropy(length, classes)
+    except ValueError as error:
+        raise CommandError(str(error)) from None
+    print(password)
+    print(f"{bits:.0f} bits of entropy", file=sys.stderr)
+    return password
+
+
+def cmd_add(manager, args):
+    if args.account in manager.PASSWORDS:
+        raise CommandError(f"account already exists: {args.account} (use edit)")
+    unlock(manager)
+    manager.add_password(args.account, new_password(args, "Password: "))
+
+
+def cmd_edit(manager, args):
+    require_account(manager, args.account)
+    if args.rename is not None and args.rename in manager.PASSWORDS:
+        raise CommandError(f"account already exists: {args.rename}")
+    unlock(manager)
+    if args.keep_password:
+        password = manager.PASSWORDS[args.account]
+    else:
+        password = new_password(args, "New password: ")
+    if args.rename is not None and args.rename != args.account:
+        manager.rename_password(args.account, args.rename, password)
+    else:
+        manager.edit_password(args.account, password)
+
+
+def cmd_delete(manager, args):
+    missing = [account for account in args.accounts if account not in manager.PASSWORDS]
+    if missing and not args.force:
+        raise CommandError(f"no such account: {', '.join(missing)}")
+    manager.delete_many(args.accounts)
+
+
+def cmd_encrypt(manager, args):
+    if manager.encrypted:
+        raise CommandError("the vault is already encrypted")
+    manager.enable_encryption(read_new_master_password())
+    print(f"Encrypted {len(manager.PASSWORDS)} passwords", file=sys.stderr)
+
+
+def cmd_daemon(manager, args):
+    from vault_daemon import VaultDaemon
+
+    # Unlocked now if possible; otherwise the first client to need a value
+    # sends the master password.
+    if manager.locked and (MASTER_PASSWORD_VARIABLE in os.environ or sys.stdin.isatty()):
+        unlock(manager)
+    try:
+        VaultDaemon(manager, idle_lock=args.idle_lock).run()
+    except (OSError, RuntimeError, DaemonError) as error:
+        raise CommandError(str(error)) from None
+
+
+def daemon_command(args):
+    """Run `get` or `list` through the daemon; False if it can't serve them."""
+    try:
+        client = VaultClient()
+    except DaemonUnavailableError:  # Not on this platform
+        return False
+    try:
+        if client.ping()["vault"] != os.path.abspath(args.vault):
+            return False
+        if args.command == "get":
+            try:
+                password = client.get(args.account)
+            except VaultLockedError:
+                try:
+                    client.unlock(read_master_password())
+                except WrongMasterPasswordError as error:
+                    raise CommandError(str(error)) from None
+                password = client.get(args.account)
+            output_password(args, password)
+        else:
+            accounts = client.search(args.query) if args.query else client.list()
+            sys.stdout.writelines(account + "\n" for account in accounts)
+        return True
+    except DaemonUnavailableError:
+        return False
+    except KeyError:
+        raise CommandError(f"no such account: {args.account}") from None
+    except DaemonError as error:
+        raise CommandError(f"daemon: {error}") from None
+    finally:
+        client.close()
+
+
+def show_progress(rows, fraction):
+    # Only on a terminal; a log file doesn't want carriage returns
+    if sys.stderr.isatty():
+        done = f" ({fraction:.0%})" if fraction is not None else ""
+        print(f"\r{rows:,} rows{done}", end="", file=sys.stderr, flush=True)
+
+
+def cmd_import(manager, args):
+    import vault_transfer
+
+    unlock(manager)
+    try:
+        # One transaction: all of the file or nothing
+        result = vault_transfer.import_file(
+            manager, args.file, overwrite=args.overwrite, progress=show_progress
+        )
+    except (OSError, vault_transfer.ImportFormatError) as error:
+        raise CommandError(f"{args.file}: {error}") from None
+    finally:
+        if sys.stderr.isatty():
+            print(file=sys.stderr)
+    print(f"imported {result}", file=sys.stderr)
+
+
+def cmd_export(manager, args):
+    import vault_transfer
+
+    unlock(manager)
+    try:
+        vault_transfer.export_file(manager, args.file, args.format, progress=show_progress)
+    except OSError as error:
+        raise CommandError(f"{args.file}: {error}") from None
+    finally:
+        if sys.stderr.isatty():
+            print(file=sys.stderr)
+
+
+def cmd_audit(manager, args):
+    import vault_audit
+
+    unlock(manager)
+    path = args.breached or os.environ.get(BREACH_INDEX_VARIABLE)
+    try:
+        breach_index = vault_audit.BreachIndex(path) if path else None
+    except (OSError, vault_audit.BreachListError) as error:
+        raise CommandError(str(error)) from None
+    try:
+        report = vault_audit.audit_vault(manager.PASSWORDS, breach_index)
+    finally:
+        if breach_index is not None:
+            breach_index.close()
+    print(report)
+
+
+def cmd_breach_index(args):
+    import vault_audit
+
+    def progress(lines):
+        if sys.stderr.isatty():
+            print(f"\r{lines:,} lines", end="", file=sys.stderr, flush=True)
+
+    try:
+        count = vault_audit.BreachIndex.build(args.source, args.target, progress)
+    except (OSError, vault_audit.BreachListError) as error:
+        raise CommandError(str(error)) from None
+    finally:
+        if sys.stderr.isatty():
+            print(file=sys.stderr)
+    print(f"{count:,} hashes indexed in {args.target}", file=sys.stderr)
+
+
+def add_generate_arguments(parser):
+    parser.add_argument(
+        "--generate", action="store_true", help="make up a random password and print it"
+    )
+    parser.add_argument("--length", type=int, help="characters to generate (default: 20)")
+    parser.add_argument(
+        "--classes",
+        metavar="LIST",
+        help="character classes to use, comma-separated (default: lower,upper,digits,symbols)",
+    )
+    parser.add_argument(
+        "--passphrase", action="store_true", help="generate pronounceable words instead"
+    )
+    parser.add_argument("--words", type=int, help="words in a passphrase (default: 5)")
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument(
+        "--vault",
+        default=os.environ.get("EASYPASS_VAULT", "config.ini"),
+        help="vault file (default: $EASYPASS_VAULT or config.ini)",
+    )
+    parser.add_argument(
+        "--timing", action="store_true", help="print startup and command time to stderr"
+    )
+    parser.add_argument(
+        "--no-daemon", action="store_true", help="open the vault even if a daemon is running"
+    )
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    list_ = commands.add_parser("list", help="print account names, optionally matching a search")
+    list_.add_argument("query", nargs="?")
+    list_.set_defaults(func=cmd_list)
+
+    get = commands.add_parser("get", help="print the password of an account")
+    get.add_argument("account")
+    get.add_argument(
+        "--copy", action="store_true", help="put it on the clipboard instead of printing it"
+    )
+    get.add_argument(
+        "--clear-after",
+        type=float,
+        default=None,
+        metavar="SECONDS",
+        help="with --copy: clear the clipboard after this long (default: "
+        "$EASYPASS_CLIPBOARD_CLEAR or 30; 0: never)",
+    )
+    get.set_defaults(func=cmd_get)
+
+    add = commands.add_parser("add", help="add an account; the password is read from stdin")
+    add.add_argument("account")
+    add_generate_arguments(add)
+    add.set_defaults(func=cmd_add)
+
+    edit = commands.add_parser("edit", help="change the password of an account, or rename it")
+    edit.add_argument("account")
+    edit.add_argument("--rename", metavar="NEW_ACCOUNT")
+    edit.add_argument(
+        "--keep-password", action="store_true", help="only rename, don't read a new password"
+    )
+    add_generate_arguments(edit)
+    edit.set_defaults(func=cmd_edit)
+
+    delete = commands.add_parser("delete", help="delete one or more accounts")
+    delete.add_argument("accounts", nargs="+", metavar="account")
+    delete.add_argument("--force", action="store_true", help="ignore accounts that don't exist")
+    delete.set_defaults(func=cmd_delete)
+
+    import_ = commands.add_parser(
+        "import",
+        help="add accounts from a CSV file ('-' for stdin): ours, or a browser, Bitwarden, "
+        "LastPass, KeePass or 1Password export",
+    )
+    import_.add_argument("file")
+    import_.add_argument(
+        "--overwrite", action="store_true", help="replace the passwords of existing accounts"
+    )
+    import_.set_defaults(func=cmd_import)
+
+    export = commands.add_parser("export", help="write every account to a CSV file ('-' for stdout)")
+    export.add_argument("file")
+    export.add_argument("--format", choices=("csv", "chrome", "bitwarden"), default="csv")
+    export.set_defaults(func=cmd_export)
+
+    audit = commands.add_parser(
+        "audit", help="list weak, reused and breached passwords"
+    )
+    audit.add_argument(
+        "--breached",
+        metavar="INDEX",
+        help=f"breach index made by breach-index (default: ${BREACH_INDEX_VARIABLE})",
+    )
+    audit.set_defaults(func=cmd_audit)
+
+    breach_index = commands.add_parser(
+        "breach-index",
+        help="convert a Pwned Passwords SHA-1 list (ordered by hash) for audit --breached",
+    )
+    breach_index.add_argument("source")
+    breach_index.add_argument("target")
+    breach_index.set_defaults(func=cmd_breach_index, vault_free=True)
+
+    encrypt = commands.add_parser(
+        "encrypt",
+        help="encrypt the vault under a master password (read like the other passwords, "
+        f"or from ${MASTER_PASSWORD_VARIABLE}); it can't be undone",
+    )
+    encrypt.set_defaults(func=cmd_encrypt)
+
+    daemon = commands.add_parser(
+        "daemon", help="keep the vault open and answer lookups over a local socket"
+    )
+    daemon.add_argument(
+        "--idle-lock",
+        type=float,
+        default=300,
+        metavar="SECONDS",
+        help="lock an encrypted vault after this long without requests (0: never)",
+    )
+    daemon.set_defaults(func=cmd_daemon)
+    return parser
+
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    if args.command == "edit" and args.keep_password and args.rename is None:
+        print("error: --keep-password only makes sense with --rename", file=sys.stderr)
+        return 2
+
+    if args.command == "get" and args.copy and args.clear_after is None:
+        from clipboard import configured_clear_after
+
+        args.clear_after = configured_clear_after()
+
+    metrics.configure_from_environment()
+    started = opened = time.perf_counter()
+    manager = None
+    try:
+        served = args.command in ("get", "list") and not args.no_daemon and daemon_command(args)
+        if getattr(args, "vault_free", False):
+            args.func(args)
+        elif not served:
+            manager = PasswordManager(args.vault)
+            opened = time.perf_counter()
+            if getattr(manager.storage, "migrated", False):
+                print(
+                    f"note: copied the vault in {manager.storage.ini_path} to "
+                    f"{manager.storage.path}, which is used from now on. The old file is "
+                    "left as it was, passwords included; delete it once you don't need it",
+                    file=sys.stderr,
+                )
+            for path in getattr(manager.storage, "stale_files", ()):
+                print(
+                    f"warning: {path} was written after the vault moved to "
+                    f"{manager.storage.path}; its changes are not in the vault",
+                    file=sys.stderr,
+                )
+            with metrics.span(f"cli.{args.command}"):
+                args.func(manager, args)
+            error = getattr(manager.storage, "compaction_error", None)
+            if error is not None:
+                # Saved, but the journal couldn't be folded into the vault
+                print(f"warning: could not compact the vault: {error}", file=sys.stderr)
+    except (CommandError, VaultConflictError, VaultFormatError) as error:
+        print(f"error: {error}", file=sys.stderr)
+        return 1
+    finally:
+        if manager is not None:
+            manager.close()
+        metrics.disable()
+        if args.timing:
+            done = time.perf_counter()
+            print(
+                f"startup {(started - _STARTED) * 1000:.1f} ms, "
+                f"open {(opened - started) * 1000:.1f} ms"
+                f"{' (daemon)' if manager is None else ''}, "
+                f"{args.command} {(done - opened) * 1000:.1f} ms",
+                file=sys.stderr,
+            )
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,135 @@
+"""Copying passwords to the clipboard, and taking them off it again.
+
+A copied password is cleared after `clear_after` seconds, but only if the
+clipboard still holds it: whatever the user copied since is left alone.
+What was on the clipboard before our first copy is put back then, so
+copying a password doesn't cost the user their own clipboard.
+"""
+import os
+import threading
+
+import metrics
+
+# Seconds a copied password stays on the clipboard; 0 keeps it there
+CLEAR_AFTER = 30
+CLEAR_AFTER_VARIABLE = "EASYPASS_CLIPBOARD_CLEAR"
+
+
+def configured_clear_after():
+    try:
+        return max(0.0, float(os.environ[CLEAR_AFTER_VARIABLE]))
+    except (KeyError, ValueError):
+        return CLEAR_AFTER
+
+
+class ClipboardError(Exception):
+    pass
+
+
+class TkClipboard:
+    """The clipboard of a Tk application. On X11 it empties when the app exits."""
+
+    def __init__(self, root):
+        self.root = root
+
+    def paste(self):
+        import tkinter
+
+        try:
+            return self.root.clipboard_get()
+        except tkinter.TclError:  # Empty, or not text
+            return None
+
+    def copy(self, text):
+        self.root.clipboard_clear()
+        self.root.clipboard_append(text)
+
+    def clear(self):
+        self.root.clipboard_clear()
+
+
+class SystemClipboard:
+    """The desktop clipboard through pyperclip, for programs without a window."""
+
+    def __init__(self):
+        # Imported here: it probes for xclip/xsel/wl-copy and such on import
+        import pyperclip
+
+        self._pyperclip = pyperclip
+
+    def paste(self):
+        try:
+            return self._pyperclip.paste() or None
+        except self._pyperclip.PyperclipException:
+            return None
+
+    def copy(self, text):
+        try:
+            self._pyperclip.copy(text)
+        except self._pyperclip.PyperclipException as error:
+            # No clipboard tool installed, or no desktop session
+            raise ClipboardError(str(error)) from None
+
+    def clear(self):
+        self.copy("")
+
+
+def _timer(seconds, callback):
+    timer = threading.Timer(seconds, callback)
+    timer.daemon = True
+    timer.start()
+    return timer
+
+
+class ClipboardManager:
+    """Puts secrets on a clipboard backend and clears them on a timer.
+
+    `schedule(seconds, callback)` starts the timer and returns something
+    `cancel` takes; by default a threading.Timer. The GUI passes root.after
+    wrappers instead so the clearing happens on the Tk thread.
+    """
+
+    def __init__(self, backend, clear_after=CLEAR_AFTER, schedule=None, cancel=None):
+        self.backend = backend
+        self.clear_after = clear_after
+        self._schedule = schedule or _timer
+        self._cancel = cancel or (lambda timer: timer.cancel())
+        self._lock = threading.Lock()
+        self._secret = None    # What we put on the clipboard, while it's there
+        self._previous = None  # What was there before our first copy
+        self._timer = None
+
+    @property
+    def holds_secret(self):
+        return self._secret is not None
+
+    def copy(self, secret):
+        with self._lock:
+            if self._secret is None or self.backend.paste() != self._secret:
+                # Copying again over our own secret keeps the original
+                # contents to restore, not the previous secret.
+                self._previous = self.backend.paste()
+            self.backend.copy(secret)
+            metrics.count("clipboard.copy")
+            self._secret = secret
+            if self._timer is not None:
+                self._cancel(self._timer)
+                self._timer = None
+            if self.clear_after:
+                self._timer = self._schedule(self.clear_after, self.clear)
+
+    def clear(self):
+        """Take our secret off the clipboard now, if it's still there."""
+        with self._lock:
+            if self._timer is not None:
+                self._cancel(self._timer)
+                self._timer = None
+            if self._secret is None:
+                return
+            if self.backend.paste() == self._secret:
+                if self._previous is not None:
+                    self.backend.copy(self._previous)
+                else:
+                    self.backend.clear()
+                metrics.count("clipboard.clear", restored=self._previous is not None)
+            self._secret = self._previous = None
@@ -0,0 +1,106 @@
+import os
+import sys
+import tempfile
+
+
+class InstanceLock:
+    """Makes sure only one copy of the app runs at a time.
+
+    Nothing happens until acquire() is called, so importing this (or the
+    modules that use it) has no side effects. acquire() returns False when
+    another process already holds the lock.
+    """
+
+    def __init__(self, name):
+        self.name = name
+
+    def acquire(self):
+        raise NotImplementedError
+
+    def release(self):
+        raise NotImplementedError
+
+    def __enter__(self):
+        if not self.acquire():
+            raise RuntimeError(f"{self.name} is already running.")
+        return self
+
+    def __exit__(self, *exc_info):
+        self.release()
+
+
+class Win32MutexLock(InstanceLock):
+    """A named mutex in the session's namespace, like the app always used.
+
+    Each logged-in user (fast user switching, remote desktop) gets their own
+    copy of the app; only a second one in the same session is refused.
+    """
+
+    ERROR_ALREADY_EXISTS = 183
+
+    def __init__(self, name):
+        super().__init__(name)
+        self._handle = None
+
+    def acquire(self):
+        import ctypes
+        from ctypes import wintypes
+
+        kernel32 = ctypes.WinDLL("kernel32", use_last_error=True)
+        kernel32.CreateMutexW.argtypes = (wintypes.LPVOID, wintypes.BOOL, wintypes.LPCWSTR)
+        kernel32.CreateMutexW.restype = wintypes.HANDLE
+        kernel32.CloseHandle.argtypes = (wintypes.HANDLE,)
+        self._kernel32 = kernel32
+
+        handle = kernel32.CreateMutexW(None, False, self.name)
+        if not handle:
+            raise ctypes.WinError(ctypes.get_last_error())
+        if ctypes.get_last_error() == self.ERROR_ALREADY_EXISTS:
+            kernel32.CloseHandle(handle)
+            return False
+        self._handle = handle
+        return True
+
+    def release(self):
+        if self._handle is not None:
+            self._kernel32.CloseHandle(self._handle)
+            self._handle = None
+
+
+class FileLock(InstanceLock):
+    """An flock() on a per-user lock file; the kernel drops it if we die."""
+
+    def __init__(self, name, directory=None):
+        super().__init__(name)
+        directory = directory or os.environ.get("XDG_RUNTIME_DIR") or tempfile.gettempdir()
+        self.path = os.path.join(directory, f"{name}-{os.getuid()}.lock")
+        self._fd = None
+
+    def acquire(self):
+        import fcntl
+
+        fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o600)
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            os.close(fd)
+            return False
+        # For whoever wonders which process holds it
+        os.ftruncate(fd, 0)
+        os.write(fd, str(os.getpid()).encode("ascii"))
+        self._fd = fd
+        return True
+
+    def release(self):
+        if self._fd is not None:
+            import fcntl
+
+            fcntl.flock(self._fd, fcntl.LOCK_UN)
+            os.close(self._fd)
+            self._fd = None
+
+
+def instance_lock(name="EurekaPassManager"):
+    if sys.platform == "win32":
+        return Win32MutexLock(name)
+    return FileLock(name)
@@ -0,0 +1,184 @@
+"""Opt-in timings and counters for storage, mutations, the clipboard and the UI.
+
+Nothing is recorded until a sink is added with enable(); until then span()
+returns a shared do-nothing object and count() returns at once, so the
+instrumented code pays for one function call. Set EASYPASS_METRICS to turn
+it on without code changes (see configure_from_environment).
+
+Events are dicts: {"time", "type": "span" | "count", "name", ...} plus
+"seconds" for spans or "value" for counts, and the fields given at the call
+site (vault size, number of changes, "error" if the span raised). Sinks get
+them on whatever thread the work ran, the background writer's included.
+"""
+import os
+import sys
+import threading
+import time
+from collections import deque
+
+METRICS_VARIABLE = "EASYPASS_METRICS"
+
+_sinks = []
+
+
+def enable(*sinks):
+    _sinks.extend(sinks)
+
+
+def disable():
+    for sink in _sinks:
+        sink.close()
+    _sinks.clear()
+
+
+def enabled():
+    return bool(_sinks)
+
+
+def _emit(event):
+    for sink in _sinks:
+        try:
+            sink.write(event)
+        except Exception:  # A broken sink must not break the vault
+            pass
+
+
+class _Span:
+    __slots__ = ("name", "fields", "start")
+
+    def __init__(self, name, fields):
+        self.name = name
+        self.fields = fields
+
+    def set(self, **fields):
+        """Add fields only known once the work is done, like a vault's size."""
+        self.fields.update(fields)
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, traceback):
+        seconds = time.perf_counter() - self.start
+        if exc_type is not None:
+            self.fields["error"] = exc_type.__name__
+        _emit({"time": time.time(), "type": "span", "name": self.name, "seconds": seconds, **self.fields})
+
+
+class _NullSpan:
+    __slots__ = ()
+
+    def set(self, **fields):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, traceback):
+        pass
+
+
+_NULL_SPAN = _NullSpan()
+
+
+def span(name, **fields):
+    """Time a `with` block."""
+    if not _sinks:
+        return _NULL_SPAN
+    return _Span(name, fields)
+
+
+def count(name, value=1, **fields):
+    if _sinks:
+        _emit({"time": time.time(), "type": "count", "name": name, "value": value, **fields})
+
+
+class RingBufferSink:
+    """Keeps the last `size` events in memory, for a debug view or tests."""
+
+    def __init__(self, size=10000):
+        self._events = deque(maxlen=size)
+
+    def write(self, event):
+        self._events.append(event)
+
+    def close(self):
+        pass
+
+    def events(self):
+        return list(self._events)
+
+    def summary(self):
+        """Per name: how many events, and the total and slowest span time or the total count."""
+        totals = {}
+        for event in self.events():
+            entry = totals.setdefault(event["name"], {"events": 0, "total": 0, "max": 0})
+            amount = event["seconds"] if event["type"] == "span" else event["value"]
+            entry["events"] += 1
+            entry["total"] += amount
+            entry["max"] = max(entry["max"], amount)
+        return totals
+
+
+class JsonLinesSink:
+    """Appends one JSON object per event to a file, for shipping elsewhere."""
+
+    def __init__(self, path):
+        import json
+
+        self._dumps = json.dumps
+        self._lock = threading.Lock()
+        self._file = open(path, "a", encoding="utf-8")
+
+    def write(self, event):
+        line = self._dumps(event, default=str) + "\n"
+        with self._lock:
+            self._file.write(line)
+            self._file.flush()
+
+    def close(self):
+        with self._lock:
+            self._file.close()
+
+
+class LogSink:
+    """Writes events as lines to a `logging` logger, at INFO level."""
+
+    def __init__(self, logger="easypass.metrics"):
+        import logging
+
+        self._logger = logging.getLogger(logger) if isinstance(logger, str) else logger
+
+    def write(self, event):
+        fields = " ".join(
+            f"{key}={value}"
+            for key, value in event.items()
+            if key not in ("time", "type", "name", "seconds", "value")
+        )
+        if event["type"] == "span":
+            self._logger.info("%s %.1f ms %s", event["name"], event["seconds"] * 1000, fields)
+        else:
+            self._logger.info("%s +%s %s", event["name"], event["value"], fields)
+
+    def close(self):
+        pass
+
+
+def configure_from_environment():
+    """Enable a sink named by EASYPASS_METRICS: "log" or a .jsonl file path.
+
+    Does nothing when it isn't set, or a sink is already enabled.
+    """
+    target = os.environ.get(METRICS_VARIABLE)
+    if not target or _sinks:
+        return
+    if target == "log":
+        import logging
+
+        logging.basicConfig(level=logging.INFO)
+        enable(LogSink())
+    else:
+        try:
+            enable(JsonLinesSink(target))
+        except OSError as error:  # Carry on without metrics
+            print(f"{METRICS_VARIABLE}: {error}", file=sys.stderr)
@@ -0,0 +1,60 @@
+"""Random passwords and passphrases, from the `secrets` module's generator."""
+import math
+import secrets
+import string
+
+CLASSES = {
+    "lower": string.ascii_lowercase,
+    "upper": string.ascii_uppercase,
+    "digits": string.digits,
+    # Symbols most sites accept; no quotes, backslash or space
+    "symbols": "!#$%&()*+,-./:;<=>?@[]^_{|}~",
+}
+DEFAULT_LENGTH = 20
+
+# Passphrase words are made of consonant-vowel syllables instead of coming
+# from a word list, so there is no list to ship and the entropy is exact:
+# 15 * 5 = 75 syllables, three per word, about 18.7 bits a word.
+CONSONANTS = "bdfgjklmnprstvz"
+VOWELS = "aeiou"
+SYLLABLES_PER_WORD = 3
+DEFAULT_WORDS = 5
+
+
+def generate_password(length=DEFAULT_LENGTH, classes=tuple(CLASSES)):
+    """Return a random password with at least one character of each class."""
+    pools = [CLASSES[name] for name in classes]
+    if not pools:
+        raise ValueError("Pick at least one character class.")
+    if length < len(pools):
+        raise ValueError(f"A password with {len(pools)} character classes needs at least {len(pools)} characters.")
+    alphabet = "".join(pools)
+    # Drawing again until every class shows up keeps the result uniform
+    # over the passwords that qualify.
+    while True:
+        password = "".join(secrets.choice(alphabet) for _ in range(length))
+        if all(any(char in pool for char in password) for pool in pools):
+            return password
+
+
+def generate_passphrase(words=DEFAULT_WORDS, separator="-"):
+    """Return pronounceable random words like "kuvasi-melodo-..."."""
+    if words < 1:
+        raise ValueError("A passphrase needs at least one word.")
+    return separator.join(
+        "".join(
+            secrets.choice(CONSONANTS) + secrets.choice(VOWELS)
+            for _ in range(SYLLABLES_PER_WORD)
+        )
+        for _ in range(words)
+    )
+
+
+def password_entropy(length=DEFAULT_LENGTH, classes=tuple(CLASSES)):
+    # Bits of a generate_password() result, ignoring the small loss from
+    # requiring every class
+    return length * math.log2(sum(len(CLASSES[name]) for name in classes))
+
+
+def passphrase_entropy(words=DEFAULT_WORDS):
+    return words * SYLLABLES_PER_WORD * math.log2(len(CONSONANTS) * len(VOWELS))
@@ -1,106 +1,392 @@
-import ctypes
 import sys
 import tkinter as tk
-from tkinter import messagebox, PhotoImage, Entry, Toplevel
-from tkinter.ttk import Frame, Button, Style, Scrollbar
-import pyperclip
-import configparser
+from tkinter import filedialog, messagebox, simpledialog, PhotoImage, Entry, Toplevel
+from tkinter.ttk import Frame, Button, Combobox, Style, Scrollbar
 import tempfile
 import atexit
+from clipboard import ClipboardManager, TkClipboard, configured_clear_after
+from instance_lock import instance_lock
+import metrics
 import os 
+import threading
+from storage import VaultConflictError
+from vault import PasswordManager
+from vault_crypto import WrongMasterPasswordError
+from vault_pool import VaultPool, vault_key
+from virtual_listbox import VirtualListbox
+from vault_watcher import VaultWatcher
+from vault_writer import WriteBehindStorage
 
-# Classes to encapsulate password management and GUI
-class PasswordManager:
-    PASSWORDS = {}
 
-    def __init__(self, config_file="config.ini"):
-        self.config_file = config_file
-        self.PASSWORDS = self.load_passwords()
-        self.mutex = ctypes.windll.kernel32.CreateMutexA(None, 1, 'EurekaPassManager')
-        self.last_error = ctypes.windll.kernel32.GetLastError()
-
-        if self.last_error == 183:  # ERROR_ALREADY_EXISTS
-            messagebox.showerror('Error', 'Another instance of the app is already running.')
-            self.cleanup()
-            return  # Prevent the rest of the __init__ method
-        
-    def load_passwords(self):
-        config = configparser.ConfigParser()
-        config.read(self.config_file)
-        return dict(config["Passwords"]) if "Passwords" in config else {}
-
-    def save_passwords(self):
-        config = configparser.ConfigParser()
-        config["Passwords"] = self.PASSWORDS
-        with open(self.config_file, "w") as configfile:
-            config.write(configfile)
-
-    def add_password(self, account, password):
-        self.PASSWORDS[account] = password
-        self.save_passwords()
-
-    def delete_password(self, account):
-        if account in self.passwords:
-            del self.PASSWORDS[account]
-            self.save_passwords()
-
-    def edit_password(self, account, password):
-        if account in self.passwords:
-            self.PASSWORDS[account] = password
-            self.save_passwords()
-
-    def get_passwords(self):
-        return self.PASSWORDS
-
-    def cleanup(self):
-            if self.mutex:
-                ctypes.windll.kernel32.ReleaseMutex(self.mutex)
-            self.root.destroy()
-            sys.exit()  # Make sure to exit the application
-            
 class PasswordManagerGUI:
-    def __init__(self, password_manager):
+    TITLE = "Eureka - Easy Pass"
+    # How often the results of background writes are picked up, while
+    # there are any to come
+    WRITER_POLL_MS = 100
+    TOAST_MS = 1500
+    # Past this many accounts changed at once, refill the list instead
+    LISTBOX_REBUILD_AT = 1000
+    OPEN_VAULT = "Open vault..."
+    # Where Tk can't wait on a pipe (Windows), how often to look for
+    # changes the watcher found
+    WATCH_POLL_MS = 1000
+
+    def __init__(self, password_manager, pool=None):
         self.password_manager = password_manager
+        # Every vault opened this session stays in the pool, unlocked, so
+        # switching back to one is instant
+        self.pool = pool if pool is not None else VaultPool()
+        self.pool.on_evict = self.on_evict_vault
+        self.pool.use(password_manager)
+        self.vault_paths = [password_manager.config_file]
+        for path in os.environ.get("EASYPASS_VAULTS", "").split(os.pathsep):
+            if path and vault_key(path) not in map(vault_key, self.vault_paths):
+                self.vault_paths.append(path)
         self.deep_blue = "#002244"
         self.metallic_blue = "#1A3A5A"
         self.bright_blue = "#00A8FF"
         self.root = tk.Tk()
-        self.setup_styles()
-        self.setup_gui()
+        if self.password_manager.locked:
+            self.root.withdraw()
+            if not self.unlock_vault(self.password_manager):
+                self.root.destroy()
+                sys.exit()
+            self.root.deiconify()
+        with metrics.span("ui.startup", entries=len(self.password_manager.PASSWORDS)):
+            self.setup_styles()
+            self.setup_gui()
         self.root.attributes('-topmost', True)
         self.x = None
         self.y = None
-        # To make sure it stays on top after clicking elsewhere,
-        # you might want to bind the focus event to a method that 
-        # keeps setting the window to the topmost position.
+        # To make sure it stays on top after clicking elsewhere, topmost is
+        # re-asserted whenever something may have been stacked over the
+        # window, instead of polling for it.
         self.child_window_open = False
+        self._topmost_job = None
+        self._topmost_step = 0
         self.root.bind("<FocusIn>", self.on_focus)
+        self.root.bind("<FocusOut>", self.on_focus)
+        self.root.bind("<Map>", self.on_focus)
+        self.root.bind("<Visibility>", self.on_visibility)
 
         self.on_focus()
-    
-    def copy_password_to_clipboard(self, account, password):
-            # Logic to copy password to clipboard
-            # Assuming root is a Tk root window, which should be self.root in this context
-            self.root.clipboard_clear()
-            self.root.clipboard_append(password)
+
+        # Copied passwords are taken off the clipboard again after a while
+        self.clipboard = ClipboardManager(
+            TkClipboard(self.root),
+            clear_after=configured_clear_after(),
+            schedule=lambda seconds, callback: self.root.after(int(seconds * 1000), callback),
+            cancel=self.root.after_cancel,
+        )
+        self._toast_job = None
+        # Generator settings, shared by every Add and Edit dialog
+        self._generator_options = None
+
+        # Writes go to disk on a background thread, so a slow or network
+        # drive doesn't freeze the window; one writer per open vault
+        self.save_failed = False
+        self.writers = {}
+        self._writer_poll_job = None
+        self.attach_vault(self.password_manager)
+
+        # Pick up changes other programs (another instance, a sync tool) make
+        # to the current vault while we're running
+        self.listen_for_vault_changes()
+        self.watch_vault()
+        # Ready by the time anyone types in the search box, usually
+        self.password_manager.build_index_in_background()
+
+    def attach_vault(self, manager):
+        if manager in self.writers:
+            return
+        if getattr(manager.storage, "migrated", False):
             messagebox.showinfo(
-                "Password Manager", f"Password for {account} copied to clipboard!"
+                "Password Manager",
+                f"The vault in {manager.storage.ini_path} was copied to {manager.storage.path}, "
+                "which is used from now on. The old file is left as it was, passwords "
+                "included; delete it once you don't need it.",
             )
-                
-        
+        stale_files = getattr(manager.storage, "stale_files", ())
+        if stale_files:
+            messagebox.showwarning(
+                "Password Manager",
+                f"{', '.join(stale_files)} changed after the vault was moved to "
+                f"{manager.storage.path}, by a program still using the old file. "
+                "Those changes are not in the vault; add them again and delete the old file.",
+            )
+        writer = WriteBehindStorage(
+            manager,
+            on_saved=self.on_saved,
+            on_error=self.on_save_error,
+            on_queued=self.poll_writers_soon,
+        )
+        manager.storage = writer
+        self.writers[manager] = writer
+        # Vaults in the background keep their changes until switched to
+        manager.listeners.append(
+            lambda changes: manager is self.password_manager and self.on_vault_records_changed(changes)
+        )
+
+    def listen_for_vault_changes(self):
+        # The watcher thread must not call Tk: that waits for the Tk thread,
+        # which may itself be waiting in watcher.stop() for the watcher. It
+        # sets a flag and writes to a pipe Tk wakes up for instead.
+        self._vault_changed = threading.Event()
+        self._wake_r = self._wake_w = None
+        if hasattr(self.root.tk, "createfilehandler"):  # Not on Windows
+            self._wake_r, self._wake_w = os.pipe()
+            os.set_blocking(self._wake_w, False)
+            self.root.tk.createfilehandler(self._wake_r, tk.READABLE, self.on_wakeup)
+        else:
+            self.root.after(self.WATCH_POLL_MS, self.poll_vault_changed)
+
+    def on_vault_files_changed(self):
+        # Runs on the watcher thread
+        self._vault_changed.set()
+        if self._wake_w is not None:
+            try:
+                os.write(self._wake_w, b"\0")
+            except BlockingIOError:  # Full of wakeups not read yet
+                pass
+
+    def on_wakeup(self, fd, mask):
+        os.read(fd, 4096)
+        self.check_vault_changed()
+
+    def poll_vault_changed(self):
+        self.check_vault_changed()
+        self.root.after(self.WATCH_POLL_MS, self.poll_vault_changed)
+
+    def check_vault_changed(self):
+        if self._vault_changed.is_set():
+            self._vault_changed.clear()
+            self.on_vault_changed()
+
+    def stop_listening_for_vault_changes(self):
+        if self._wake_r is not None:
+            self.root.tk.deletefilehandler(self._wake_r)
+            os.close(self._wake_r)
+            os.close(self._wake_w)
+            self._wake_r = self._wake_w = None
+
+    def watch_vault(self):
+        self.watcher = VaultWatcher(self.password_manager.storage.files(), self.on_vault_files_changed)
+        self.watcher.start()
+
+    def unlock_vault(self, manager):
+        # Asked once per vault and session; the derived key is kept by the
+        # manager. False if the user gave up.
+        while manager.locked:
+            master_password = simpledialog.askstring(
+                "Eureka - Easy Pass",
+                f"Master password for {self.vault_name(manager.config_file)}:",
+                show="*",
+                parent=self.root,
+            )
+            if master_password is None:
+                return False
+            try:
+                manager.unlock(master_password)
+            except WrongMasterPasswordError:
+                messagebox.showerror("Password Manager", "Wrong master password.")
+        return True
+
+    def vault_name(self, path):
+        # The file name, plus its folder when another vault has the same one
+        name = os.path.splitext(os.path.basename(path))[0]
+        others = [
+            other for other in self.vault_paths
+            if vault_key(other) != vault_key(path)
+            and os.path.splitext(os.path.basename(other))[0] == name
+        ]
+        if others:
+            name = f"{name} ({os.path.basename(os.path.dirname(os.path.abspath(path)))})"
+        return name
+
+    def update_vault_selector(self):
+        self.vault_selector.config(
+            values=[self.vault_name(path) for path in self.vault_paths] + [self.OPEN_VAULT]
+        )
+        self.vault_selector.set(self.vault_name(self.password_manager.config_file))
+
+    def on_vault_selected(self, event=None):
+        choice = self.vault_selector.current()
+        if choice < len(self.vault_paths):
+            self.switch_vault(self.vault_paths[choice])
+            return
+        self.disable_topmost()
+        # Naming a file that doesn't exist yet starts a new, empty vault
+        path = filedialog.asksaveasfilename(
+            parent=self.root,
+            title="Open or create a vault",
+            confirmoverwrite=False,
+            defaultextension=".vault",
+            filetypes=[("Vaults", "*.vault *.ini"), ("All files", "*")],
+        )
+        self.enable_topmost()
+        if path:
+            self.switch_vault(path)
+        else:
+            self.update_vault_selector()
+
+    def switch_vault(self, path):
+        """Show another vault; the list is refilled in place."""
+        if vault_key(path) == vault_key(self.password_manager.config_file):
+            # The same vault, maybe by its other name (config.ini, config.vault)
+            self.update_vault_selector()
+            return
+        try:
+            manager = self.pool.open(path)
+        except (OSError, ValueError) as error:  # ValueError: not a vault we can read
+            messagebox.showerror("Password Manager", f"Could not open {path}:\n{error}")
+            self.update_vault_selector()
+            return
+        if manager.locked and not self.unlock_vault(manager):
+            self.update_vault_selector()
+            return
+        if vault_key(path) not in map(vault_key, self.vault_paths):
+            self.vault_paths.append(path)
+
+        self.watcher.stop()
+        self.attach_vault(manager)
+        self.password_manager = manager
+        manager.build_index_in_background()
+        self.watch_vault()
+        # Catch up with what changed on disk while it was in the background
+        manager.refresh()
+        if self.search_var.get():
+            self.search_var.set("")  # Refills the list through filter_accounts()
+        else:
+            self.filter_accounts()
+        self.update_vault_selector()
+        self.update_encrypt_button()
+        self.show_toast(f"Switched to {self.vault_name(path)}")
+        # Only now that the new vault is in use may the old ones be closed
+        self.pool.use(manager)
+
+    def update_encrypt_button(self):
+        self.encrypt_button.config(state="disabled" if self.password_manager.encrypted else "normal")
+
+    def encrypt_vault(self):
+        manager = self.password_manager
+        self.disable_topmost()
+        try:
+            master_password = simpledialog.askstring(
+                "Eureka - Easy Pass",
+                f"New master password for {self.vault_name(manager.config_file)}.\n"
+                "It can't be recovered or removed later:",
+                show="*",
+                parent=self.root,
+            )
+            if not master_password:
+                return
+            repeated = simpledialog.askstring(
+                "Eureka - Easy Pass", "Repeat the master password:", show="*", parent=self.root
+            )
+            if repeated != master_password:
+                messagebox.showerror("Password Manager", "The passwords don't match.")
+                return
+            # Queued writes go out first, and others' changes come in, while
+            # the vault is still plaintext
+            manager.refresh()
+            writer = self.writers[manager]
+            if writer.flush() is not None:
+                messagebox.showerror(
+                    "Password Manager", "The vault can't be encrypted until it can be saved."
+                )
+                return
+            try:
+                manager.enable_encryption(master_password)
+            except (OSError, ValueError) as error:  # Still plaintext, on disk too
+                messagebox.showerror("Password Manager", f"Could not encrypt the vault:\n{error}")
+                return
+        finally:
+            self.enable_topmost()
+        self.filter_accounts()
+        self.update_encrypt_button()
+        self.show_toast(f"Encrypted {self.vault_name(manager.config_file)}")
+
+    def on_evict_vault(self, key, manager):
+        # Called by the pool before it closes a vault; not while it has
+        # changes that couldn't be saved
+        writer = self.writers.get(manager)
+        if writer is not None:
+            if writer.flush() is not None:
+                return False
+            del self.writers[manager]
+        return True
+
+    def copy_password_to_clipboard(self, account, password):
+        self.clipboard.copy(password)
+        if self.clipboard.clear_after:
+            self.show_toast(f"Copied {account}, clears in {self.clipboard.clear_after:g} s")
+        else:
+            self.show_toast(f"Copied {account}")
+
+    def show_toast(self, message):
+        # A label over the bottom of the window for a moment; unlike a
+        # message box it needs no click and doesn't stop the event loop.
+        # Repeated copies reuse it.
+        if self._toast_job is not None:
+            self.root.after_cancel(self._toast_job)
+        self.toast.config(text=message)
+        self.toast.place(relx=0.5, rely=1.0, anchor="s", y=-4)
+        self.toast.lift()
+        self._toast_job = self.root.after(self.TOAST_MS, self.hide_toast)
+
+    def hide_toast(self):
+        self._toast_job = None
+        self.toast.place_forget()
+
+    # Some window managers restack a moment after the event that made us
+    # raise the window, so it is re-checked a few times with growing delays
+    # and then left alone until the next event.
+    TOPMOST_RECHECK_MS = (50, 200, 800, 3200)
+
     def on_focus(self, event=None):
         if not self.child_window_open:
             self.root.attributes('-topmost', True)
-            self.root.after(10, self.keep_on_top)
-        
+            self._topmost_step = 0
+            self._schedule_keep_on_top()
+
+    def on_visibility(self, event):
+        if event.widget is self.root and event.state != "VisibilityUnobscured":
+            self.on_focus()
+
     def keep_on_top(self):
+        self._topmost_job = None
         if not self.child_window_open:
             self.root.attributes('-topmost', True)  # Keep the window on top
-            self.root.after(10, self.keep_on_top)   # Continue to call this method to ensure topmost    
-        
+            self._schedule_keep_on_top()
+
+    def _schedule_keep_on_top(self):
+        if self._topmost_job is not None:
+            self.root.after_cancel(self._topmost_job)
+            self._topmost_job = None
+        if self._topmost_step < len(self.TOPMOST_RECHECK_MS):
+            delay = self.TOPMOST_RECHECK_MS[self._topmost_step]
+            self._topmost_step += 1
+            self._topmost_job = self.root.after(delay, self.keep_on_top)
+
     def disable_topmost(self):
         self.child_window_open = True
+        if self._topmost_job is not None:
+            self.root.after_cancel(self._topmost_job)
+            self._topmost_job = None
         self.root.attributes('-topmost', False)    
+
+    def enable_topmost(self):
+        self.child_window_open = False
+        self.on_focus()
+
+    def track_child_window(self, window):
+        # However the dialog goes away (Save, Update or the close button),
+        # the main window goes back on top.
+        self.disable_topmost()
+        window.bind(
+            "<Destroy>",
+            lambda event: event.widget is window and self.enable_topmost(),
+        )
                 
     def start_move_window(self, event):
 
@@ -124,15 +410,81 @@ class PasswordManagerGUI:
         if selection:
             index = selection[0]
             selected_key = self.listbox.get(index)
+            # Read from disk (and decrypted) just for this copy, then dropped
             selected_password = self.password_manager.PASSWORDS[selected_key]
             self.copy_password_to_clipboard(selected_key, selected_password)
+            del selected_password
         else:
             messagebox.showwarning("Password Manager", "No password selected!")
 
 
+    def on_vault_changed(self):
+        self.password_manager.refresh()
+
+    def on_vault_records_changed(self, changes):
+        with metrics.span("ui.refresh", changes=len(changes)):
+            self._apply_vault_changes(changes)
+
+    def _apply_vault_changes(self, changes):
+        # Only the rows of added or removed accounts are touched; edited
+        # values don't show in the list.
+        accounts = {change[1] for change in changes}
+        if self.search_var.get() or len(accounts) > self.LISTBOX_REBUILD_AT:
+            self.filter_accounts()
+            return
+        passwords = self.password_manager.PASSWORDS
+        shown = set(self.listbox.items)
+        removed = [account for account in accounts if account in shown and account not in passwords]
+        added = [account for account in accounts if account not in shown and account in passwords]
+        for index in sorted((self.listbox.items.index(account) for account in removed), reverse=True):
+            self.listbox.delete(index)
+        if added:
+            self.listbox.insert(tk.END, *added)
+
+    def poll_writers_soon(self):
+        if self._writer_poll_job is None:
+            self._writer_poll_job = self.root.after(self.WRITER_POLL_MS, self.poll_writer)
+
+    def poll_writer(self):
+        # Stops once every writer is done, so an idle window has no timer
+        # running; the next change starts it again
+        self._writer_poll_job = None
+        for writer in list(self.writers.values()):
+            writer.deliver()
+        if any(writer.busy for writer in self.writers.values()):
+            self.poll_writers_soon()
+
+    def on_saved(self):
+        if self.save_failed:
+            self.save_failed = False
+            self.title_label.config(text=self.TITLE)
+
+    def on_save_error(self, error):
+        if isinstance(error, VaultConflictError):
+            self.on_vault_conflict(error)
+            return
+        # Shown once; the writer keeps retrying until it works
+        self.save_failed = True
+        self.title_label.config(text=f"{self.TITLE} - not saved, retrying")
+        messagebox.showerror(
+            "Password Manager",
+            f"Could not save the vault:\n{error}\n\nYour changes are kept and will be saved "
+            "as soon as the file can be written.",
+        )
+
     def on_closing(self):
-        if hasattr(self, "mutex") and self.mutex:
-            ctypes.windll.kernel32.ReleaseMutex(self.mutex)
+        # Everything still queued is written before the window goes away
+        errors = [writer.flush() for writer in self.writers.values()]
+        error = next((error for error in errors if error is not None), None)
+        if error is not None and not messagebox.askyesno(
+            "Password Manager",
+            f"Some changes could not be saved:\n{error}\n\nClose anyway and lose them?",
+        ):
+            return
+        self.watcher.stop()
+        self.stop_listening_for_vault_changes()
+        self.clipboard.clear()
+        self.pool.close()
         self.root.destroy()
 
  
@@ -196,8 +548,11 @@ class PasswordManagerGUI:
         self.root.configure(bg="#002244")
         dir_path = os.path.dirname(os.path.realpath(__file__))
         icon_path = os.path.join(dir_path, 'favicon.png')
-        self.root.iconbitmap(icon_path)
         self.favicon_image = PhotoImage(file=icon_path)  # If you use `.png`, make sure to update the file extension
+        if sys.platform == "win32":
+            self.root.iconbitmap(icon_path)
+        else:
+            self.root.iconphoto(True, self.favicon_image)  # X11 and macOS Tk only take bitmaps or photos
 
         # Window closing protocol
         self.root.protocol("WM_DELETE_WINDOW", self.on_closing)
@@ -207,10 +562,10 @@ class PasswordManagerGUI:
 
         title_bar = tk.Frame(self.root, bg=self.deep_blue)
 
-        title_label = tk.Label(title_bar, text="Eureka - Easy Pass", bg=self.deep_blue, fg="#00FF00")
-        title_label.grid(row=0, column=0, sticky="w")
+        self.title_label = tk.Label(title_bar, text=self.TITLE, bg=self.deep_blue, fg="#00FF00")
+        self.title_label.grid(row=0, column=0, sticky="w")
 
-        close_button = tk.Button(title_bar, text="X", bg=self.deep_blue, fg="#00FF00", command=lambda : self.root.destroy())
+        close_button = tk.Button(title_bar, text="X", bg=self.deep_blue, fg="#00FF00", command=self.on_closing)
         close_button.grid(row=0, column=1, sticky="e")
 
         # These settings will ensure that the title_label takes up most of the space and
@@ -225,7 +580,7 @@ class PasswordManagerGUI:
         
         # Window sizing
         window_width = 300
-        window_height = min(200, len(self.password_manager.PASSWORDS) * 20 + 170)
+        window_height = min(300, len(self.password_manager.PASSWORDS) * 20 + 270)
         self.root.geometry(f"{window_width}x{window_height}")
         self.root.resizable(False, True)
 
@@ -233,18 +588,37 @@ class PasswordManagerGUI:
         self.frame = Frame(self.root, style="TFrame")
         self.frame.grid(row=1, column=0, columnspan=3, sticky="nsew", pady=20)
 
-        self.listbox = tk.Listbox(
+        # Which vault is shown; the last entry opens another one
+        self.vault_selector = Combobox(self.frame, state="readonly")
+        self.vault_selector.grid(row=0, column=0, columnspan=2, sticky="ew", pady=(0, 5))
+        self.vault_selector.bind("<<ComboboxSelected>>", self.on_vault_selected)
+        self.update_vault_selector()
+
+        # Search box; narrows the listbox on every keystroke
+        self.search_var = tk.StringVar()
+        self.search_entry = tk.Entry(
+            self.frame,
+            textvariable=self.search_var,
+            bg=self.metallic_blue,
+            fg=self.bright_blue,
+            insertbackground=self.bright_blue,
+            relief="flat",
+        )
+        self.search_entry.grid(row=1, column=0, columnspan=2, sticky="ew", pady=(0, 5))
+        self.search_var.trace_add("write", self.filter_accounts)
+
+        # Only the rows in view are handed to Tk, however big the vault is
+        self.listbox = VirtualListbox(
             self.frame,
-            height=len(self.password_manager.PASSWORDS),
+            self.password_manager.PASSWORDS,
+            height=min(10, max(1, len(self.password_manager.PASSWORDS))),
             selectmode="single",
             bg=self.deep_blue,              # Background color of the listbox
             fg=self.bright_blue,            # Text color in the listbox
             selectbackground=self.metallic_blue,  # Color of the selected item's background
             selectforeground="#FFFFFF",      # Color of the selected item's text
         )
-        for key in self.password_manager.PASSWORDS:
-            self.listbox.insert(tk.END, key)
-        self.listbox.grid(row=0, column=0, sticky="nsew")
+        self.listbox.grid(row=2, column=0, sticky="nsew")
 
         # Scrollbar for listbox
         scrollbar = Scrollbar(
@@ -253,7 +627,7 @@ class PasswordManagerGUI:
             command=self.listbox.yview,
             style="Vertical.TScrollbar",
         )
-        scrollbar.grid(row=0, column=1, sticky="ns")
+        scrollbar.grid(row=2, column=1, sticky="ns")
         self.listbox.config(yscrollcommand=scrollbar.set)
         self.listbox.bind("<Double-Button-1>", self.on_password_selected)
 
@@ -270,6 +644,23 @@ class PasswordManagerGUI:
             command=self.delete_password,
             style="TButton",
         ).grid(row=2, column=2, sticky="nsew")
+        Button(
+            self.root, text="Import...", command=self.import_passwords, style="TButton"
+        ).grid(row=3, column=0, sticky="nsew")
+        Button(
+            self.root, text="Export...", command=self.export_passwords, style="TButton"
+        ).grid(row=3, column=1, sticky="nsew")
+        Button(
+            self.root, text="Audit", command=self.audit_passwords, style="TButton"
+        ).grid(row=3, column=2, sticky="nsew")
+        # Also for vaults opened later; disabled once the current one is encrypted
+        self.encrypt_button = Button(
+            self.root, text="Encrypt Vault...", command=self.encrypt_vault, style="TButton"
+        )
+        self.encrypt_button.grid(row=4, column=0, columnspan=3, sticky="nsew")
+        self.update_encrypt_button()
+
+        self.toast = tk.Label(self.root, bg=self.metallic_blue, fg="#FFFFFF", padx=8, pady=2)
 
         # To make sure the grid columns and rows resize properly
         self.root.grid_rowconfigure(1, weight=1)  # makes the listbox frame expandable
@@ -278,11 +669,22 @@ class PasswordManagerGUI:
         self.root.grid_columnconfigure(2, weight=1)
 
         self.frame.grid_columnconfigure(0, weight=1)  # makes the listbox expandable
-        self.frame.grid_rowconfigure(0, weight=1)
+        self.frame.grid_rowconfigure(2, weight=1)
         
+    def filter_accounts(self, *args):
+        query = self.search_var.get()
+        with metrics.span("ui.filter", query_length=len(query)) as span:
+            if query:
+                accounts = self.password_manager.search(query)
+            else:
+                accounts = self.password_manager.PASSWORDS
+            # Search results are found as the list scrolls to them
+            self.listbox.set_items(accounts)
+            span.set(rows=self.listbox.size())
+
     def add_password(self):
         add_window = tk.Toplevel(self.root)
-        self.disable_topmost()
+        self.track_child_window(add_window)
         add_window.configure(bg=self.deep_blue)
         add_window.grab_set()  # Disable interaction with the root window
         
@@ -322,19 +724,28 @@ class PasswordManagerGUI:
         )
         password_entry = tk.Entry(add_window, show="*")
         password_entry.grid(row=1, column=1, sticky="ew", padx=5, pady=5)
+        self.add_password_generator(add_window, password_entry, row=2)
 
         def save_password():
             account = account_entry.get()
             password = password_entry.get()
-            self.password_manager.PASSWORDS[account] = password  # Update the passwords dictionary
-            self.password_manager.save_passwords()  # Save the updated dictionary
+            is_new = account not in self.password_manager.PASSWORDS
+            try:
+                self.password_manager.add_password(account, password)  # Update and persist the passwords dictionary
+            except VaultConflictError as error:
+                add_window.destroy()
+                self.on_vault_conflict(error)
+                return
             add_window.destroy()
-            self.listbox.insert(tk.END, account)  # Update listbox with new account
+            if self.search_var.get():
+                self.filter_accounts()  # Only show it if it matches the search
+            elif is_new:
+                self.listbox.insert(tk.END, account)  # Update listbox with new account
             
 
             
         tk.Button(add_window, text="Save", command=save_password).grid(
-            row=2, column=0, columnspan=2, sticky="ew", padx=10, pady=10
+            row=3, column=0, columnspan=2, sticky="ew", padx=10, pady=10
         )
 
         add_window.grid_columnconfigure(1, weight=1)
@@ -345,9 +756,88 @@ class PasswordManagerGUI:
         add_window.resizable(width=False, height=True)
 
 
+    def generator_options(self):
+        if self._generator_options is None:
+            from password_generator import CLASSES, DEFAULT_LENGTH, DEFAULT_WORDS
+
+            self._generator_options = {
+                "length": tk.IntVar(self.root, DEFAULT_LENGTH),
+                "passphrase": tk.BooleanVar(self.root, False),
+                "words": tk.IntVar(self.root, DEFAULT_WORDS),
+                **{name: tk.BooleanVar(self.root, True) for name in CLASSES},
+            }
+        return self._generator_options
+
+    def add_password_generator(self, window, password_entry, row):
+        # A Generate button, its settings and a strength readout under a
+        # password field
+        import password_generator
+        from vault_audit import STRONG_BITS, WEAK_BITS, estimate_entropy
+
+        options = self.generator_options()
+        colors = dict(bg=self.deep_blue, fg=self.bright_blue)
+        checkbox_colors = dict(colors, selectcolor=self.metallic_blue, activebackground=self.deep_blue)
+        panel = tk.Frame(window, bg=self.deep_blue)
+        panel.grid(row=row, column=1, sticky="w", padx=5)
+        strength = tk.Label(panel, **colors)
+        strength.grid(row=0, column=0, columnspan=4, sticky="w")
+
+        size_label = tk.Label(panel, **colors)
+        size_label.grid(row=1, column=0, sticky="w")
+        size = tk.Spinbox(panel, from_=1, to=128, width=4)
+        size.grid(row=1, column=1, sticky="w")
+        class_buttons = [
+            tk.Checkbutton(panel, text=name, variable=options[name], **checkbox_colors)
+            for name in password_generator.CLASSES
+        ]
+        for column, button in enumerate(class_buttons):
+            button.grid(row=2, column=column, sticky="w")
+
+        def show_mode():
+            passphrase = options["passphrase"].get()
+            size_label.config(text="Words" if passphrase else "Length")
+            size.config(textvariable=options["words" if passphrase else "length"])
+            for button in class_buttons:
+                button.config(state="disabled" if passphrase else "normal")
+
+        tk.Checkbutton(
+            panel, text="Passphrase", variable=options["passphrase"], command=show_mode, **checkbox_colors
+        ).grid(row=1, column=2, columnspan=2, sticky="w")
+        show_mode()
+
+        def show_strength(event=None, bits=None):
+            # Generated passwords have an exact figure; typed ones an estimate
+            if bits is None:
+                bits = estimate_entropy(password_entry.get())
+            rating = "weak" if bits < WEAK_BITS else "fair" if bits < STRONG_BITS else "strong"
+            strength.config(text=f"{rating} ({bits:.0f} bits)")
+
+        def generate():
+            try:
+                if options["passphrase"].get():
+                    words = options["words"].get()
+                    password = password_generator.generate_passphrase(words)
+                    bits = password_generator.passphrase_entropy(words)
+                else:
+                    length = options["length"].get()
+                    classes = [name for name in password_generator.CLASSES if options[name].get()]
+                    password = password_generator.generate_password(length, classes)
+                    bits = password_generator.password_entropy(length, classes)
+            except (ValueError, tk.TclError) as error:  # TclError: not a number
+                messagebox.showwarning("Password Manager", str(error), parent=window)
+                return
+            password_entry.delete(0, tk.END)
+            password_entry.insert(0, password)
+            password_entry.config(show="")  # Visible, so it can be noted down
+            show_strength(bits=bits)
+
+        tk.Button(window, text="Generate", command=generate).grid(
+            row=row, column=0, sticky="ne", padx=5, pady=5
+        )
+        password_entry.bind("<KeyRelease>", show_strength)
+        show_strength()
+
     def edit_password(self):
-  
-        self.disable_topmost()
         selection = self.listbox.curselection()
         if not selection:
             tk.messagebox.showwarning(
@@ -357,6 +847,7 @@ class PasswordManagerGUI:
         index = selection[0]
         selected_key = self.listbox.get(index)
         edit_window = tk.Toplevel(self.root)
+        self.track_child_window(edit_window)
         edit_window.configure(bg=self.deep_blue)
         
         edit_window.transient(self.root)
@@ -398,12 +889,12 @@ class PasswordManagerGUI:
         password_entry = tk.Entry(edit_window, show="*")
         password_entry.insert(0, self.password_manager.PASSWORDS[selected_key])
         password_entry.grid(row=1, column=1)
+        self.add_password_generator(edit_window, password_entry, row=2)
 
         def update_password():
-            # Get the current selection index
-            selection = self.listbox.curselection()
-            old_key = selection
-            print(old_key)
+            nonlocal index
+            # The entry being edited
+            old_key = selected_key
 
             # Get the new account name and password from the entries
             new_account = account_entry.get()
@@ -416,19 +907,34 @@ class PasswordManagerGUI:
             if new_account != old_key and new_account in self.password_manager.PASSWORDS:
                 tk.messagebox.showwarning("Update Error", "The account name already exists.")
                 return
+            if old_key not in self.password_manager.PASSWORDS:
+                edit_window.destroy()
+                tk.messagebox.showwarning(
+                    "Update Error", f"{old_key} was deleted by another program in the meantime."
+                )
+                self.filter_accounts()
+                return
 
-            # Update the password dictionary and listbox
-            if new_account == old_key:
-                self.password_manager.PASSWORDS[old_key] = new_password
-            else:
-            # Remove the old entry and add the new one
-
-
+            # Update and persist the password dictionary, then the listbox
+            try:
+                if new_account == old_key:
+                    self.password_manager.edit_password(old_key, new_password)
+                else:
+                    # Remove the old entry and add the new one
+                    self.password_manager.rename_password(old_key, new_account, new_password)
+            except VaultConflictError as error:
+                edit_window.destroy()
+                self.on_vault_conflict(error)
+                return
 
-                # Use next() to get the first index from the iterable, or return the size of the listbox if the iterable is empty
-         
-                self.password_manager.PASSWORDS.pop(old_key, None)  # Safely remove the old key
-                self.password_manager.PASSWORDS[new_account] = new_password
+            # Other programs' changes may have moved the row while the dialog
+            # was open, or the search no longer shows it
+            if old_key not in self.listbox.items:
+                self.filter_accounts()
+                edit_window.destroy()
+                return
+            index = self.listbox.items.index(old_key)
+            if new_account != old_key:
                 # Update the listbox entry
                 self.listbox.delete(index)
                
@@ -438,23 +944,30 @@ class PasswordManagerGUI:
                 self.listbox.selection_clear(0, tk.END)
                 self.listbox.selection_set(index)
 
-            # Save the updated dictionary
-            self.password_manager.save_passwords()
-
-            # Keep the updated entry selected
-            self.listbox.selection_set(index)
+            if new_account != old_key and self.search_var.get():
+                # The new name may not match the search any more
+                self.filter_accounts()
+            else:
+                # Keep the updated entry selected
+                self.listbox.selection_set(index)
 
             # Close the edit window
             edit_window.destroy()
 
 
         tk.Button(edit_window, text="Update", command=update_password).grid(
-                row=2, column=0, columnspan=2
+                row=3, column=0, columnspan=2
             )
         
     def delete_password(self):
         selection = self.listbox.curselection()
         self.disable_topmost()
+        try:
+            self._delete_selected(selection)
+        finally:
+            self.enable_topmost()  # The message boxes are closed by now
+
+    def _delete_selected(self, selection):
         if selection:
             index = selection[0]
             selected_key = self.listbox.get(index)
@@ -465,12 +978,18 @@ class PasswordManagerGUI:
                 default="no",
             )
             if response:
-                del self.password_manager.PASSWORDS[selected_key]  # Remove from the passwords dictionary
-                self.password_manager.save_passwords()  # Save the updated dictionary
-                self.listbox.delete(index)  # Remove from the listbox
-                tk.messagebox.showinfo(
-                    "Password Manager", f"Password for {selected_key} has been deleted."
-                )
+                try:
+                    self.password_manager.delete_password(selected_key)  # Remove from the passwords dictionary and persist
+                except VaultConflictError as error:
+                    self.on_vault_conflict(error)
+                else:
+                    # Looked up again, rows may have moved while asking, or be
+                    # gone if another program deleted it first
+                    if selected_key in self.listbox.items:
+                        self.listbox.delete(self.listbox.items.index(selected_key))
+                    tk.messagebox.showinfo(
+                        "Password Manager", f"Password for {selected_key} has been deleted."
+                    )
             else:
                 tk.messagebox.showinfo(
                     "Password Manager", "Delete operation cancelled."
@@ -480,9 +999,102 @@ class PasswordManagerGUI:
                 "Password Manager", "No password selected to delete."
             )
   
+    def import_passwords(self):
+        # A CSV of ours, or an export from a browser or another password
+        # manager; existing accounts keep their passwords.
+        import vault_transfer
+
+        self.disable_topmost()
+        path = filedialog.askopenfilename(
+            parent=self.root,
+            title="Import passwords",
+            filetypes=[("CSV files", "*.csv"), ("All files", "*")],
+        )
+        if path:
+            try:
+                result = vault_transfer.import_file(
+                    self.password_manager, path, progress=self.show_import_progress
+                )
+            except VaultConflictError as error:
+                self.on_vault_conflict(error)
+            except (OSError, ValueError) as error:  # ValueError: not a CSV we know
+                messagebox.showerror("Password Manager", f"Could not import {path}:\n{error}")
+            else:
+                self.filter_accounts()
+                messagebox.showinfo("Password Manager", f"Imported {result}.")
+            finally:
+                self.title_label.config(text=self.TITLE)
+        self.enable_topmost()
+
+    def show_import_progress(self, rows, fraction):
+        done = f" ({fraction:.0%})" if fraction is not None else ""
+        self.title_label.config(text=f"Importing... {rows:,} rows{done}")
+        self.title_label.update_idletasks()
+
+    def export_passwords(self):
+        import vault_transfer
+
+        self.disable_topmost()
+        path = filedialog.asksaveasfilename(
+            parent=self.root,
+            title="Export passwords (unencrypted)",
+            defaultextension=".csv",
+            filetypes=[("CSV files", "*.csv")],
+        )
+        if path:
+            try:
+                count = vault_transfer.export_file(self.password_manager, path)
+            except OSError as error:
+                messagebox.showerror("Password Manager", f"Could not export to {path}:\n{error}")
+            else:
+                messagebox.showinfo("Password Manager", f"Exported {count} passwords to {path}.")
+        self.enable_topmost()
+
+    def audit_passwords(self):
+        # Weak and reused passwords, plus breached ones when a breach index
+        # is configured (see `cli.py breach-index`)
+        import vault_audit
+
+        path = os.environ.get("EASYPASS_BREACH_INDEX")
+        breach_index = None
+        if path:
+            try:
+                breach_index = vault_audit.BreachIndex(path)
+            except (OSError, vault_audit.BreachListError) as error:
+                messagebox.showwarning("Password Manager", f"Breach list not checked:\n{error}")
+        try:
+            report = vault_audit.audit_vault(self.password_manager.PASSWORDS, breach_index)
+        finally:
+            if breach_index is not None:
+                breach_index.close()
+
+        audit_window = tk.Toplevel(self.root)
+        self.track_child_window(audit_window)
+        audit_window.configure(bg=self.deep_blue)
+        audit_window.transient(self.root)
+        audit_window.title("Password audit")
+        text = tk.Text(
+            audit_window, width=50, height=20, bg=self.deep_blue, fg=self.bright_blue, relief="flat"
+        )
+        text.insert("1.0", str(report))
+        text.config(state="disabled")
+        text.grid(row=0, column=0, sticky="nsew", padx=5, pady=5)
+        tk.Button(audit_window, text="Close", command=audit_window.destroy).grid(
+            row=1, column=0, sticky="ew", padx=10, pady=10
+        )
+        audit_window.grid_rowconfigure(0, weight=1)
+        audit_window.grid_columnconfigure(0, weight=1)
+
+    def on_vault_conflict(self, error):
+        # Another program changed the same account first; its version is the
+        # one kept, so show the list as it is now.
+        messagebox.showerror(
+            "Password Manager", f"{error}\n\nThe list has been reloaded, please try again."
+        )
+        self.filter_accounts()
+
     def on_child_close(self,window):
-            self.child_window_open = False
-            self.root.attributes('-topmost', True)
+            # The <Destroy> binding from track_child_window() restores topmost
             window.destroy()
             
        
@@ -490,29 +1102,24 @@ class PasswordManagerGUI:
         self.root.mainloop()
 
 
-def cleanup_mutex():
-    if mutex:
-        ctypes.windll.kernel32.CloseHandle(mutex)
-
-
-@atexit.register
-def on_exit():
-    cleanup_mutex()
-
-
-# Mutex and single instance check can stay outside the classes as they relate to the application instance
-mutex = ctypes.windll.kernel32.CreateMutexA(None, False, "Global\\PasswordManagerMutex")
-last_error = ctypes.windll.kernel32.GetLastError()
-
-if last_error == 183:
-    messagebox.showerror("Error", "Application is already running.")
-    sys.exit(0)
-
 # Starting point of the application
 if __name__ == "__main__":
+    # Single instance check; only taken here so importing this module (tests,
+    # tools, benchmarks) has no side effects
+    lock = instance_lock()
+    if not lock.acquire():
+        messagebox.showerror("Error", "Application is already running.")
+        sys.exit(0)
+    atexit.register(lock.release)
+    metrics.configure_from_environment()
+    atexit.register(metrics.disable)
+
     try:
-        manager = PasswordManager()
-        gui = PasswordManagerGUI(manager)
+        pool = VaultPool()
+        manager = pool.open("config.ini")
+        # Also flushes the pending writes if we exit without on_closing()
+        atexit.register(pool.close)
+        gui = PasswordManagerGUI(manager, pool)
         gui.run()
     except Exception as e:
         # Print the exception message
@@ -0,0 +1,247 @@
+import bisect
+
+from storage import DELETE
+
+# Queries at least this long go through the trigram index and match anywhere
+# in an account name; shorter ones match the start of the name.
+TRIGRAM = 3
+# Prefixes up to this long have their own lists of ids
+PREFIX = TRIGRAM - 1
+
+
+def trigrams(text):
+    return {text[i:i + TRIGRAM] for i in range(len(text) - TRIGRAM + 1)}
+
+
+def prefixes(text):
+    return {text[:length] for length in range(1, min(len(text), PREFIX) + 1)}
+
+
+def _insert(postings, key, account_id):
+    ids = postings.get(key)
+    if ids is None:
+        postings[key] = [account_id]
+    else:
+        ids.append(account_id)  # New ids are the highest, so it stays sorted
+
+
+def _remove(postings, key, account_id):
+    ids = postings[key]
+    del ids[bisect.bisect_left(ids, account_id)]
+    if not ids:
+        del postings[key]
+
+
+class SearchResults:
+    """The matches of one search, found as they are asked for.
+
+    Slicing or iterating only checks as many candidates as it takes to find
+    the matches asked for, so showing the first screenful costs the same
+    whether a query matches ten accounts or half the vault. len() finds all
+    of them. `complete` tells whether they have all been found.
+    """
+
+    def __init__(self, candidates, accounts, names=None, query=None, prefix=False):
+        self._candidates = candidates  # ids, in insertion order
+        self._accounts = accounts
+        self._names = names    # With a query, candidates must contain it
+        self._query = query
+        self._prefix = prefix  # ...or start with it
+        self._position = 0     # Candidates checked so far
+        self._ids = []         # Matches found so far
+        self._found = []       # ...and their accounts
+
+    @property
+    def complete(self):
+        return self._position >= len(self._candidates)
+
+    def _fetch(self, count):
+        # Find matches until there are `count` of them (None: all)
+        candidates, accounts, names, query = self._candidates, self._accounts, self._names, self._query
+        prefix = self._prefix
+        ids, found = self._ids, self._found
+        position = self._position
+        while position < len(candidates) and (count is None or len(found) < count):
+            account_id = candidates[position]
+            position += 1
+            account = accounts[account_id]
+            if account is not None and (
+                query is None
+                or (names[account_id].startswith(query) if prefix else query in names[account_id])
+            ):
+                ids.append(account_id)
+                found.append(account)
+        self._position = position
+
+    def __len__(self):
+        self._fetch(None)
+        return len(self._found)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            start, stop = index.start or 0, index.stop
+            self._fetch(stop if stop is not None and stop >= 0 and start >= 0 else None)
+        else:
+            self._fetch(index + 1 if index >= 0 else None)
+        return self._found[index]
+
+    def __iter__(self):
+        position = 0
+        while True:
+            if position == len(self._found):
+                self._fetch(position + 100)
+                if position == len(self._found):
+                    return
+            yield self._found[position]
+            position += 1
+
+
+class _Lowered:
+    # Lowercased names, made as they are looked at
+    def __init__(self, accounts):
+        self._accounts = accounts
+
+    def __getitem__(self, account_id):
+        return self._accounts[account_id].lower()
+
+
+def scan(accounts, query):
+    """Search `accounts` like AccountIndex.search(), without an index.
+
+    Every name is checked, lazily, so it suits a one-off search (the CLI), or
+    searching while the index is still being built.
+    """
+    accounts = list(accounts)
+    query = query.lower()
+    if not query:
+        return SearchResults(range(len(accounts)), accounts)
+    return SearchResults(
+        range(len(accounts)), accounts, _Lowered(accounts), query, prefix=len(query) < TRIGRAM
+    )
+
+
+class AccountIndex:
+    """Case-insensitive type-ahead search over account names.
+
+    Every account gets an integer id in insertion order, which is also the
+    order results come back in, matching the unfiltered list. The index keeps
+    a sorted list of ids per trigram for substring queries and per one- and
+    two-character prefix for shorter ones; add() and discard() keep them
+    current, so nothing is rebuilt when the vault changes.
+
+    search() only picks the shortest of those lists and returns; the matches
+    are found lazily (see SearchResults), so a keystroke stays well under a
+    millisecond even when it matches most of a 100k vault. When a query
+    extends the previous one (the user typed another character) the previous
+    results are filtered instead, if they are fewer.
+    """
+
+    def __init__(self, accounts=()):
+        self._ids = {}         # account -> id
+        self._accounts = []    # id -> account, None once discarded
+        self._names = []       # id -> lowercased account, None once discarded
+        self._trigrams = {}    # trigram -> ids whose name contains it, sorted
+        self._prefixes = {}    # first one or two characters -> ids, sorted
+        self._last = None      # (query, results) of the previous search
+        self._build(accounts)
+
+    def _build(self, accounts):
+        # _register() for many accounts at once, inlined: this is most of the
+        # cost of opening a big vault's search
+        ids, accounts_by_id, names = self._ids, self._accounts, self._names
+        by_trigram, by_prefix = self._trigrams, self._prefixes
+        for account in accounts:
+            if account in ids:
+                continue
+            account_id = ids[account] = len(accounts_by_id)
+            accounts_by_id.append(account)
+            name = account.lower()
+            names.append(name)
+            for gram in {name[i:i + TRIGRAM] for i in range(len(name) - TRIGRAM + 1)}:
+                postings = by_trigram.get(gram)
+                if postings is None:
+                    by_trigram[gram] = [account_id]
+                else:
+                    postings.append(account_id)
+            for length in range(1, min(len(name), PREFIX) + 1):
+                postings = by_prefix.get(name[:length])
+                if postings is None:
+                    by_prefix[name[:length]] = [account_id]
+                else:
+                    postings.append(account_id)
+
+    def __len__(self):
+        return len(self._ids)
+
+    def __contains__(self, account):
+        return account in self._ids
+
+    def _register(self, account):
+        name = account.lower()
+        account_id = len(self._accounts)
+        self._ids[account] = account_id
+        self._accounts.append(account)
+        self._names.append(name)
+        for gram in trigrams(name):
+            _insert(self._trigrams, gram, account_id)
+        for prefix in prefixes(name):
+            _insert(self._prefixes, prefix, account_id)
+        return account_id
+
+    def add(self, account):
+        if account in self._ids:
+            return
+        self._register(account)
+        self._last = None
+
+    def discard(self, account):
+        account_id = self._ids.pop(account, None)
+        if account_id is None:
+            return
+        name = self._names[account_id]
+        for gram in trigrams(name):
+            _remove(self._trigrams, gram, account_id)
+        for prefix in prefixes(name):
+            _remove(self._prefixes, prefix, account_id)
+        self._accounts[account_id] = None
+        self._names[account_id] = None
+        self._last = None
+
+    def search(self, query):
+        """Return the accounts matching `query`, in insertion order, as SearchResults."""
+        query = query.lower()
+        if not query:
+            return SearchResults(range(len(self._accounts)), self._accounts)
+
+        if len(query) < TRIGRAM:
+            # Every id listed under the prefix matches; nothing to check
+            candidates = self._prefixes.get(query, ())
+            self._last = None
+            return SearchResults(list(candidates), self._accounts)
+
+        candidates = min((self._trigrams.get(gram, ()) for gram in trigrams(query)), key=len)
+        last = self._last
+        if (
+            last is not None
+            and query.startswith(last[0])
+            and last[1].complete
+            and len(last[1]._ids) < len(candidates)
+        ):
+            candidates = last[1]._ids
+        # A copy, so later changes to the index don't shift it under us.
+        # Having a trigram doesn't mean having the whole query, unless the
+        # query is that trigram.
+        if len(query) > TRIGRAM:
+            results = SearchResults(list(candidates), self._accounts, self._names, query)
+        else:
+            results = SearchResults(list(candidates), self._accounts)
+        self._last = (query, results)
+        return results
+
+    def update(self, changes):
+        """Apply a list of storage changes (see storage.SET/DELETE)."""
+        for op, account, _ in changes:
+            if op == DELETE:
+                self.discard(account)
+            else:
+                self.add(account)
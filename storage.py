@@ -0,0 +1,1047 @@
+import json
+import locale
+import mmap
+import os
+import struct
+import threading
+import zlib
+from collections.abc import ItemsView, MutableMapping
+from contextlib import contextmanager
+
+import metrics
+
+# Change operations understood by every storage backend. A change is a tuple
+# of (operation, account, password); password is None for deletes.
+SET = "set"
+DELETE = "delete"
+
+_ABSENT = object()
+
+
+def apply_changes(passwords, changes):
+    for op, account, password in changes:
+        if op == SET:
+            passwords[account] = password
+        elif op == DELETE:
+            passwords.pop(account, None)
+        else:
+            raise ValueError(f"Unknown vault operation: {op!r}")
+
+
+def atomic_write(path, data):
+    # Write next to the target and rename over it, so readers and crashes only
+    # ever see the old or the new file, never a half written one.
+    import tempfile  # Here, like configparser below, to keep startup fast
+
+    directory = os.path.dirname(os.path.abspath(path))
+    fd, tmp_path = tempfile.mkstemp(prefix=".tmp-", dir=directory)
+    try:
+        with os.fdopen(fd, "wb") as tmp:
+            tmp.write(data)
+            tmp.flush()
+            os.fsync(tmp.fileno())
+        os.replace(tmp_path, path)
+    except BaseException:
+        try:
+            os.unlink(tmp_path)
+        except OSError:
+            pass
+        raise
+    fsync_directory(directory)
+
+
+def fsync_directory(directory):
+    # Persist the rename itself. Not supported (nor needed) on Windows.
+    if os.name != "posix":
+        return
+    fd = os.open(directory, os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+class VaultStorage:
+    """Base class for the on-disk representation of a vault.
+
+    Besides the accounts a backend keeps a small `meta` dict of strings
+    (e.g. key derivation parameters), written out by save().
+    """
+
+    def load(self):
+        """Return the stored accounts as a dict of account -> password."""
+        raise NotImplementedError
+
+    def save(self, passwords):
+        """Persist the complete vault."""
+        raise NotImplementedError
+
+    def apply(self, changes, passwords, base=None):
+        """Persist `changes`, already applied to the in-memory `passwords`.
+
+        Returns the changes other writers made in the meantime, which have
+        been merged into `passwords`; a single-writer backend has none.
+        """
+        self.save(passwords)
+        return []
+
+    def refresh(self, passwords):
+        """Merge in changes other writers made; return them."""
+        return []
+
+    def files(self):
+        """The files whose modification means the vault changed."""
+        return []
+
+    def reopen(self, passwords):
+        """Map the vault file for `passwords` again after passwords.close()."""
+
+    def close(self):
+        pass
+
+
+class SnapshotReader:
+    """Read-only memory map of a snapshot file, for reading single values."""
+
+    def __init__(self, path, decode):
+        self._decode = decode
+        self._file = open(path, "rb")
+        try:
+            self._map = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        except ValueError:  # Empty file
+            self._map = None
+
+    def read(self, offset, length):
+        # Copy into a buffer we own and wipe it once decoded. The returned str
+        # can't be wiped, so callers should drop it as soon as they're done.
+        buffer = bytearray(memoryview(self._map)[offset:offset + length])
+        try:
+            return self._decode(buffer)
+        finally:
+            buffer[:] = bytes(len(buffer))
+
+    def close(self):
+        if self._map is not None:
+            self._map.close()
+            self._map = None
+        self._file.close()
+
+
+class SnapshotRecords(MutableMapping):
+    """The stored accounts, with values left on disk until they are asked for.
+
+    Each entry is either the value itself (set since the snapshot was written)
+    or the (offset, length) of the value in the snapshot, read through a
+    SnapshotReader on every lookup and not kept. Memory use follows the number
+    of accounts, not the size of the values.
+    """
+
+    def __init__(self, values=None):
+        self._entries = dict(values or {})
+        self._reader = None
+
+    def bind(self, reader, locations=None):
+        # Point every entry at a freshly written snapshot, dropping the
+        # in-memory values it now holds. Without locations, just reopen.
+        if self._reader is not None:
+            self._reader.close()
+        self._reader = reader
+        if locations is not None:
+            self._entries = locations
+
+    def close(self):
+        if self._reader is not None:
+            self._reader.close()
+            self._reader = None
+
+    def adopt(self, other):
+        # Take over the entries and the open snapshot of `other`.
+        self.close()
+        self._entries = other._entries
+        self._reader = other._reader
+        other._reader = None
+
+    def __getitem__(self, account):
+        entry = self._entries[account]
+        if type(entry) is tuple:
+            return self._reader.read(*entry)
+        return entry
+
+    def __setitem__(self, account, value):
+        self._entries[account] = value
+
+    def __delitem__(self, account):
+        del self._entries[account]
+
+    def __contains__(self, account):
+        return account in self._entries
+
+    def __iter__(self):
+        return iter(self._entries)
+
+    def __len__(self):
+        return len(self._entries)
+
+
+class IniStorage(VaultStorage):
+    """The original format: every account in the [Passwords] section of an INI file.
+
+    Next to the file goes `<path>.idx`, a small index with the position of
+    every value in it. With a current index, load() reads only the index and
+    maps the INI file; values are read when looked up. Without one (a file
+    from an older version, or edited by hand) the whole file is parsed.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.index_path = path + ".idx"
+        self.meta = {}
+        # Same encoding ConfigParser.read() uses, so existing files keep working.
+        self.encoding = locale.getpreferredencoding(False)
+
+    @staticmethod
+    def _parser():
+        import configparser  # Only needed when there is no current index
+
+        config = configparser.ConfigParser()
+        # Keep account names as typed. The default lowercases them, which made
+        # "Gmail" and "gmail" collide and would break encrypted values, whose
+        # account name is part of the authenticated data.
+        config.optionxform = str
+        return config
+
+    def load(self):
+        records = self._load_indexed()
+        if records is not None:
+            return records
+
+        import configparser
+
+        config = self._parser()
+        try:
+            config.read(self.path)
+        except configparser.Error as error:
+            raise VaultFormatError(f"{self.path} is not a vault: {error}") from None
+        if config.sections() and "Passwords" not in config:
+            # Some other INI file; an empty one is an empty vault
+            raise VaultFormatError(f"{self.path} is not a vault: it has no [Passwords] section")
+        self.meta = dict(config["Vault"]) if "Vault" in config else {}
+        passwords = dict(config["Passwords"]) if "Passwords" in config else {}
+        records = SnapshotRecords(passwords)
+        # If the file is exactly what save() would write, only the index is
+        # missing; write it so the next start is lazy. Otherwise the index
+        # appears with the next save.
+        try:
+            with open(self.path, "rb") as snapshot:
+                current = snapshot.read()
+        except FileNotFoundError:
+            return records
+        data, locations = self._render(passwords)
+        if data == current:
+            self._write_index(locations)
+            records.bind(SnapshotReader(self.path, self._decode_value), locations)
+        return records
+
+    def files(self):
+        return [self.path]
+
+    def _load_indexed(self):
+        try:
+            with open(self.index_path, "rb") as index_file:
+                index = json.loads(index_file.read())
+            stat = os.stat(self.path)
+        except (OSError, ValueError):
+            return None
+        if index.get("size") != stat.st_size or index.get("mtime_ns") != stat.st_mtime_ns:
+            return None  # The INI file changed behind the index's back
+        self.meta = index["meta"]
+        records = SnapshotRecords()
+        records.bind(
+            SnapshotReader(self.path, self._decode_value),
+            {account: (offset, length) for account, offset, length in index["passwords"]},
+        )
+        return records
+
+    def _decode_value(self, raw):
+        # Undo what _render() did, the way ConfigParser would read it back.
+        value = raw.decode(self.encoding)
+        value = "\n".join(line.strip() for line in value.split("\n"))
+        return value.replace("%%", "%")
+
+    def _render(self, passwords):
+        # Same layout ConfigParser.write() produces, built by hand so the
+        # position of every value is known.
+        parts = []
+        locations = {}
+        position = 0
+        encoding = self.encoding
+
+        def emit(text):
+            nonlocal position
+            data = text.encode(encoding)
+            parts.append(data)
+            position += len(data)
+
+        if self.meta:
+            emit("[Vault]\n")
+            for key, value in self.meta.items():
+                emit(f"{key} = {value}\n")
+            emit("\n")
+        emit("[Passwords]\n")
+        for account, password in passwords.items():
+            emit(f"{account} = ")
+            start = position
+            # ConfigParser interpolates on read, so a literal % has to be
+            # doubled; continuation lines of a multi-line value are indented.
+            emit(password.replace("%", "%%").replace("\n", "\n\t"))
+            locations[account] = (start, position - start)
+            emit("\n")
+        emit("\n")
+        return b"".join(parts), locations
+
+    def _write_index(self, locations):
+        stat = os.stat(self.path)
+        index = {
+            "size": stat.st_size,
+            "mtime_ns": stat.st_mtime_ns,
+            "meta": self.meta,
+            "passwords": [
+                [account, offset, length] for account, (offset, length) in locations.items()
+            ],
+        }
+        atomic_write(self.index_path, json.dumps(index, ensure_ascii=False).encode("utf-8"))
+
+    def save(self, passwords):
+        data, locations = self._render(passwords)
+        if not isinstance(passwords, SnapshotRecords):
+            atomic_write(self.path, data)
+            self._write_index(locations)
+            return
+
+        # Windows can't replace a file that is still mapped
+        passwords.close()
+        try:
+            atomic_write(self.path, data)
+        except BaseException:
+            self.reopen(passwords)
+            raise
+        passwords.bind(SnapshotReader(self.path, self._decode_value), locations)
+        self._write_index(locations)
+
+    def reopen(self, passwords):
+        passwords.bind(SnapshotReader(self.path, self._decode_value))
+
+
+# Binary vault layout, all integers little-endian:
+#
+#   header    magic, version, flags, entry count, CRC32 of meta+index+names,
+#             length of meta, length of names
+#   meta      JSON object (the [Vault] settings of an INI vault)
+#   index     one entry per account, sorted by UTF-8 name: offset and length
+#             of the name in `names`, offset of its value in the file
+#   names     the account names, UTF-8, back to back
+#   values    each a u32 length followed by that many bytes of UTF-8
+BINARY_MAGIC = b"EZPVAULT"
+BINARY_VERSION = 1
+BINARY_HEADER = struct.Struct("<8sHHIIQQ")
+BINARY_ENTRY = struct.Struct("<IIQ")
+BINARY_LENGTH = struct.Struct("<I")
+
+
+class VaultFormatError(ValueError):
+    pass
+
+
+class BinaryReader(SnapshotReader):
+    """A mapped binary vault, searched in place.
+
+    Opening one reads and checks only the header, the meta and the index;
+    find() is a binary search over the mapped index, so neither the names
+    nor the values have to be loaded to look an account up.
+    """
+
+    def __init__(self, path):
+        super().__init__(path, lambda raw: raw.decode("utf-8"))
+        try:
+            self._parse_header(path)
+        except BaseException:
+            self.close()
+            raise
+
+    def _parse_header(self, path):
+        data = self._map
+        if data is None or len(data) < BINARY_HEADER.size:
+            raise VaultFormatError(f"{path} is not a vault file.")
+        magic, version, _, count, crc, meta_length, names_length = BINARY_HEADER.unpack_from(data)
+        if magic != BINARY_MAGIC:
+            raise VaultFormatError(f"{path} is not a vault file.")
+        if version != BINARY_VERSION:
+            raise VaultFormatError(f"{path} has an unknown format version ({version}).")
+        self.count = count
+        self._lookups = 0
+        self._offsets = None
+        self._index = BINARY_HEADER.size + meta_length
+        self._names = self._index + count * BINARY_ENTRY.size
+        self._names_end = self._names + names_length
+        view = memoryview(data)
+        try:
+            if len(data) < self._names_end or zlib.crc32(view[BINARY_HEADER.size:self._names_end]) != crc:
+                raise VaultFormatError(f"{path} is damaged.")
+            self.meta = json.loads(bytes(view[BINARY_HEADER.size:self._index]))
+        finally:
+            view.release()
+
+    def find(self, account):
+        """Return where the value of `account` is, or None."""
+        if self._offsets is not None:
+            return self._offsets.get(account)
+        # A few lookups (a CLI call, the daemon) search the mapped index. Past
+        # a fraction of the vault, as when diffing or copying it, one pass
+        # into a dict is cheaper than searching for every account.
+        self._lookups += 1
+        if self._lookups > 64 + self.count // 16:
+            self._offsets = dict(self.entries())
+            return self._offsets.get(account)
+
+        key = account.encode("utf-8")
+        data, unpack = self._map, BINARY_ENTRY.unpack_from
+        index, names, size = self._index, self._names, BINARY_ENTRY.size
+        lo, hi = 0, self.count
+        while lo < hi:
+            mid = (lo + hi) // 2
+            name_offset, name_length, value_offset = unpack(data, index + mid * size)
+            start = names + name_offset
+            if data[start:start + name_length] < key:
+                lo = mid + 1
+            else:
+                hi = mid
+        if lo < self.count:
+            name_offset, name_length, value_offset = unpack(data, index + lo * size)
+            start = names + name_offset
+            if data[start:start + name_length] == key:
+                return value_offset
+        return None
+
+    def value(self, offset):
+        (length,) = BINARY_LENGTH.unpack_from(self._map, offset)
+        return self.read(offset + BINARY_LENGTH.size, length)
+
+    def entries(self):
+        """Yield (account, value offset) in index order, i.e. sorted."""
+        names = self._map[self._names:self._names_end]
+        index = memoryview(self._map)[self._index:self._names]
+        try:
+            for name_offset, name_length, value_offset in BINARY_ENTRY.iter_unpack(index):
+                yield names[name_offset:name_offset + name_length].decode("utf-8"), value_offset
+        finally:
+            index.release()
+
+
+class _BinaryItems(ItemsView):
+    # Walks the file in order instead of searching it for every account
+    def __iter__(self):
+        return self._mapping.iter_items()
+
+
+class BinaryRecords(MutableMapping):
+    """The accounts of a binary vault: the mapped file, plus what changed since.
+
+    Lookups go to the changes first and then to the file's index, so opening
+    a vault costs the same whatever its size; nothing is copied out of the
+    file until it is asked for.
+    """
+
+    def __init__(self, reader=None):
+        self._reader = reader
+        self._changed = {}     # account -> value, set since the file was written
+        self._new = {}         # the accounts of _changed that aren't in the file
+        self._deleted = set()  # accounts of the file deleted since
+
+    def _in_file(self, account):
+        return self._reader is not None and self._reader.find(account) is not None
+
+    def bind(self, reader, saved=False):
+        # Switch to `reader`. If it maps a file just written from these
+        # records, the changes kept in memory are in it and can go.
+        self.close()
+        self._reader = reader
+        if saved:
+            self._changed = {}
+            self._new = {}
+            self._deleted = set()
+
+    def close(self):
+        if self._reader is not None:
+            self._reader.close()
+            self._reader = None
+
+    def adopt(self, other):
+        # Take over the entries and the open file of `other`.
+        self.close()
+        self._reader, other._reader = other._reader, None
+        self._changed, self._new, self._deleted = other._changed, other._new, other._deleted
+
+    def __getitem__(self, account):
+        if account in self._changed:
+            return self._changed[account]
+        if self._reader is not None and account not in self._deleted:
+            offset = self._reader.find(account)
+            if offset is not None:
+                return self._reader.value(offset)
+        raise KeyError(account)
+
+    def __contains__(self, account):
+        if account in self._changed:
+            return True
+        return account not in self._deleted and self._in_file(account)
+
+    def __setitem__(self, account, value):
+        if account not in self._changed:
+            if self._in_file(account):
+                self._deleted.discard(account)
+            else:
+                self._new[account] = None
+        self._changed[account] = value
+
+    def __delitem__(self, account):
+        if account not in self:
+            raise KeyError(account)
+        self._changed.pop(account, None)
+        if self._new.pop(account, _ABSENT) is _ABSENT:
+            self._deleted.add(account)
+
+    def __iter__(self):
+        if self._reader is not None:
+            deleted = self._deleted
+            for account, _ in self._reader.entries():
+                if account not in deleted:
+                    yield account
+        yield from list(self._new)
+
+    def items(self):
+        return _BinaryItems(self)
+
+    def iter_items(self):
+        changed = self._changed
+        if self._reader is not None:
+            deleted = self._deleted
+            for account, offset in self._reader.entries():
+                if account in changed:
+                    yield account, changed[account]
+                elif account not in deleted:
+                    yield account, self._reader.value(offset)
+        for account in list(self._new):
+            yield account, changed[account]
+
+    def __len__(self):
+        count = self._reader.count if self._reader is not None else 0
+        return count - len(self._deleted) + len(self._new)
+
+
+class BinaryStorage(VaultStorage):
+    """The compact binary format described above.
+
+    Account names are stored exactly as typed. load() maps the file and
+    returns at once; values and names are read from the mapping as needed.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.meta = {}
+
+    def load(self):
+        try:
+            reader = BinaryReader(self.path)
+        except FileNotFoundError:
+            self.meta = {}
+            return BinaryRecords()
+        self.meta = reader.meta
+        return BinaryRecords(reader)
+
+    def files(self):
+        return [self.path]
+
+    def _render(self, passwords):
+        keys = sorted(
+            ((account.encode("utf-8"), value) for account, value in passwords.items()),
+            key=lambda item: item[0],
+        )
+        meta = json.dumps(self.meta, ensure_ascii=False).encode("utf-8")
+        names = b"".join(key for key, _ in keys)
+        entries = bytearray(len(keys) * BINARY_ENTRY.size)
+        values = []
+        position = BINARY_HEADER.size + len(meta) + len(entries) + len(names)
+        name_offset = 0
+        for number, (key, value) in enumerate(keys):
+            value = value.encode("utf-8")
+            BINARY_ENTRY.pack_into(entries, number * BINARY_ENTRY.size, name_offset, len(key), position)
+            values.append(BINARY_LENGTH.pack(len(value)))
+            values.append(value)
+            name_offset += len(key)
+            position += BINARY_LENGTH.size + len(value)
+        crc = zlib.crc32(names, zlib.crc32(entries, zlib.crc32(meta)))
+        header = BINARY_HEADER.pack(
+            BINARY_MAGIC, BINARY_VERSION, 0, len(keys), crc, len(meta), len(names)
+        )
+        return b"".join([header, meta, entries, names, *values])
+
+    def save(self, passwords):
+        data = self._render(passwords)
+        if not isinstance(passwords, BinaryRecords):
+            atomic_write(self.path, data)
+            return
+
+        # Windows can't replace a file that is still mapped, so every other
+        # records object on it has to be closed too (see WriteBehindStorage)
+        passwords.close()
+        try:
+            atomic_write(self.path, data)
+        except BaseException:
+            self.reopen(passwords)
+            raise
+        passwords.bind(BinaryReader(self.path), saved=True)
+
+    def reopen(self, passwords):
+        if os.path.exists(self.path):
+            passwords.bind(BinaryReader(self.path))
+
+
+class VaultConflictError(Exception):
+    """Another writer changed some of the same accounts first.
+
+    Nothing was written. `changes` holds what the other writer left those
+    accounts as; `foreign` their other changes, already merged in.
+    """
+
+    def __init__(self, changes, foreign):
+        accounts = ", ".join(sorted(change[1] for change in changes))
+        super().__init__(f"Changed by another program in the meantime: {accounts}")
+        self.changes = changes
+        self.foreign = foreign
+
+
+@contextmanager
+def file_lock(path):
+    # Advisory and exclusive; every JournalStorage on the same vault takes it
+    # around reads and writes, whichever process it is in.
+    fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o600)
+    try:
+        if os.name == "nt":
+            import msvcrt
+
+            while True:
+                try:
+                    msvcrt.locking(fd, msvcrt.LK_LOCK, 1)
+                    break
+                except OSError:  # LK_LOCK gives up after ten seconds
+                    continue
+            try:
+                yield
+            finally:
+                os.lseek(fd, 0, os.SEEK_SET)
+                msvcrt.locking(fd, msvcrt.LK_UNLCK, 1)
+        else:
+            import fcntl
+
+            fcntl.flock(fd, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(fd, fcntl.LOCK_UN)
+    finally:
+        os.close(fd)
+
+
+class JournalStorage(VaultStorage):
+    """A snapshot file plus an append-only journal of changes made since.
+
+    Every call to apply() appends one record to `<path>.journal` and fsyncs it,
+    so a mutation costs O(size of the change) instead of a full rewrite. Once
+    `compact_every` changes have piled up (in any number of records; a bulk
+    import is a single one) the journal is folded back into a fresh snapshot. Loading reads the snapshot and replays the journal on top.
+
+    Several processes can share a vault. Reads and writes happen under
+    `<path>.lock`, and before writing, the journal records others appended
+    since our last look are merged in. If one of them touched an account we
+    are about to write, apply() raises VaultConflictError instead. If someone
+    compacted in the meantime, the new snapshot is diffed against ours.
+    """
+
+    def __init__(self, path, snapshot=None, compact_every=1000):
+        self.path = path
+        self.snapshot = snapshot if snapshot is not None else IniStorage(path)
+        self.journal_path = path + ".journal"
+        self.lock_path = path + ".lock"
+        self.compact_every = compact_every
+        self.pending_records = 0
+        self.pending_changes = 0  # In those records
+        # Why the last compaction apply() started failed, until one works.
+        # The change itself was written; the journal just keeps growing.
+        self.compaction_error = None
+        # The INI vault this one was migrated from, when opened by its name,
+        # and whether that happened just now (see open_storage)
+        self.ini_path = None
+        self.migrated = False
+        self._journal = None
+        # What of the files on disk our records reflect: the identity of the
+        # snapshot file and how far into the journal we have read.
+        self._snapshot_id = None
+        self._journal_offset = 0
+        self._thread_lock = threading.RLock()
+        self._lock_depth = 0
+
+    @property
+    def meta(self):
+        return self.snapshot.meta
+
+    @meta.setter
+    def meta(self, meta):
+        self.snapshot.meta = meta
+
+    @contextmanager
+    def locked(self):
+        with self._thread_lock:
+            if self._lock_depth:
+                self._lock_depth += 1
+                try:
+                    yield
+                finally:
+                    self._lock_depth -= 1
+                return
+            with file_lock(self.lock_path):
+                self._lock_depth = 1
+                try:
+                    yield
+                finally:
+                    self._lock_depth = 0
+
+    def files(self):
+        return self.snapshot.files() + [self.journal_path]
+
+    def reopen(self, passwords):
+        self.snapshot.reopen(passwords)
+
+    def load(self):
+        with metrics.span("storage.load") as span, self.locked():
+            passwords = self.snapshot.load()
+            self._snapshot_id = self._stat_snapshot()
+            self._journal_offset = 0
+            self.pending_records = 0
+            self.pending_changes = 0
+            for changes in self._read_journal():
+                apply_changes(passwords, changes)
+            span.set(entries=len(passwords), journal_records=self.pending_records)
+            if metrics.enabled():
+                span.set(bytes=sum(_file_size(path) for path in self.files()))
+            return passwords
+
+    def save(self, passwords):
+        with metrics.span("storage.save", entries=len(passwords)), self.locked():
+            self.refresh(passwords)
+            self.compact(passwords)
+
+    def refresh(self, passwords):
+        """Merge in what other writers did; return their changes."""
+        with metrics.span("storage.refresh") as span, self.locked():
+            foreign, _ = self._catch_up(passwords, (), {})
+            span.set(foreign=len(foreign))
+            return foreign
+
+    def apply(self, changes, passwords, base=None):
+        """Append `changes`, already applied to `passwords`; return others' changes.
+
+        `base` maps each changed account to its stored value before the
+        change (None if it didn't exist), for telling whether another writer
+        touched it.
+        """
+        if not changes:
+            return []
+        with metrics.span("storage.apply", changes=len(changes)) as span, self.locked():
+            foreign, conflicts = self._catch_up(passwords, changes, base or {})
+            span.set(foreign=len(foreign))
+            if conflicts:
+                raise VaultConflictError(conflicts, foreign)
+            journal = self._open_journal()
+            journal.write(self._encode(changes))
+            journal.flush()
+            os.fsync(journal.fileno())
+            self._journal_offset = journal.tell()
+            self.pending_records += 1
+            self.pending_changes += len(changes)
+            if self.compaction_due:
+                # The change is on disk by now, so a failed compaction (disk
+                # full, say) mustn't fail the write; it's tried again next time.
+                try:
+                    self.compact(passwords)
+                except Exception as error:
+                    metrics.count("storage.compact_failures", error=type(error).__name__)
+                    self.compaction_error = error
+                else:
+                    self.compaction_error = None
+            return foreign
+
+    def compact(self, passwords):
+        # The snapshot is replaced atomically before the journal is emptied. A
+        # crash in between leaves records that are already in the snapshot;
+        # replaying them again is harmless because sets and deletes are
+        # idempotent.
+        with metrics.span("storage.compact", entries=len(passwords)), self.locked():
+            self.snapshot.save(passwords)
+            self.close()
+            with open(self.journal_path, "wb") as journal:
+                os.fsync(journal.fileno())
+            self._snapshot_id = self._stat_snapshot()
+            self._journal_offset = 0
+            self.pending_records = 0
+            self.pending_changes = 0
+
+    @property
+    def compaction_due(self):
+        return self.pending_changes >= self.compact_every
+
+    @property
+    def stale_files(self):
+        """Files of the INI vault written after it was migrated; after load().
+
+        What they hold isn't in this vault.
+        """
+        if self.ini_path is None:
+            return []
+        recorded = json.loads(self.meta.get(MIGRATED_FROM, "{}"))
+        return [
+            path for path, stamp in _ini_stamps(self.ini_path).items()
+            if stamp is not None and stamp != recorded.get(os.path.basename(path))
+        ]
+
+    def close(self):
+        if self._journal is not None:
+            self._journal.close()
+            self._journal = None
+
+    def _open_journal(self):
+        if self._journal is None:
+            # Append mode: every write lands at the current end of the file,
+            # even after another process truncated it.
+            self._journal = open(self.journal_path, "ab")
+        return self._journal
+
+    def _stat_snapshot(self):
+        try:
+            stat = os.stat(self.snapshot.path)
+        except FileNotFoundError:
+            return None
+        return stat.st_ino, stat.st_size, stat.st_mtime_ns
+
+    def _journal_size(self):
+        try:
+            return os.path.getsize(self.journal_path)
+        except FileNotFoundError:
+            return 0
+
+    def _catch_up(self, passwords, changes, base):
+        # Bring `passwords` up to date with the disk, except for the accounts
+        # in `changes`, and sort what the others did into changes to merge and
+        # conflicts with ours.
+        ours = {change[1] for change in changes}
+        if (
+            self._stat_snapshot() != self._snapshot_id
+            or self._journal_size() < self._journal_offset
+        ):
+            return self._reload(passwords, changes, base)
+
+        foreign = []
+        conflicts = {}
+        for record in self._read_journal(self._journal_offset):
+            for change in record:
+                if change[1] in ours:
+                    conflicts[change[1]] = change
+                else:
+                    foreign.append(change)
+        apply_changes(passwords, foreign)
+        return foreign, list(conflicts.values())
+
+    def _reload(self, passwords, changes, base):
+        # Someone compacted, so the records we missed are gone from the
+        # journal. Load the vault afresh and diff it against what we have.
+        ours = {change[1] for change in changes}
+        current = self.load()
+
+        foreign = []
+        for account, stored in current.items():
+            if account in ours:
+                continue
+            if passwords.get(account) != stored:
+                foreign.append((SET, account, stored))
+        for account in passwords:
+            if account not in current and account not in ours:
+                foreign.append((DELETE, account, None))
+
+        conflicts = []
+        for account in ours:
+            stored = current.get(account)
+            if stored != base.get(account):
+                if stored is None:
+                    conflicts.append((DELETE, account, None))
+                else:
+                    conflicts.append((SET, account, stored))
+
+        # Our pending changes stay applied on top, as in the incremental case.
+        apply_changes(current, changes)
+        if type(passwords) is type(current) and hasattr(current, "adopt"):
+            passwords.adopt(current)
+        else:
+            passwords.clear()
+            passwords.update(current)
+        return foreign, conflicts
+
+    # Each record is one line: the CRC32 of the payload in hex, a space and a
+    # JSON list of [operation, account, password] triples. A whole batch of
+    # changes goes into a single record so it is replayed all or nothing.
+    @staticmethod
+    def _encode(changes):
+        payload = json.dumps(
+            [list(change) for change in changes],
+            ensure_ascii=False,
+            separators=(",", ":"),
+        ).encode("utf-8")
+        return b"%08x %s\n" % (zlib.crc32(payload), payload)
+
+    @staticmethod
+    def _decode(line):
+        if not line.endswith(b"\n") or line[8:9] != b" ":
+            return None
+        payload = line[9:-1]
+        try:
+            if int(line[:8], 16) != zlib.crc32(payload):
+                return None
+            return [tuple(change) for change in json.loads(payload)]
+        except ValueError:
+            return None
+
+    def _read_journal(self, start=0):
+        # Yields the change lists recorded from `start` on and advances
+        # _journal_offset past them. Only called with the vault lock held.
+        try:
+            with open(self.journal_path, "rb") as journal:
+                journal.seek(start)
+                data = journal.read()
+        except FileNotFoundError:
+            return
+
+        offset = 0
+        while offset < len(data):
+            end = data.find(b"\n", offset)
+            end = len(data) if end == -1 else end + 1
+            changes = self._decode(data[offset:end])
+            if changes is None:
+                break
+            self.pending_records += 1
+            self.pending_changes += len(changes)
+            yield changes
+            offset = end
+        self._journal_offset = start + offset
+
+        if offset < len(data):
+            # A torn or corrupt tail, left behind by a crash in the middle of
+            # an append. Everything before it is intact; drop the rest so new
+            # records aren't appended after garbage.
+            with open(self.journal_path, "r+b") as journal:
+                journal.truncate(start + offset)
+                os.fsync(journal.fileno())
+
+
+def _file_size(path):
+    try:
+        return os.path.getsize(path)
+    except OSError:
+        return 0
+
+
+def storage_path(path):
+    """The file the vault at `path` lives in: config.ini -> config.vault."""
+    root, extension = os.path.splitext(path)
+    if extension.lower() == ".ini":
+        return root + ".vault"
+    return path
+
+
+def open_storage(path):
+    """Return the storage for the vault at `path`.
+
+    Vaults are binary files with a journal. A path ending in .ini names the
+    old format: the binary vault lives next to it (see storage_path()), and
+    is created from the INI vault the first time; `migrated` tells whether
+    that happened now. The INI vault is left as it was, passwords and all,
+    for the user to delete. Should it change after all, something still
+    writes the old format (an older copy of the app, a script); that is
+    ignored, but listed in `stale_files` so the user can be told.
+    """
+    binary_path = storage_path(path)
+    migrated = False
+    if binary_path != path and not os.path.exists(binary_path):
+        migrated = migrate_ini(path, binary_path)
+    storage = JournalStorage(binary_path, snapshot=BinaryStorage(binary_path))
+    if binary_path != path:
+        storage.ini_path = path
+        storage.migrated = migrated
+    return storage
+
+
+# Meta key of a migrated vault: what the INI files looked like then
+MIGRATED_FROM = "migrated_from"
+
+
+def _ini_stamps(ini_path):
+    # path -> [size, mtime] of the INI vault's files, None if missing
+    stamps = {}
+    for path in (ini_path, ini_path + ".journal"):
+        try:
+            stat = os.stat(path)
+        except FileNotFoundError:
+            stamps[path] = None
+        else:
+            stamps[path] = [stat.st_size, stat.st_mtime_ns]
+    return stamps
+
+
+def migrate_ini(ini_path, binary_path):
+    """Copy an INI vault, journal included, into a new binary vault.
+
+    The INI files are not touched, so nothing is lost if `ini_path` wasn't
+    the vault it seemed to be. Returns whether it migrated; it doesn't if
+    there is no INI vault, or the binary one exists. Raises VaultFormatError
+    for an INI file that isn't a vault.
+    """
+    source = JournalStorage(ini_path)
+    with source.locked():
+        # Checked again under the lock, in case another process migrated
+        if os.path.exists(binary_path) or not any(
+            os.path.exists(path) for path in (ini_path, source.journal_path)
+        ):
+            return False
+        records = source.load()
+        try:
+            target = BinaryStorage(binary_path)
+            target.meta = dict(source.meta)
+            target.meta[MIGRATED_FROM] = json.dumps(
+                {os.path.basename(path): stamp for path, stamp in _ini_stamps(ini_path).items()}
+            )
+            target.save(records)
+            copied = BinaryStorage(binary_path)
+            migrated = copied.load()
+            try:
+                if dict(migrated) != dict(records) or copied.meta != target.meta:
+                    raise VaultFormatError(f"{binary_path} doesn't match {ini_path} after migrating")
+            finally:
+                migrated.close()
+        except BaseException:
+            # Left for the next attempt; the INI vault is still in use until then
+            try:
+                os.unlink(binary_path)
+            except FileNotFoundError:
+                pass
+            raise
+        finally:
+            records.close()
+            source.close()
+    return True
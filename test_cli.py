@@ -0,0 +1,48 @@
+import os
+import socket
+
+import cli
+
+
+def test_list_and_get_without_unix_sockets(tmp_path, monkeypatch, capsys):
+    # As on Windows: no daemon to ask, so the vault is opened directly
+    vault_path = str(tmp_path / "test.ini")
+    manager = cli.PasswordManager(vault_path)
+    manager.add_password("github", "hunter2")
+    manager.close()
+    monkeypatch.delattr(os, "getuid")
+    monkeypatch.delattr(socket, "AF_UNIX")
+
+    assert cli.main(["--vault", vault_path, "list"]) == 0
+    assert cli.main(["--vault", vault_path, "get", "github"]) == 0
+    assert capsys.readouterr().out == "github\nhunter2\n"
+    assert cli.main(["--vault", vault_path, "daemon"]) == 1
+    assert "isn't supported" in capsys.readouterr().err
+
+
+def test_generate_with_character_classes(tmp_path, capsys):
+    vault_path = str(tmp_path / "test.ini")
+    argv = ["--vault", vault_path, "add", "--generate", "--length", "30"]
+    assert cli.main(argv + ["github", "--classes", "digits"]) == 0
+    password = capsys.readouterr().out.strip()
+    assert len(password) == 30 and password.isdigit()
+    assert cli.main(argv + ["gitlab", "--classes", "digits,emoji"]) == 1
+    assert "unknown character class: emoji" in capsys.readouterr().err
+
+
+def test_list_query_scans_without_building_the_index(tmp_path, monkeypatch, capsys):
+    import search_index
+
+    vault_path = str(tmp_path / "test.vault")
+    manager = cli.PasswordManager(vault_path)
+    manager.add_many({"Gmail-work": "1", "github": "2", "my-gmail": "3"})
+    manager.close()
+
+    def no_index(*args):
+        raise AssertionError("built the index")
+
+    monkeypatch.setattr(search_index, "AccountIndex", no_index)
+    assert cli.main(["--vault", vault_path, "--no-daemon", "list", "gmail"]) == 0
+    assert capsys.readouterr().out == "Gmail-work\nmy-gmail\n"
+    assert cli.main(["--vault", vault_path, "--no-daemon", "list", "gi"]) == 0
+    assert capsys.readouterr().out == "github\n"
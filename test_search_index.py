@@ -0,0 +1,84 @@
+from search_index import AccountIndex, scan
+
+NAMES = ["Gmail-work", "github", "gmail-home", "bank", "GitLab", "my-gmail", "ab", "a"]
+
+
+def expected(names, query):
+    query = query.lower()
+    if len(query) < 3:
+        return [name for name in names if name.lower().startswith(query)]
+    return [name for name in names if query in name.lower()]
+
+
+def test_results_match_a_scan():
+    index = AccountIndex(NAMES)
+    for query in ["", "g", "gi", "GM", "gma", "gmail", "mail-", "l-h", "zzz", "a", "ab", "abc"]:
+        results = index.search(query)
+        assert list(results) == (NAMES if not query else expected(NAMES, query)), query
+        assert len(results) == len(list(results))
+
+
+def test_results_are_found_lazily():
+    names = [f"account-{i:05d}" for i in range(10000)]
+    results = AccountIndex(names).search("account-")
+    assert results[:10] == names[:10]
+    assert not results.complete
+    assert results[-1] == names[-1]
+    assert results.complete
+
+
+def test_index_follows_changes():
+    index = AccountIndex(NAMES)
+    stale = index.search("gmail")
+    index.discard("my-gmail")
+    index.add("gmail-new")
+    names = [name for name in NAMES if name != "my-gmail"] + ["gmail-new"]
+    assert list(index.search("gmail")) == expected(names, "gmail")
+    assert list(index.search("gm")) == expected(names, "gm")
+    # Results taken before the change skip discarded accounts
+    assert "my-gmail" not in list(stale)
+
+
+def test_extending_the_query_narrows_the_previous_results():
+    index = AccountIndex(NAMES)
+    assert len(index.search("gma")) == 3
+    assert list(index.search("gmail-")) == ["Gmail-work", "gmail-home"]
+    assert list(index.search("gmail-h")) == ["gmail-home"]
+
+
+def test_scan_matches_the_index():
+    index = AccountIndex(NAMES)
+    for query in ["", "g", "GI", "gma", "mail-", "zzz", "ab"]:
+        assert list(scan(NAMES, query)) == list(index.search(query)), query
+
+
+def test_index_built_in_background_catches_up(tmp_path, monkeypatch):
+    import threading
+
+    import search_index
+    from vault import PasswordManager
+
+    manager = PasswordManager(str(tmp_path / "test.vault"))
+    manager.add_many({name: "x" for name in NAMES})
+    release = threading.Event()
+
+    class SlowIndex(AccountIndex):
+        def __init__(self, accounts=()):
+            release.wait()
+            super().__init__(accounts)
+
+    monkeypatch.setattr(search_index, "AccountIndex", SlowIndex)
+    manager.build_index_in_background()
+    # Meanwhile searches scan, and changes are kept for the index
+    manager.delete_password("my-gmail")
+    manager.add_password("gmail-new", "x")
+    names = [name for name in NAMES if name != "my-gmail"] + ["gmail-new"]
+    assert list(manager.search("gmail")) == expected(names, "gmail")
+    assert not manager.index_built
+
+    release.set()
+    manager.index  # Waits for it
+    assert manager.index_built
+    assert list(manager.search("gmail")) == expected(names, "gmail")
+    assert list(manager.search("gm")) == expected(names, "gm")
+    manager.close()
@@ -0,0 +1,178 @@
+import os
+
+import pytest
+
+from storage import SET, BinaryStorage, JournalStorage, VaultFormatError, open_storage
+from vault import PasswordManager
+
+
+def open_journal(path, compact_every=1000):
+    return JournalStorage(path, snapshot=BinaryStorage(path), compact_every=compact_every)
+
+
+@pytest.fixture
+def vault_path(tmp_path):
+    return str(tmp_path / "test.vault")
+
+
+def test_journal_is_replayed_on_load(vault_path):
+    manager = PasswordManager(vault_path, storage=open_journal(vault_path))
+    manager.add_password("a", "1")
+    manager.add_many({"b": "2", "c": "3"})
+    manager.delete_password("a")
+    manager.close()
+    assert not os.path.exists(vault_path)  # Nothing compacted yet
+
+    storage = open_journal(vault_path)
+    assert dict(storage.load()) == {"b": "2", "c": "3"}
+    assert storage.pending_records == 3
+
+
+def test_torn_tail_is_dropped_and_truncated(vault_path):
+    manager = PasswordManager(vault_path, storage=open_journal(vault_path))
+    manager.add_password("a", "1")
+    manager.add_password("b", "2")
+    manager.close()
+    journal_path = vault_path + ".journal"
+    intact = os.path.getsize(journal_path)
+    # A crash in the middle of appending the next record
+    with open(journal_path, "ab") as journal:
+        journal.write(JournalStorage._encode([(SET, "c", "3")])[:-5])
+
+    storage = open_journal(vault_path)
+    assert dict(storage.load()) == {"a": "1", "b": "2"}
+    assert os.path.getsize(journal_path) == intact
+
+    # New records go after the intact ones, not after the garbage
+    manager = PasswordManager(vault_path, storage=storage)
+    manager.add_password("d", "4")
+    manager.close()
+    assert dict(open_journal(vault_path).load()) == {"a": "1", "b": "2", "d": "4"}
+
+
+def test_corrupt_record_stops_replay(vault_path):
+    manager = PasswordManager(vault_path, storage=open_journal(vault_path))
+    manager.add_password("a", "1")
+    manager.close()
+    journal_path = vault_path + ".journal"
+    with open(journal_path, "ab") as journal:
+        record = bytearray(JournalStorage._encode([(SET, "b", "2")]))
+        record[12] ^= 0xFF  # Fails the CRC
+        journal.write(record)
+        journal.write(JournalStorage._encode([(SET, "c", "3")]))
+
+    assert dict(open_journal(vault_path).load()) == {"a": "1"}
+
+
+def test_records_already_in_snapshot_replay_harmlessly(vault_path):
+    # A crash between writing the snapshot and emptying the journal
+    manager = PasswordManager(vault_path, storage=open_journal(vault_path))
+    manager.add_many({"a": "1", "b": "2"})
+    manager.delete_password("a")
+    journal_path = vault_path + ".journal"
+    with open(journal_path, "rb") as journal:
+        records = journal.read()
+    manager.storage.compact(manager._records)
+    manager.close()
+    with open(journal_path, "wb") as journal:
+        journal.write(records)
+
+    assert dict(open_journal(vault_path).load()) == {"b": "2"}
+
+
+def test_failed_compaction_keeps_the_write(vault_path, monkeypatch):
+    manager = PasswordManager(vault_path, storage=open_journal(vault_path, compact_every=1))
+
+    def disk_full(self, passwords):
+        raise OSError(28, "No space left on device")
+
+    monkeypatch.setattr(BinaryStorage, "save", disk_full)
+    manager.add_password("x", "1")
+    assert dict(manager.PASSWORDS) == {"x": "1"}
+    assert isinstance(manager.storage.compaction_error, OSError)
+    manager.close()
+    monkeypatch.undo()
+
+    storage = open_journal(vault_path, compact_every=1)
+    reopened = PasswordManager(vault_path, storage=storage)
+    assert dict(reopened.PASSWORDS) == {"x": "1"}
+    # The next write compacts again, and clears the error
+    reopened.add_password("y", "2")
+    assert storage.compaction_error is None
+    assert os.path.getsize(vault_path + ".journal") == 0
+    reopened.close()
+    assert dict(open_journal(vault_path).load()) == {"x": "1", "y": "2"}
+
+
+def test_failed_encryption_leaves_the_vault_plaintext(vault_path, monkeypatch):
+    manager = PasswordManager(vault_path, storage=open_journal(vault_path))
+    manager.add_password("a", "1")
+
+    def disk_full(self, passwords):
+        raise OSError(28, "No space left on device")
+
+    monkeypatch.setattr(BinaryStorage, "save", disk_full)
+    with pytest.raises(OSError):
+        manager.enable_encryption("master")
+    assert not manager.encrypted
+    assert dict(manager.PASSWORDS) == {"a": "1"}
+    assert manager.storage.meta == {}
+    monkeypatch.undo()
+
+    manager.enable_encryption("master")
+    manager.close()
+    reopened = PasswordManager(vault_path, storage=open_journal(vault_path), master_password="master")
+    assert dict(reopened.PASSWORDS) == {"a": "1"}
+    reopened.close()
+
+
+def test_ini_vault_is_migrated_and_left_alone(tmp_path):
+    ini_path = str(tmp_path / "config.ini")
+    old = PasswordManager(ini_path, storage=JournalStorage(ini_path))
+    old.add_many({"a": "1", "b": "2"})
+    old.close()
+    with open(ini_path + ".journal", "rb") as journal:
+        before = journal.read()
+
+    storage = open_storage(ini_path)
+    assert storage.migrated
+    assert dict(storage.load()) == {"a": "1", "b": "2"}
+    assert storage.stale_files == []
+    storage.close()
+    with open(ini_path + ".journal", "rb") as journal:
+        assert journal.read() == before
+    assert not open_storage(ini_path).migrated
+
+    # Something still writing the old format isn't read, but it is noticed
+    old = PasswordManager(ini_path, storage=JournalStorage(ini_path))
+    old.add_password("c", "3")
+    old.close()
+    storage = open_storage(ini_path)
+    assert "c" not in storage.load()
+    assert storage.stale_files == [ini_path + ".journal"]
+    storage.close()
+
+
+@pytest.mark.parametrize("content", ["[core]\nbare = false\n", "no = sections\n"])
+def test_other_ini_files_are_not_migrated(tmp_path, content):
+    ini_path = str(tmp_path / "gitconfig.ini")
+    with open(ini_path, "w") as ini:
+        ini.write(content)
+    with pytest.raises(VaultFormatError):
+        open_storage(ini_path)
+    with open(ini_path) as ini:
+        assert ini.read() == content
+    assert not os.path.exists(str(tmp_path / "gitconfig.vault"))
+
+
+def test_bulk_change_is_compacted(vault_path):
+    # One record, but more changes than compact_every: loading it later
+    # mustn't mean replaying the whole vault from the journal
+    manager = PasswordManager(vault_path, storage=open_journal(vault_path, compact_every=10))
+    manager.add_many({f"account-{number}": str(number) for number in range(25)})
+    manager.close()
+    assert os.path.getsize(vault_path + ".journal") == 0
+
+    storage = open_journal(vault_path, compact_every=10)
+    assert len(storage.load()) == 25
+    assert storage.pending_changes == 0
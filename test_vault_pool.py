@@ -0,0 +1,40 @@
+from vault_pool import VaultPool
+
+
+class FakeManager:
+    def __init__(self, path):
+        self.config_file = path
+        self.closed = False
+        self.index_built = False
+
+    class storage:
+        @staticmethod
+        def files():
+            return []
+
+    def close(self):
+        self.closed = True
+
+
+def test_current_vault_stays_open_until_the_switch_is_done(tmp_path):
+    pool = VaultPool(max_open=2, opener=FakeManager)
+    first = pool.open(str(tmp_path / "first.vault"))
+    pool.use(first)
+    second = pool.open(str(tmp_path / "second.vault"))
+    # Opening a third one, maybe to give up on it (a wrong master password),
+    # mustn't close the vault still in use
+    third = pool.open(str(tmp_path / "third.vault"))
+    assert len(pool) == 3 and not first.closed
+
+    # Then the least recently used one goes
+    pool.use(third)
+    assert first.closed and not second.closed and not third.closed
+    assert len(pool) == 2
+
+
+def test_ini_and_vault_names_are_one_vault(tmp_path):
+    pool = VaultPool(opener=FakeManager)
+    first = pool.open(str(tmp_path / "config.ini"))
+    assert pool.open(str(tmp_path / "config.vault")) is first
+    assert str(tmp_path / "config.vault") in pool
+    assert len(pool) == 1
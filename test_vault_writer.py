@@ -0,0 +1,141 @@
+import threading
+
+import pytest
+
+from storage import VaultConflictError
+from vault import PasswordManager
+from vault_writer import WriteBehindStorage
+
+
+@pytest.fixture
+def vault_path(tmp_path):
+    return str(tmp_path / "test.vault")
+
+
+def open_with_writer(path, errors):
+    manager = PasswordManager(path)
+    manager.storage = WriteBehindStorage(manager, on_error=errors.append)
+    return manager
+
+
+def on_disk(path):
+    manager = PasswordManager(path)
+    try:
+        return dict(manager.PASSWORDS)
+    finally:
+        manager.close()
+
+
+def test_change_merged_but_not_delivered_is_a_conflict(vault_path, monkeypatch):
+    errors = []
+    manager = open_with_writer(vault_path, errors)
+    manager.add_many({"x": "1", "y": "1"})
+    assert manager.storage.flush() is None
+    other = PasswordManager(vault_path)
+    other.edit_password("x", "theirs")
+    other.close()
+
+    # The write of y merges their x, which the manager doesn't get yet
+    manager.edit_password("y", "2")
+    monkeypatch.setattr(manager.storage, "deliver", lambda: None)
+    manager.storage.flush()
+    monkeypatch.undo()
+    manager.edit_password("x", "ours")
+    manager.storage.flush()
+
+    assert [type(error) for error in errors] == [VaultConflictError]
+    assert dict(manager.PASSWORDS) == {"x": "theirs", "y": "2"}
+    manager.close()
+    assert on_disk(vault_path) == {"x": "theirs", "y": "2"}
+
+
+def test_conflict_keeps_the_rest_of_the_batch(vault_path, monkeypatch):
+    errors = []
+    manager = open_with_writer(vault_path, errors)
+    manager.add_many({"x": "1", "y": "1", "old": "1"})
+    writer = manager.storage
+    assert writer.flush() is None
+
+    # Hold the worker up so the edits below go out as one batch
+    release = threading.Event()
+    blocked = threading.Event()
+
+    def slow_refresh(passwords):
+        blocked.set()
+        release.wait()
+        return []
+
+    monkeypatch.setattr(writer.inner, "refresh", slow_refresh)
+    manager.refresh()
+    blocked.wait()
+    other = PasswordManager(vault_path)
+    other.edit_password("x", "theirs")
+    other.add_password("new", "theirs")
+    other.close()
+    manager.edit_password("x", "ours")
+    manager.edit_password("y", "2")
+    manager.rename_password("old", "new", "1")
+    release.set()
+    writer.flush()
+
+    assert [type(error) for error in errors] == [VaultConflictError]
+    # The rename lost on "new", so "old" isn't deleted either
+    assert dict(manager.PASSWORDS) == {"x": "theirs", "y": "2", "old": "1", "new": "theirs"}
+    manager.close()
+    assert on_disk(vault_path) == {"x": "theirs", "y": "2", "old": "1", "new": "theirs"}
+
+
+def test_vault_file_is_only_replaced_with_the_managers_map_closed(vault_path, monkeypatch):
+    import storage
+
+    manager = PasswordManager(vault_path)
+    manager.storage.compact_every = 3
+    errors = []
+    writer = manager.storage = WriteBehindStorage(manager, on_error=errors.append)
+    replaced = []
+    atomic_write = storage.atomic_write
+
+    def checked_atomic_write(path, data):
+        # Windows refuses to replace a mapped file
+        replaced.append(manager._records._reader is None)
+        atomic_write(path, data)
+
+    monkeypatch.setattr(storage, "atomic_write", checked_atomic_write)
+    for number in range(7):
+        manager.add_password(f"account-{number}", str(number))
+        assert writer.flush() is None
+    assert replaced == [True, True]
+    assert manager.PASSWORDS["account-0"] == "0"
+
+    manager.enable_encryption("master")
+    assert replaced == [True, True, True]
+    assert manager.PASSWORDS["account-6"] == "6"
+    manager.close()
+    assert errors == []
+
+    reopened = PasswordManager(vault_path, master_password="master")
+    assert dict(reopened.PASSWORDS) == {f"account-{number}": str(number) for number in range(7)}
+    reopened.close()
+
+
+def test_failed_encryption_through_the_writer_leaves_the_vault_plaintext(vault_path, monkeypatch):
+    from storage import BinaryStorage
+
+    errors = []
+    manager = open_with_writer(vault_path, errors)
+    manager.add_password("a", "1")
+    assert manager.storage.flush() is None
+
+    def disk_full(self, passwords):
+        raise OSError(28, "No space left on device")
+
+    monkeypatch.setattr(BinaryStorage, "save", disk_full)
+    with pytest.raises(OSError):
+        manager.enable_encryption("master")
+    monkeypatch.undo()
+    assert not manager.encrypted
+    # Later writes are plaintext too, not values nobody can decrypt
+    manager.add_password("b", "2")
+    manager.close()
+    assert errors == []
+    assert on_disk(vault_path) == {"a": "1", "b": "2"}
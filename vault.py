@@ -0,0 +1,300 @@
+import threading
+from contextlib import contextmanager
+
+import metrics
+from storage import DELETE, SET, VaultConflictError, apply_changes, open_storage
+from vault_crypto import EncryptedPasswords, VaultCipher, is_encrypted
+
+_MISSING = object()
+
+
+class PasswordManager:
+    def __init__(self, config_file="config.ini", storage=None, master_password=None):
+        self.config_file = config_file
+        # A binary vault next to config.ini (moved over from it on first use).
+        # Mutations are appended to a journal and folded back into the vault
+        # from time to time, instead of rewriting it every time.
+        self.storage = storage if storage is not None else open_storage(config_file)
+        # _records holds the values as stored: plain passwords, or tokens for
+        # an encrypted vault. PASSWORDS is what the app reads and writes; for
+        # an encrypted vault it decrypts a value only when it is looked up.
+        self._records = self.load_passwords()
+        self.cipher = None
+        if is_encrypted(self.storage.meta):
+            self.PASSWORDS = EncryptedPasswords(self._records)
+            if master_password is not None:
+                self.unlock(master_password)
+        else:
+            self.PASSWORDS = self._records
+        # Changes made inside transaction(), keyed by account, and the values
+        # the touched accounts had before it started. None outside one.
+        self._pending = None
+        self._undo = None
+        self._index = None
+        # While the index is built in the background: (thread, [index], the
+        # names it is built from), and the changes made meanwhile, for it to
+        # catch up on
+        self._index_building = None
+        self._index_backlog = None
+        # Called with the list of changes whenever changes made by another
+        # process are merged in
+        self.listeners = []
+
+    def load_passwords(self):
+        with metrics.span("vault.load") as span:
+            records = self.storage.load()
+            span.set(entries=len(records))
+            return records
+
+    def save_passwords(self):
+        # Writes out the whole vault; single changes go through _commit().
+        with metrics.span("vault.save", entries=len(self._records)):
+            self.refresh()
+            self.storage.save(self._records)
+
+    @property
+    def encrypted(self):
+        return isinstance(self.PASSWORDS, EncryptedPasswords)
+
+    @property
+    def locked(self):
+        return self.encrypted and self.cipher is None
+
+    def unlock(self, master_password):
+        # The only place the KDF runs for an existing vault; the key is kept
+        # for the rest of the session. Raises WrongMasterPasswordError.
+        self.cipher = VaultCipher.unlock(master_password, self.storage.meta)
+        self.PASSWORDS.cipher = self.cipher
+
+    def lock(self):
+        self.cipher = None
+        if self.encrypted:
+            self.PASSWORDS.cipher = None
+
+    def enable_encryption(self, master_password):
+        """Encrypt every password under `master_password`; there is no way back."""
+        if self.encrypted:
+            raise ValueError("The vault is already encrypted.")
+        # Others' changes first, while they are plaintext like ours
+        self.refresh()
+        cipher, meta = VaultCipher.create(master_password)
+        plain = dict(self._records)
+        old_meta = dict(self.storage.meta)
+        apply_changes(
+            self._records,
+            [(SET, account, cipher.encrypt(account, password)) for account, password in plain.items()],
+        )
+        self.storage.meta.update(meta)
+        try:
+            # A full snapshot, which also empties the journal of plaintext records
+            with metrics.span("vault.save", entries=len(self._records)):
+                self.storage.save(self._records)
+        except BaseException:
+            # Still the plaintext vault it was, on disk and here
+            self.storage.meta = old_meta
+            apply_changes(self._records, [(SET, account, password) for account, password in plain.items()])
+            raise
+        self.cipher = cipher
+        self.PASSWORDS = EncryptedPasswords(self._records, cipher)
+
+    @property
+    def index(self):
+        # Built on first search (or see build_index_in_background()), then
+        # kept current by _commit().
+        if self._index is None:
+            if self._index_building is not None:
+                self._index_building[0].join()
+                self._finish_index()
+            else:
+                from search_index import AccountIndex
+
+                self._index = AccountIndex(self._records)
+        return self._index
+
+    @property
+    def index_built(self):
+        return self._index is not None
+
+    def build_index_in_background(self):
+        """Start building the search index on a thread; searches don't wait for it.
+
+        Until it is done they check every name instead (see search_index.scan),
+        which for the first screenful of results takes a few milliseconds
+        rather than the second or so the index takes over 100k accounts.
+        """
+        if self._index is not None or self._index_building is not None:
+            return
+        from search_index import AccountIndex
+
+        names = list(self._records)
+        built = []
+        thread = threading.Thread(
+            target=lambda: built.append(AccountIndex(names)), name="search-index", daemon=True
+        )
+        self._index_building = (thread, built, names)
+        self._index_backlog = []
+        thread.start()
+
+    def _finish_index(self):
+        _, built, _ = self._index_building
+        if built:
+            self._index = built[0]
+            self._index.update(self._index_backlog)
+        else:  # The thread failed; a MemoryError, say
+            from search_index import AccountIndex
+
+            self._index = AccountIndex(self._records)
+        self._index_building = None
+        self._index_backlog = None
+
+    def search(self, query):
+        if self._index_building is not None:
+            thread, _, names = self._index_building
+            if thread.is_alive():
+                from search_index import scan
+
+                if self._index_backlog:
+                    # Changed accounts go last, as they would in the index
+                    changed = dict.fromkeys(change[1] for change in self._index_backlog)
+                    names = [name for name in names if name not in changed]
+                    names += [account for account in changed if account in self._records]
+                return scan(names, query)
+            self._finish_index()
+        return self.index.search(query)
+
+    def _update_index(self, changes):
+        if self._index is not None:
+            self._index.update(changes)
+        elif self._index_backlog is not None:
+            self._index_backlog.extend(changes)
+
+    def _commit(self, changes):
+        self._update_index(changes)
+        # Only the last change to each account matters at commit time.
+        for change in changes:
+            self._pending[change[1]] = change
+
+    def _set(self, account, password):
+        self.PASSWORDS[account] = password
+        return (SET, account, self._records[account])
+
+    def _remember(self, *accounts):
+        for account in accounts:
+            self._undo.setdefault(account, self._records.get(account, _MISSING))
+
+    def _merged(self, changes):
+        # Changes other writers made, already applied to _records by storage
+        if changes:
+            self._update_index(changes)
+            for listener in self.listeners:
+                listener(changes)
+        return changes
+
+    def refresh(self):
+        """Pick up what other processes wrote to the vault; return their changes."""
+        return self._merged(self.storage.refresh(self._records))
+
+    def merge(self, changes):
+        """Apply changes found on disk by someone else, e.g. a background writer."""
+        apply_changes(self._records, changes)
+        return self._merged(changes)
+
+    @contextmanager
+    def transaction(self):
+        """Group mutations so they are persisted once, or not at all.
+
+        Inside the block changes only touch PASSWORDS; they are written in a
+        single storage call when it exits. If it raises, PASSWORDS is put back
+        the way it was and nothing is written. Nested blocks join the outer one.
+        If another process changed one of the same accounts first, this raises
+        VaultConflictError and those accounts take the other process's values.
+        """
+        if self._pending is not None:
+            yield self
+            return
+
+        self._pending = {}
+        self._undo = {}
+        try:
+            yield self
+            changes = list(self._pending.values())
+            base = {
+                account: None if record is _MISSING else record
+                for account, record in self._undo.items()
+            }
+            self._pending = None
+            metrics.count("vault.changes", len(changes))
+            self._merged(self.storage.apply(changes, self._records, base))
+        except BaseException as error:
+            self._rollback()
+            if isinstance(error, VaultConflictError):
+                metrics.count("vault.conflicts")
+                apply_changes(self._records, error.changes)
+                self._merged(error.changes + error.foreign)
+            raise
+        finally:
+            self._pending = None
+            self._undo = None
+
+    def _rollback(self):
+        for account, record in self._undo.items():
+            if record is _MISSING:
+                self._records.pop(account, None)
+                change = (DELETE, account, None)
+            else:
+                self._records[account] = record
+                change = (SET, account, record)
+            self._update_index([change])
+
+    def add_password(self, account, password):
+        with self.transaction():
+            self._remember(account)
+            self._commit([self._set(account, password)])
+
+    def delete_password(self, account):
+        if account in self._records:
+            with self.transaction():
+                self._remember(account)
+                del self._records[account]
+                self._commit([(DELETE, account, None)])
+
+    def edit_password(self, account, password):
+        if account in self._records:
+            with self.transaction():
+                self._remember(account)
+                self._commit([self._set(account, password)])
+
+    def rename_password(self, old_account, new_account, password):
+        # Recorded as one change set so a crash can't keep just half of it.
+        # Encrypted values are bound to their account name, so the value is
+        # sealed again under the new one.
+        with self.transaction():
+            self._remember(old_account, new_account)
+            self._records.pop(old_account, None)
+            self._commit([(DELETE, old_account, None), self._set(new_account, password)])
+
+    # Bulk variants; each one is a single transaction.
+    def add_many(self, items):
+        items = items.items() if hasattr(items, "items") else items
+        with self.transaction():
+            for account, password in items:
+                self.add_password(account, password)
+
+    def update_many(self, items):
+        items = items.items() if hasattr(items, "items") else items
+        with self.transaction():
+            for account, password in items:
+                self.edit_password(account, password)
+
+    def delete_many(self, accounts):
+        with self.transaction():
+            for account in accounts:
+                self.delete_password(account)
+
+    def get_passwords(self):
+        return self.PASSWORDS
+
+    def close(self):
+        self.storage.close()
+        if hasattr(self._records, "close"):
+            self._records.close()
@@ -0,0 +1,267 @@
+"""Vault audit: weak passwords, passwords used for several accounts, and
+passwords that appear in a breached-password list.
+
+The breach list is the Have I Been Pwned "Pwned Passwords" download in its
+SHA-1, ordered-by-hash form (one `HASH:count` line per password, tens of
+gigabytes). Searching that text for every vault password would take far
+too long, so it is converted once, with BreachIndex.build(), into a file
+that maps the first 20 bits of a hash to a bucket of the following 64 bits,
+sorted. A lookup is two reads in the bucket table and a binary search of
+about a thousand entries in a memory map, so the 100k passwords of a big
+vault are checked in about a second. Matching on 80 bits of the hash makes
+a false alarm about as likely as a collision of random 80-bit keys.
+"""
+import hashlib
+import math
+import mmap
+import os
+import string
+import struct
+import sys
+from array import array
+
+# Below this many bits a password counts as weak
+WEAK_BITS = 50
+# ...and from this many on, strong
+STRONG_BITS = 80
+
+# Character pools a password is assumed to have been drawn from. Each
+# character is translated to its pool's marker, so a password's pools are
+# the set of markers left.
+POOLS = {
+    "a": (string.ascii_lowercase, 26),
+    "A": (string.ascii_uppercase, 26),
+    "0": (string.digits, 10),
+    "!": (string.punctuation + " ", 33),
+}
+POOL_MARKERS = str.maketrans({char: marker for marker, (chars, _) in POOLS.items() for char in chars})
+OTHER_POOL = 100  # Anything else: accented letters, other scripts
+
+BREACH_MAGIC = b"EZPBREAC"
+BREACH_VERSION = 1
+BREACH_PREFIX_BITS = 20
+BREACH_BUCKETS = 1 << BREACH_PREFIX_BITS
+# magic, version, prefix bits, entry count
+BREACH_HEADER = struct.Struct("<8sHHQ")
+BREACH_OFFSET = struct.Struct("<Q")
+BREACH_KEY = slice(2, 10)  # Digest bytes stored per entry; the first 16 bits are the bucket's
+BREACH_ENTRY_SIZE = 8
+BREACH_TABLE_START = BREACH_HEADER.size
+BREACH_ENTRIES_START = BREACH_TABLE_START + (BREACH_BUCKETS + 1) * BREACH_OFFSET.size
+
+# Lines between two progress callbacks while building
+PROGRESS_EVERY = 1000000
+
+
+class BreachListError(ValueError):
+    pass
+
+
+def _bits_per_char(markers):
+    pool = sum(POOLS[marker][1] for marker in markers if marker in POOLS)
+    if not markers.issubset(POOLS):
+        pool += OTHER_POOL
+    return math.log2(pool) if pool else 0.0
+
+
+def estimate_entropy(password):
+    """Bits of a brute-force search over the character pools `password` uses.
+
+    An upper bound: "Password1!" scores like random characters would, so
+    this catches short and single-class passwords, not guessable ones. The
+    breach list is what catches those.
+    """
+    return len(password) * _bits_per_char(frozenset(password.translate(POOL_MARKERS)))
+
+
+def score_passwords(passwords):
+    """Map each distinct password in `passwords` to estimate_entropy()."""
+    # Most passwords use one of a handful of pool combinations; each one's
+    # bits per character are worked out once.
+    per_char = {}
+    scores = {}
+    for password in set(passwords):
+        markers = frozenset(password.translate(POOL_MARKERS))
+        bits = per_char.get(markers)
+        if bits is None:
+            bits = per_char[markers] = _bits_per_char(markers)
+        scores[password] = len(password) * bits
+    return scores
+
+
+def find_reused(items):
+    """Group accounts by password; return the groups of more than one account."""
+    accounts = {}
+    for account, password in items:
+        accounts.setdefault(password, []).append(account)
+    return [sorted(group) for group in accounts.values() if len(group) > 1]
+
+
+def _bucket(digest):
+    return int.from_bytes(digest[:3], "big") >> (24 - BREACH_PREFIX_BITS)
+
+
+class BreachIndex:
+    """The breached-password list, converted for fast lookups; see the module docstring."""
+
+    def __init__(self, path):
+        self.path = path
+        self._map = None
+        self._file = open(path, "rb")
+        if os.fstat(self._file.fileno()).st_size < BREACH_ENTRIES_START:
+            self.close()
+            raise BreachListError(f"{path} is not a breach index (see BreachIndex.build).")
+        self._map = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, version, bits, self.count = BREACH_HEADER.unpack_from(self._map)
+        if magic != BREACH_MAGIC or bits != BREACH_PREFIX_BITS:
+            self.close()
+            raise BreachListError(f"{path} is not a breach index (see BreachIndex.build).")
+        if version != BREACH_VERSION:
+            self.close()
+            raise BreachListError(f"{path} is a newer breach index version ({version}).")
+
+    def close(self):
+        if self._map is not None:
+            self._map.close()
+            self._map = None
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def contains_digest(self, digest):
+        data = self._map
+        offset = BREACH_TABLE_START + _bucket(digest) * BREACH_OFFSET.size
+        low, high = struct.unpack_from("<QQ", data, offset)
+        key = digest[BREACH_KEY]
+        while low < high:
+            middle = (low + high) // 2
+            start = BREACH_ENTRIES_START + middle * BREACH_ENTRY_SIZE
+            entry = data[start:start + BREACH_ENTRY_SIZE]
+            if entry < key:
+                low = middle + 1
+            elif entry > key:
+                high = middle
+            else:
+                return True
+        return False
+
+    def __contains__(self, password):
+        return self.contains_digest(hashlib.sha1(password.encode("utf-8")).digest())
+
+    def breached(self, passwords):
+        """Return the set of `passwords` that are in the list."""
+        digests = {hashlib.sha1(password.encode("utf-8")).digest(): password for password in set(passwords)}
+        # In hash order, so neighbouring lookups touch neighbouring pages
+        return {digests[digest] for digest in sorted(digests) if self.contains_digest(digest)}
+
+    @staticmethod
+    def build(source, target, progress=None):
+        """Convert a `HASH[:count]` list sorted by hash into an index at `target`.
+
+        `progress` is called with the number of lines read, now and then.
+        Returns the number of distinct hashes.
+        """
+        temporary = f"{target}.tmp"
+        try:
+            count = BreachIndex._write(source, temporary, progress)
+        except BaseException:
+            try:
+                os.unlink(temporary)
+            except FileNotFoundError:
+                pass
+            raise
+        os.replace(temporary, target)
+        return count
+
+    @staticmethod
+    def _write(source, target, progress):
+        counts = array("Q", bytes(8 * (BREACH_BUCKETS + 1)))
+        count = 0
+        previous = b""
+        with open(source, "rb") as lines, open(target, "wb") as index:
+            index.seek(BREACH_ENTRIES_START)
+            chunk = []
+            for number, line in enumerate(lines, 1):
+                try:
+                    digest = bytes.fromhex(line[:40].decode("ascii"))
+                except (UnicodeDecodeError, ValueError):
+                    digest = b""
+                if len(digest) != 20:
+                    if not line.strip():
+                        continue
+                    raise BreachListError(f"{source}, line {number}: not a SHA-1 hash.")
+                if digest <= previous:
+                    if digest == previous:
+                        continue
+                    raise BreachListError(
+                        f"{source}, line {number}: the list must be sorted by hash "
+                        "(the 'ordered by hash' download)."
+                    )
+                previous = digest
+                counts[_bucket(digest) + 1] += 1
+                chunk.append(digest[BREACH_KEY])
+                count += 1
+                if len(chunk) == 65536:
+                    index.write(b"".join(chunk))
+                    chunk.clear()
+                if progress is not None and number % PROGRESS_EVERY == 0:
+                    progress(number)
+            index.write(b"".join(chunk))
+            # Bucket b holds entries table[b] to table[b + 1]
+            for bucket in range(1, BREACH_BUCKETS + 1):
+                counts[bucket] += counts[bucket - 1]
+            index.seek(0)
+            index.write(BREACH_HEADER.pack(BREACH_MAGIC, BREACH_VERSION, BREACH_PREFIX_BITS, count))
+            if sys.byteorder != "little":
+                counts.byteswap()
+            index.write(counts.tobytes())
+            index.flush()
+            os.fsync(index.fileno())
+        return count
+
+
+class AuditReport:
+    def __init__(self):
+        self.accounts = 0
+        self.weak = []      # (account, bits), weakest first
+        self.reused = []    # lists of accounts sharing a password
+        self.breached = []  # accounts whose password is in the breach list
+        self.breach_checked = False
+
+    def __str__(self):
+        lines = [f"{self.accounts} accounts audited"]
+        lines.append(f"{len(self.weak)} weak (under {WEAK_BITS} bits)")
+        for account, bits in self.weak:
+            lines.append(f"  {account}: {bits:.0f} bits")
+        lines.append(f"{len(self.reused)} passwords used for more than one account")
+        for group in self.reused:
+            lines.append(f"  {', '.join(group)}")
+        if self.breach_checked:
+            lines.append(f"{len(self.breached)} found in the breached-password list")
+            lines.extend(f"  {account}" for account in self.breached)
+        else:
+            lines.append("not checked against a breached-password list")
+        return "\n".join(lines)
+
+
+def audit_vault(passwords, breach_index=None):
+    """Audit a PASSWORDS mapping (unlocked, if encrypted)."""
+    report = AuditReport()
+    items = list(passwords.items())
+    report.accounts = len(items)
+    # Each distinct password is scored and looked up once
+    scores = score_passwords(password for _, password in items)
+    report.weak = sorted(
+        ((account, scores[password]) for account, password in items if scores[password] < WEAK_BITS),
+        key=lambda weak: (weak[1], weak[0]),
+    )
+    report.reused = sorted(find_reused(items))
+    if breach_index is not None:
+        breached = breach_index.breached(scores)
+        report.breached = sorted(account for account, password in items if password in breached)
+        report.breach_checked = True
+    return report
@@ -0,0 +1,120 @@
+import json
+import os
+import socket
+import tempfile
+
+from vault_crypto import VaultLockedError, WrongMasterPasswordError
+
+
+def daemon_paths(directory=None):
+    """Return the (socket, token file) paths of the daemon for this user.
+
+    Raises DaemonUnavailableError where there is no daemon to be had: it
+    needs Unix sockets and user ids, which Windows lacks.
+    """
+    if not hasattr(socket, "AF_UNIX") or not hasattr(os, "getuid"):
+        raise DaemonUnavailableError("The vault daemon isn't supported on this platform.")
+    if directory is None:
+        base = os.environ.get("XDG_RUNTIME_DIR") or tempfile.gettempdir()
+        directory = os.path.join(base, f"easypass-{os.getuid()}")
+    return os.path.join(directory, "daemon.sock"), os.path.join(directory, "daemon.token")
+
+
+class DaemonError(Exception):
+    def __init__(self, message, code=None):
+        super().__init__(message)
+        self.code = code
+
+
+class DaemonUnavailableError(DaemonError):
+    pass
+
+
+class VaultClient:
+    """Talks to a running VaultDaemon; one connection, reused for every call.
+
+    Only needs the standard library, so the CLI, scripts and the GUI can all
+    use it without loading the vault themselves. Raises
+    DaemonUnavailableError when no daemon is running, and the usual
+    KeyError, VaultLockedError or WrongMasterPasswordError for failed
+    requests.
+    """
+
+    def __init__(self, directory=None, timeout=5.0):
+        self.socket_path, self.token_path = daemon_paths(directory)
+        self.timeout = timeout
+        self._socket = None
+        self._file = None
+        self._token = None
+
+    def connect(self):
+        try:
+            with open(self.token_path, encoding="ascii") as token_file:
+                self._token = token_file.read().strip()
+            sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        except OSError:  # No token yet
+            raise DaemonUnavailableError("The vault daemon isn't running.") from None
+        sock.settimeout(self.timeout)
+        try:
+            sock.connect(self.socket_path)
+        except OSError:
+            sock.close()
+            raise DaemonUnavailableError("The vault daemon isn't running.") from None
+        self._socket = sock
+        self._file = sock.makefile("rb")
+
+    def close(self):
+        if self._socket is not None:
+            self._file.close()
+            self._socket.close()
+            self._socket = self._file = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def request(self, op, **params):
+        if self._socket is None:
+            self.connect()
+        params.update(op=op, token=self._token)
+        try:
+            self._socket.sendall(json.dumps(params).encode("utf-8") + b"\n")
+            line = self._file.readline()
+        except OSError as error:
+            self.close()
+            raise DaemonError(f"Lost the connection to the vault daemon: {error}") from None
+        if not line:
+            self.close()
+            raise DaemonError("The vault daemon closed the connection.")
+        response = json.loads(line)
+        if response["ok"]:
+            return response["result"]
+        code, message = response.get("code"), response.get("error", "")
+        if code == "not_found":
+            raise KeyError(params.get("account"))
+        if code == "locked":
+            raise VaultLockedError(message)
+        if code == "wrong_password":
+            raise WrongMasterPasswordError(message)
+        raise DaemonError(message, code)
+
+    def ping(self):
+        """Return the vault path the daemon serves and whether it's locked."""
+        return self.request("ping")
+
+    def get(self, account):
+        return self.request("get", account=account)
+
+    def list(self):
+        return self.request("list")
+
+    def search(self, query):
+        return self.request("search", query=query)
+
+    def unlock(self, master_password):
+        return self.request("unlock", master_password=master_password)
+
+    def lock(self):
+        return self.request("lock")
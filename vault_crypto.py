@@ -0,0 +1,151 @@
+import base64
+import os
+from collections.abc import MutableMapping
+
+# Prefix of every encrypted value, so the format can change later
+TOKEN_PREFIX = "enc1:"
+
+# scrypt cost; about 100 ms and 32 MiB per derivation on a desktop machine
+SCRYPT_N = 2 ** 15
+SCRYPT_R = 8
+SCRYPT_P = 1
+
+_CHECK_ACCOUNT = "\0vault-check"
+
+
+class VaultLockedError(Exception):
+    pass
+
+
+class WrongMasterPasswordError(Exception):
+    pass
+
+
+def _b64encode(data):
+    return base64.urlsafe_b64encode(data).decode("ascii")
+
+
+def _b64decode(text):
+    return base64.urlsafe_b64decode(text.encode("ascii"))
+
+
+def is_encrypted(meta):
+    return meta.get("kdf") == "scrypt"
+
+
+class VaultCipher:
+    """AES-256-GCM over single values, with the key derived once per session.
+
+    The master password goes through scrypt only in create() and unlock();
+    the resulting key stays in this object, so encrypting or decrypting one
+    value afterwards costs microseconds. Every value is sealed on its own,
+    with the account name as associated data, so it can be decrypted without
+    touching the rest of the vault and can't be moved to another account.
+    """
+
+    def __init__(self, key):
+        # Imported here: only encrypted vaults need it, and it is slow to load
+        try:
+            from cryptography.hazmat.primitives.ciphers.aead import AESGCM
+        except ImportError:
+            raise RuntimeError(
+                "Encrypted vaults need the 'cryptography' package (pip install cryptography)."
+            ) from None
+        self._aead = AESGCM(key)
+
+    @staticmethod
+    def derive_key(master_password, salt, n=SCRYPT_N, r=SCRYPT_R, p=SCRYPT_P):
+        import hashlib
+
+        return hashlib.scrypt(
+            master_password.encode("utf-8"),
+            salt=salt,
+            n=n,
+            r=r,
+            p=p,
+            maxmem=2 * 128 * n * r + 1024 * 1024,
+            dklen=32,
+        )
+
+    @classmethod
+    def create(cls, master_password):
+        """Return a cipher for a new vault and the parameters to store with it."""
+        salt = os.urandom(16)
+        cipher = cls(cls.derive_key(master_password, salt))
+        meta = {
+            "kdf": "scrypt",
+            "salt": _b64encode(salt),
+            "n": str(SCRYPT_N),
+            "r": str(SCRYPT_R),
+            "p": str(SCRYPT_P),
+        }
+        meta["check"] = cipher.encrypt(_CHECK_ACCOUNT, "")
+        return cipher, meta
+
+    @classmethod
+    def unlock(cls, master_password, meta):
+        key = cls.derive_key(
+            master_password,
+            _b64decode(meta["salt"]),
+            n=int(meta["n"]),
+            r=int(meta["r"]),
+            p=int(meta["p"]),
+        )
+        cipher = cls(key)
+        try:
+            cipher.decrypt(_CHECK_ACCOUNT, meta["check"])
+        except ValueError:
+            raise WrongMasterPasswordError("Wrong master password.") from None
+        return cipher
+
+    def encrypt(self, account, password):
+        nonce = os.urandom(12)
+        sealed = self._aead.encrypt(nonce, password.encode("utf-8"), account.encode("utf-8"))
+        return TOKEN_PREFIX + _b64encode(nonce + sealed)
+
+    def decrypt(self, account, token):
+        if not token.startswith(TOKEN_PREFIX):
+            raise ValueError(f"Value for {account!r} is not encrypted.")
+        data = _b64decode(token[len(TOKEN_PREFIX):])
+        try:
+            plain = self._aead.decrypt(data[:12], data[12:], account.encode("utf-8"))
+        except Exception:  # cryptography's InvalidTag
+            raise ValueError(f"Value for {account!r} can't be decrypted.") from None
+        return plain.decode("utf-8")
+
+
+class EncryptedPasswords(MutableMapping):
+    """Dict-like view of an encrypted vault that decrypts values on access.
+
+    `records` holds the values as stored (account -> token). Listing accounts
+    never decrypts anything; a value is only decrypted when it is read, e.g.
+    when it's copied to the clipboard. Reading while locked raises
+    VaultLockedError.
+    """
+
+    def __init__(self, records, cipher=None):
+        self.records = records
+        self.cipher = cipher
+
+    def _require_cipher(self):
+        if self.cipher is None:
+            raise VaultLockedError("The vault is locked.")
+        return self.cipher
+
+    def __getitem__(self, account):
+        return self._require_cipher().decrypt(account, self.records[account])
+
+    def __setitem__(self, account, password):
+        self.records[account] = self._require_cipher().encrypt(account, password)
+
+    def __delitem__(self, account):
+        del self.records[account]
+
+    def __contains__(self, account):
+        return account in self.records
+
+    def __iter__(self):
+        return iter(self.records)
+
+    def __len__(self):
+        return len(self.records)
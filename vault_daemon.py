@@ -0,0 +1,182 @@
+import asyncio
+import hmac
+import json
+import os
+import secrets
+import signal
+import socket
+import time
+
+from vault_client import daemon_paths
+from vault_crypto import VaultLockedError, WrongMasterPasswordError
+from vault_watcher import VaultWatcher
+
+
+class VaultDaemon:
+    """Serves lookups from an open PasswordManager over a Unix socket.
+
+    The protocol is one JSON object per line each way. Every request carries
+    the token the daemon writes next to its socket at startup; both live in a
+    directory only this user can enter, so reading the token proves the client
+    runs as the same user. An encrypted vault is locked again after
+    `idle_lock` seconds without requests (None or 0 disables that); clients
+    then get a "locked" error until someone sends the master password.
+    """
+
+    def __init__(self, manager, directory=None, idle_lock=300):
+        self.manager = manager
+        self.socket_path, self.token_path = daemon_paths(directory)
+        self.idle_lock = idle_lock
+        self._token = None
+        self._last_request = time.monotonic()
+        self._lock_timer = None
+        self._stop = None
+        self._loop = None
+        self._handlers = {
+            "ping": self.op_ping,
+            "get": self.op_get,
+            "list": self.op_list,
+            "search": self.op_search,
+            "unlock": self.op_unlock,
+            "lock": self.op_lock,
+        }
+
+    def run(self):
+        asyncio.run(self.serve())
+
+    def stop(self):
+        # Safe to call from any thread
+        if self._loop is not None:
+            self._loop.call_soon_threadsafe(self._stop.set)
+
+    async def serve(self):
+        self._loop = asyncio.get_running_loop()
+        self._stop = asyncio.Event()
+        self._prepare_directory()
+        self.manager.build_index_in_background()
+        server = await asyncio.start_unix_server(self._serve_client, path=self.socket_path)
+        os.chmod(self.socket_path, 0o600)
+        # The token only appears once the socket is ready for it
+        self._token = secrets.token_hex(32)
+        fd = os.open(self.token_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+        with os.fdopen(fd, "w", encoding="ascii") as token_file:
+            token_file.write(self._token)
+
+        # Keep up with what the GUI, the CLI or a sync tool write meanwhile
+        watcher = VaultWatcher(
+            self.manager.storage.files(),
+            lambda: self._loop.call_soon_threadsafe(self.manager.refresh),
+        )
+        watcher.start()
+        for signum in (signal.SIGINT, signal.SIGTERM):
+            try:
+                self._loop.add_signal_handler(signum, self._stop.set)
+            except (RuntimeError, ValueError):  # Not in the main thread
+                pass
+        self._schedule_lock()
+        try:
+            async with server:
+                await self._stop.wait()
+        finally:
+            watcher.stop()
+            if self._lock_timer is not None:
+                self._lock_timer.cancel()
+            for path in (self.token_path, self.socket_path):
+                try:
+                    os.unlink(path)
+                except FileNotFoundError:
+                    pass
+
+    def _prepare_directory(self):
+        directory = os.path.dirname(self.socket_path)
+        os.makedirs(directory, mode=0o700, exist_ok=True)
+        info = os.stat(directory)
+        if info.st_uid != os.getuid() or info.st_mode & 0o077:
+            raise RuntimeError(f"{directory} must belong to this user and be private (0700).")
+        if os.path.exists(self.socket_path):
+            # Left over from a daemon that died, unless one is still answering
+            probe = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            try:
+                probe.connect(self.socket_path)
+            except OSError:
+                os.unlink(self.socket_path)
+            else:
+                raise RuntimeError("A vault daemon is already running.")
+            finally:
+                probe.close()
+
+    async def _serve_client(self, reader, writer):
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                response = self._dispatch(line)
+                writer.write(json.dumps(response).encode("utf-8") + b"\n")
+                await writer.drain()
+        except (ConnectionError, ValueError):  # ValueError: line over the limit
+            pass
+        finally:
+            writer.close()
+
+    def _dispatch(self, line):
+        try:
+            request = json.loads(line)
+            token = request.get("token")
+        except (ValueError, AttributeError):
+            return {"ok": False, "code": "bad_request", "error": "Requests are JSON objects."}
+        if not isinstance(token, str) or not hmac.compare_digest(token, self._token):
+            return {"ok": False, "code": "auth", "error": "Bad or missing token."}
+        handler = self._handlers.get(request.get("op"))
+        if handler is None:
+            return {"ok": False, "code": "bad_request", "error": f"Unknown op {request.get('op')!r}."}
+        self._last_request = time.monotonic()
+        try:
+            return {"ok": True, "result": handler(request)}
+        except KeyError as error:
+            return {"ok": False, "code": "not_found", "error": f"No such account: {error}"}
+        except VaultLockedError as error:
+            return {"ok": False, "code": "locked", "error": str(error)}
+        except WrongMasterPasswordError as error:
+            return {"ok": False, "code": "wrong_password", "error": str(error)}
+
+    # Idle lock: one timer, pushed back lazily when it fires early
+    def _schedule_lock(self, delay=None):
+        if self.idle_lock and self.manager.encrypted:
+            self._lock_timer = self._loop.call_later(
+                self.idle_lock if delay is None else delay, self._check_idle
+            )
+
+    def _check_idle(self):
+        idle = time.monotonic() - self._last_request
+        if idle >= self.idle_lock:
+            self.manager.lock()
+            self._schedule_lock()
+        else:
+            self._schedule_lock(self.idle_lock - idle)
+
+    # Request handlers
+    def op_ping(self, request):
+        return {
+            "vault": os.path.abspath(self.manager.config_file),
+            "encrypted": self.manager.encrypted,
+            "locked": self.manager.locked,
+        }
+
+    def op_get(self, request):
+        return self.manager.PASSWORDS[request["account"]]
+
+    def op_list(self, request):
+        return list(self.manager.PASSWORDS)
+
+    def op_search(self, request):
+        return list(self.manager.search(request["query"]))
+
+    def op_unlock(self, request):
+        if self.manager.locked:
+            self.manager.unlock(request["master_password"])
+        return True
+
+    def op_lock(self, request):
+        self.manager.lock()
+        return True
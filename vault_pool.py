@@ -0,0 +1,109 @@
+import os
+from collections import OrderedDict
+
+from storage import storage_path
+from vault import PasswordManager
+
+# How many vaults stay open, and roughly how much memory they may take
+MAX_OPEN = 4
+MAX_BYTES = 256 * 1024 * 1024
+
+
+def vault_key(path):
+    # One entry per vault file, however the path was spelled; config.ini
+    # names config.vault too, since that is where it was migrated to
+    return os.path.normcase(os.path.realpath(storage_path(path)))
+
+
+def estimated_size(manager):
+    """Rough memory cost of an open vault, in bytes.
+
+    The files are mapped rather than read, so this is their size on disk, plus
+    as much again once a search built the index over the account names.
+    """
+    size = 0
+    for path in manager.storage.files():
+        try:
+            size += os.path.getsize(path)
+        except OSError:
+            pass
+    if manager.index_built:
+        size *= 2
+    return size
+
+
+class VaultPool:
+    """The vaults open in this process, most recently used last.
+
+    Vaults stay open, and unlocked, after switching away from them, so
+    switching back costs neither a load nor the key derivation. Past
+    `max_open` vaults or `max_bytes` of estimated_size() the least recently
+    used ones are closed, never the current one: the one last passed to
+    use(), or else the most recently used. open() closes nothing, so the
+    current vault stays open until a switch to another one is done.
+    `on_evict(key, manager)` runs first and can return False to keep a vault
+    open (unsaved changes).
+    """
+
+    def __init__(self, max_open=MAX_OPEN, max_bytes=MAX_BYTES, opener=PasswordManager, on_evict=None):
+        self.max_open = max_open
+        self.max_bytes = max_bytes
+        self.opener = opener
+        self.on_evict = on_evict
+        self._managers = OrderedDict()  # vault_key -> PasswordManager
+        self._current = None  # vault_key of the vault in use
+
+    def __contains__(self, path):
+        return vault_key(path) in self._managers
+
+    def __len__(self):
+        return len(self._managers)
+
+    def __iter__(self):
+        return iter(list(self._managers.values()))
+
+    def add(self, manager):
+        """Take over an already open manager, e.g. the one the app started with."""
+        self._managers[vault_key(manager.config_file)] = manager
+        self._managers.move_to_end(vault_key(manager.config_file))
+        self.trim()
+        return manager
+
+    def open(self, path):
+        """Return the manager for `path`, opening it if needed (maybe still locked)."""
+        key = vault_key(path)
+        manager = self._managers.get(key)
+        if manager is None:
+            manager = self._managers[key] = self.opener(path)
+        else:
+            self._managers.move_to_end(key)
+        return manager
+
+    def use(self, manager):
+        """Make `manager` the current vault, then close what no longer fits."""
+        key = vault_key(manager.config_file)
+        self._managers[key] = manager
+        self._managers.move_to_end(key)
+        self._current = key
+        self.trim()
+
+    def trim(self):
+        current = self._current if self._current in self._managers else next(reversed(self._managers), None)
+        total = sum(estimated_size(manager) for manager in self._managers.values())
+        for key, manager in list(self._managers.items()):
+            if len(self._managers) <= self.max_open and total <= self.max_bytes:
+                break
+            if key == current:
+                continue
+            size = estimated_size(manager)
+            if self.on_evict is not None and self.on_evict(key, manager) is False:
+                continue
+            del self._managers[key]
+            manager.close()
+            total -= size
+
+    def close(self):
+        for manager in reversed(self._managers.values()):
+            manager.close()
+        self._managers.clear()
+        self._current = None
@@ -0,0 +1,216 @@
+"""Bulk import and export: our CSV plus browser and password manager exports.
+
+Files are read and written one row at a time, so memory use doesn't depend
+on their size beyond the vault itself. An import is a single transaction: it
+is persisted with one storage call at the end, or not at all.
+"""
+import csv
+import io
+import os
+import sys
+from urllib.parse import urlsplit
+
+# Column names, lowercased, that carry each piece of a login in the formats
+# we read: Chrome/Edge/Brave (name,url,username,password,note), Firefox
+# (url,username,password,...), Safari (Title,URL,Username,Password,...),
+# Bitwarden (name,login_uri,login_username,login_password,...), LastPass
+# (url,username,password,...,name,...), KeePass/KeePassXC
+# ("Title","Username","Password","URL",...), 1Password (Title,Url/Website,
+# Username,Password,...) and our own account,password.
+COLUMNS = {
+    "account": ("account",),
+    "title": ("name", "title"),
+    "url": ("url", "login_uri", "website", "web site", "login url"),
+    "username": ("username", "login_username", "user name", "login name"),
+    "password": ("password", "login_password"),
+}
+
+# Export layouts: header, then a function of (account, password) -> row
+EXPORT_FORMATS = {
+    "csv": (("account", "password"), lambda account, password: (account, password)),
+    # Chrome, Edge and Firefox all import this one
+    "chrome": (
+        ("name", "url", "username", "password", "note"),
+        lambda account, password: (account, "", "", password, ""),
+    ),
+    "bitwarden": (
+        ("folder", "favorite", "type", "name", "notes", "fields", "reprompt",
+         "login_uri", "login_username", "login_password", "login_totp"),
+        lambda account, password: ("", "", "login", account, "", "", "0", "", "", password, ""),
+    ),
+}
+
+# Rows between two progress callbacks
+PROGRESS_EVERY = 10000
+
+
+class ImportFormatError(ValueError):
+    pass
+
+
+class ImportResult:
+    def __init__(self):
+        self.rows = 0        # data rows read
+        self.added = 0       # new accounts
+        self.replaced = 0    # existing accounts given the imported password
+        self.duplicates = 0  # rows for accounts that already existed, kept as they were
+        self.skipped = 0     # rows without a password (notes, cards...)
+
+    def __str__(self):
+        return (
+            f"{self.rows} rows: {self.added} added, {self.replaced} replaced, "
+            f"{self.duplicates} duplicates kept, {self.skipped} without a password"
+        )
+
+
+def open_source(path):
+    # utf-8-sig: several exporters start the file with a byte order mark
+    if path == "-":
+        return io.TextIOWrapper(sys.stdin.buffer, encoding="utf-8-sig", newline="")
+    return open(path, encoding="utf-8-sig", newline="")
+
+
+def open_target(path):
+    if path == "-":
+        sys.stdout.flush()
+        return io.TextIOWrapper(sys.stdout.buffer, encoding="utf-8", newline="")
+    return open(path, "w", encoding="utf-8", newline="")
+
+
+def close_stream(stream, path):
+    # Leave stdin and stdout open for the rest of the program
+    if path == "-":
+        if stream.writable():
+            stream.flush()
+        stream.detach()
+    else:
+        stream.close()
+
+
+def byte_position(stream):
+    # How far into the file the reader got, for progress; None for pipes.
+    try:
+        return stream.buffer.tell()
+    except (AttributeError, OSError, ValueError):
+        return None
+
+
+def account_name(title, url, username):
+    # The vault only keys passwords by name, so the site and the user name
+    # both go into it: "github.com (alice)".
+    site = title or urlsplit(url).hostname or url
+    if site and username:
+        return f"{site} ({username})"
+    return site or username
+
+
+def read_logins(source):
+    """Yield (account, password) for every row of a CSV export.
+
+    The format is recognized from the header. A file without one is taken
+    to be account,password rows. Rows without a password are yielded as
+    (account, None).
+    """
+    reader = csv.reader(source)
+    header = next(reader, None)
+    if header is None:
+        return
+    names = [name.strip().lower() for name in header]
+    columns = {}
+    for role, candidates in COLUMNS.items():
+        for candidate in candidates:
+            if candidate in names:
+                columns[role] = names.index(candidate)
+                break
+
+    if "password" not in columns:
+        if len(header) != 2:
+            raise ImportFormatError("No password column in the header.")
+        # Headerless account,password file; the first line is data
+        yield header[0], header[1]
+        for row in reader:
+            if len(row) >= 2:
+                yield row[0], row[1]
+        return
+
+    def cell(row, role):
+        index = columns.get(role)
+        return row[index].strip() if index is not None and index < len(row) else ""
+
+    for row in reader:
+        if not row:
+            continue
+        if "account" in columns:
+            account = cell(row, "account")
+        else:
+            account = account_name(cell(row, "title"), cell(row, "url"), cell(row, "username"))
+        index = columns["password"]
+        password = row[index] if index < len(row) else ""
+        yield account, password or None
+
+
+def import_logins(manager, logins, overwrite=False, progress=None):
+    """Add (account, password) pairs to `manager` in one transaction.
+
+    Accounts already in the vault, or seen earlier in `logins`, keep their
+    password unless `overwrite` is set. `progress` is called with the
+    number of rows read so far, every PROGRESS_EVERY rows and at the end.
+    """
+    result = ImportResult()
+    passwords = manager.PASSWORDS
+    with manager.transaction():
+        for account, password in logins:
+            result.rows += 1
+            if not account or password is None:
+                result.skipped += 1
+            elif account not in passwords:
+                manager.add_password(account, password)
+                result.added += 1
+            elif overwrite:
+                manager.edit_password(account, password)
+                result.replaced += 1
+            else:
+                result.duplicates += 1
+            if progress is not None and result.rows % PROGRESS_EVERY == 0:
+                progress(result.rows)
+    if progress is not None:
+        progress(result.rows)
+    return result
+
+
+def import_file(manager, path, overwrite=False, progress=None):
+    """Import a CSV export; `progress(rows, done_fraction_or_None)`."""
+    source = open_source(path)
+    try:
+        size = os.fstat(source.fileno()).st_size if path != "-" else None
+
+        def report(rows):
+            position = byte_position(source)
+            progress(rows, position / size if size and position is not None else None)
+
+        return import_logins(
+            manager, read_logins(source), overwrite, report if progress is not None else None
+        )
+    finally:
+        close_stream(source, path)
+
+
+def export_file(manager, path, format="csv", progress=None):
+    """Write every account to `path` in one of EXPORT_FORMATS; return the count."""
+    header, make_row = EXPORT_FORMATS[format]
+    passwords = manager.PASSWORDS
+    count = 0
+    target = open_target(path)
+    try:
+        writer = csv.writer(target)
+        writer.writerow(header)
+        for account in passwords:
+            writer.writerow(make_row(account, passwords[account]))
+            count += 1
+            if progress is not None and count % PROGRESS_EVERY == 0:
+                progress(count, count / len(passwords))
+    finally:
+        close_stream(target, path)
+    if progress is not None:
+        progress(count, 1.0)
+    return count
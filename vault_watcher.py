@@ -0,0 +1,156 @@
+import ctypes
+import ctypes.util
+import os
+import select
+import struct
+import sys
+import threading
+
+# inotify(7) constants
+IN_MODIFY = 0x00000002
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+_EVENT_HEADER = struct.Struct("iIII")
+
+
+class VaultWatcher:
+    """Calls `callback` from a background thread when the vault files change.
+
+    Uses inotify on Linux and falls back to polling os.stat() elsewhere, or if
+    inotify isn't available. A burst of writes (a journal append followed by a
+    compaction, say) fires the callback once, after `debounce` seconds of quiet.
+    Our own writes trigger it too; refreshing then simply finds nothing new.
+    """
+
+    def __init__(self, paths, callback, debounce=0.2, poll_interval=1.0):
+        self.paths = [os.path.abspath(path) for path in paths]
+        self.callback = callback
+        self.debounce = debounce
+        self.poll_interval = poll_interval
+        self._thread = None
+        self._stop = threading.Event()
+        self._wake_r = self._wake_w = None
+
+    def start(self):
+        if self._thread is not None:
+            return
+        self._stop.clear()
+        inotify = _Inotify.open(self.paths) if sys.platform.startswith("linux") else None
+        if inotify is not None:
+            self._wake_r, self._wake_w = os.pipe()
+            target = lambda: self._run_inotify(inotify)
+        else:
+            target = self._run_polling
+        self._thread = threading.Thread(target=target, name="vault-watcher", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        if self._thread is None:
+            return
+        self._stop.set()
+        if self._wake_w is not None:
+            os.write(self._wake_w, b"\0")
+        self._thread.join()
+        self._thread = None
+        for fd in (self._wake_r, self._wake_w):
+            if fd is not None:
+                os.close(fd)
+        self._wake_r = self._wake_w = None
+
+    def _fire(self):
+        if not self._stop.is_set():
+            self.callback()
+
+    def _run_inotify(self, inotify):
+        try:
+            while not self._stop.is_set():
+                # Sleeps until something happens in the directory; no timeout
+                ready, _, _ = select.select([inotify.fd, self._wake_r], [], [])
+                if self._wake_r in ready or not inotify.read_changed():
+                    continue
+                # Coalesce until the writes stop
+                while not self._stop.is_set():
+                    ready, _, _ = select.select(
+                        [inotify.fd, self._wake_r], [], [], self.debounce
+                    )
+                    if not ready:
+                        break
+                    if inotify.fd in ready:
+                        inotify.read_changed()
+                self._fire()
+        finally:
+            inotify.close()
+
+    def _stat_all(self):
+        stats = []
+        for path in self.paths:
+            try:
+                stat = os.stat(path)
+                stats.append((stat.st_ino, stat.st_size, stat.st_mtime_ns))
+            except FileNotFoundError:
+                stats.append(None)
+        return stats
+
+    def _run_polling(self):
+        last = self._stat_all()
+        while not self._stop.wait(self.poll_interval):
+            current = self._stat_all()
+            if current == last:
+                continue
+            # Coalesce until the files stop changing
+            while not self._stop.wait(self.debounce):
+                settled = self._stat_all()
+                if settled == current:
+                    break
+                current = settled
+            last = current
+            self._fire()
+
+
+class _Inotify:
+    def __init__(self, fd, names):
+        self.fd = fd
+        self._names = names
+
+    @classmethod
+    def open(cls, paths):
+        # Watch the directories rather than the files: the snapshot is replaced
+        # by a rename, which would orphan a watch on the file itself.
+        try:
+            libc = ctypes.CDLL(ctypes.util.find_library("c") or None, use_errno=True)
+            fd = libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+        except (OSError, AttributeError):
+            return None
+        if fd < 0:
+            return None
+        mask = IN_MODIFY | IN_CLOSE_WRITE | IN_MOVED_TO | IN_CREATE | IN_DELETE
+        names = set()
+        for directory in {os.path.dirname(path) for path in paths}:
+            if libc.inotify_add_watch(fd, os.fsencode(directory), mask) < 0:
+                os.close(fd)
+                return None
+        for path in paths:
+            names.add(os.fsencode(os.path.basename(path)))
+        return cls(fd, names)
+
+    def read_changed(self):
+        # Drain pending events; True if any was about one of our files.
+        changed = False
+        while True:
+            try:
+                data = os.read(self.fd, 64 * 1024)
+            except BlockingIOError:
+                return changed
+            offset = 0
+            while offset < len(data):
+                _, _, _, length = _EVENT_HEADER.unpack_from(data, offset)
+                offset += _EVENT_HEADER.size
+                name = data[offset:offset + length].rstrip(b"\0")
+                offset += length
+                if name in self._names:
+                    changed = True
+
+    def close(self):
+        os.close(self.fd)
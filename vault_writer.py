@@ -0,0 +1,377 @@
+import queue
+import threading
+
+import metrics
+from storage import DELETE, SET, VaultConflictError, VaultStorage, apply_changes
+
+# Seconds between attempts after a write failed (network drive gone, disk full)
+RETRY_DELAY = 5.0
+
+
+def _restore(base):
+    # The changes that put accounts back to what `base` says they were
+    return [
+        (DELETE, account, None) if record is None else (SET, account, record)
+        for account, record in base.items()
+    ]
+
+
+class WriteBehindStorage(VaultStorage):
+    """Does the writes of another storage on a background thread.
+
+    Put it in place of a PasswordManager's storage and apply() and refresh()
+    return at once; one worker thread does the work, merging whatever has
+    piled up meanwhile into a single write. It keeps its own copy of the
+    records, so the manager's are only touched by its owner.
+
+    Both copies map the vault file, and Windows can't replace a mapped file.
+    So the worker only ever appends to the journal; replacing the file, for
+    save() or to compact the journal, happens while the owner waits with the
+    manager's records closed (see _replace). So save() raises like a
+    synchronous one when the file can't be written, and nothing is retried.
+
+    Outcomes wait in an outbox until the owner calls deliver() on its own
+    thread (the GUI polls it with root.after, while `busy`; `on_queued()`
+    tells it when there is new work): changes found on disk are
+    merged into the manager, then `on_saved()` or `on_error(error)` is
+    called. Accounts another writer changed first, on disk or since the owner
+    last saw them, are reverted to its values and reported as a
+    VaultConflictError, like a synchronous transaction; the rest of the batch
+    is still written. Other errors keep the batch and retry every
+    RETRY_DELAY seconds.
+    """
+
+    def __init__(self, manager, on_saved=None, on_error=None, on_queued=None):
+        self.manager = manager
+        self.inner = manager.storage
+        self.on_saved = on_saved
+        self.on_error = on_error
+        self.on_queued = on_queued
+        self._records = self.inner.load()
+        # Compaction is left to _replace(), not done by the worker's writes
+        self._compact_every = getattr(self.inner, "compact_every", None)
+        if self._compact_every is not None:
+            self.inner.compact_every = float("inf")
+        self._compact_due = False
+        self._replacing = False
+        self._queue = queue.Queue()
+        self._requested = 0  # Items the owner queued
+        self._finished = 0   # ...and the worker is done with
+        self._outbox = queue.SimpleQueue()
+        self._changes = {}  # Coalesced changes not written yet, by account
+        self._base = {}     # What those accounts are on disk
+        self._groups = []   # Accounts changed by one transaction, overlapping ones merged
+        self._error = None
+        self._closed = False
+        self._thread = threading.Thread(target=self._run, name="vault-writer", daemon=True)
+        self._thread.start()
+
+    @property
+    def meta(self):
+        return self.inner.meta
+
+    @meta.setter
+    def meta(self, meta):
+        self.inner.meta = meta
+
+    def files(self):
+        return self.inner.files()
+
+    def load(self):
+        raise NotImplementedError("Load through the wrapped storage.")
+
+    # Called by the owner; they only queue work
+    def _request(self, *item):
+        self._requested += 1
+        self._queue.put(item)
+
+    def apply(self, changes, passwords, base=None):
+        self._request("apply", list(changes), dict(base or {}))
+        if self.on_queued is not None:
+            self.on_queued()
+        return []
+
+    def refresh(self, passwords):
+        self._request("refresh")
+        if self.on_queued is not None:
+            self.on_queued()
+        return []
+
+    @property
+    def busy(self):
+        """Whether deliver() has something to report, now or later."""
+        return (
+            self._finished < self._requested
+            or not self._outbox.empty()
+            or self._error is not None
+            or self._compact_due
+        )
+
+    def save(self, passwords):
+        # A full save also covers changes made to the records directly (like
+        # enable_encryption's), so it takes a copy of all of them. The caller
+        # gets the error, to undo those changes (the vault on disk is as it was).
+        error = self._replace("save", list(passwords.items()))
+        if error is not None:
+            raise error
+
+    def compact(self):
+        """Fold the journal into the vault file, if nothing is left to write."""
+        self._replace("compact")
+
+    def _replace(self, *item):
+        # The worker replaces the vault file while the manager's records,
+        # which map it too, are closed. The owner waits meanwhile, so nothing
+        # reads them. Afterwards they map the new file, or the old one again.
+        # Returns the error if the file couldn't be replaced.
+        if self._closed:
+            return None
+        records = self.manager._records
+        mapped = hasattr(records, "close")
+        self._replacing = True
+        try:
+            if mapped:
+                records.close()
+            done = threading.Event()
+            outcome = []
+            self._request(*item, done, outcome)
+            done.wait()
+            replaced, error = outcome[0]
+            if mapped:
+                if replaced:
+                    # What's left of the journal is replayed by the worker
+                    # later, like any other writer's records
+                    records.adopt(getattr(self.inner, "snapshot", self.inner).load())
+                else:
+                    self.inner.reopen(records)
+        finally:
+            self._replacing = False
+        self.deliver()
+        return error
+
+    def flush(self):
+        """Wait until everything queued is on disk; return the error if it isn't."""
+        if not self._closed:
+            done = threading.Event()
+            self._request("flush", done)
+            done.wait()
+        self.deliver()
+        return self._error
+
+    def deliver(self):
+        """Report what the worker did; call this on the owner's thread."""
+        while True:
+            try:
+                changes, error = self._outbox.get_nowait()
+            except queue.Empty:
+                break
+            if changes:
+                self.manager.merge(changes)
+            if error is not None:
+                if self.on_error is not None:
+                    self.on_error(error)
+            elif self.on_saved is not None:
+                self.on_saved()
+        if self._compact_due and not self._replacing:
+            self._replace("compact")
+
+    def close(self):
+        if self._closed:
+            return
+        self._queue.put(("stop",))
+        self._thread.join()
+        self._closed = True
+        self.inner.close()
+        if hasattr(self._records, "close"):
+            self._records.close()
+
+    # The worker thread
+    def _run(self):
+        while True:
+            try:
+                item = self._queue.get(timeout=RETRY_DELAY if self._error else None)
+            except queue.Empty:
+                self._retry()
+                continue
+            # Take everything that is queued, so it goes out in one write
+            items = [item]
+            while True:
+                try:
+                    items.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+
+            for item in items:
+                kind = item[0]
+                if kind == "apply":
+                    _, changes, base = item
+                    for account, record in base.items():
+                        self._base.setdefault(account, record)
+                    for change in changes:
+                        self._changes[change[1]] = change
+                    self._add_group({change[1] for change in changes} | set(base))
+                    continue
+                self._write()
+                if kind == "refresh":
+                    self._refresh()
+                elif kind == "save":
+                    item[3].append(self._save(item[1]))
+                    item[2].set()
+                elif kind == "compact":
+                    item[2].append(self._compact())
+                    item[1].set()
+                elif kind == "flush":
+                    item[1].set()
+                elif kind == "stop":
+                    return
+            self._write()
+            self._finished += len(items)
+
+    def _retry(self):
+        if self._changes:
+            self._write()
+        else:
+            self._refresh()
+
+    def _failed(self, error):
+        metrics.count("writer.failures", error=type(error).__name__)
+        # Only the first failure in a row is reported, not every retry
+        if self._error is None:
+            self._outbox.put(([], error))
+        self._error = error
+
+    def _succeeded(self, foreign):
+        if not self._changes:
+            self._error = None
+        self._outbox.put((foreign or [], None))
+
+    def _refresh(self):
+        try:
+            foreign = self.inner.refresh(self._records)
+        except Exception as error:
+            self._failed(error)
+        else:
+            self._succeeded(foreign)
+
+    def _add_group(self, accounts):
+        # Coalescing ties transactions that touch the same account together
+        for group in [group for group in self._groups if not group.isdisjoint(accounts)]:
+            self._groups.remove(group)
+            accounts |= group
+        self._groups.append(accounts)
+
+    def _drop(self, accounts):
+        # Take `accounts` out of the batch, along with the rest of their
+        # transactions, so none is written by halves (think of a rename).
+        # Returns what the dropped accounts are on disk.
+        dropped = set(accounts)
+        kept = []
+        for group in self._groups:
+            if group.isdisjoint(dropped):
+                kept.append(group)
+            else:
+                dropped |= group
+        self._groups = kept
+        base = {}
+        for account in dropped:
+            self._changes.pop(account, None)
+            if account in self._base:
+                base[account] = self._base.pop(account)
+        return base
+
+    def _stale(self):
+        # Accounts someone else changed after the owner last saw them: their
+        # change was merged in here, but hadn't reached the owner when it
+        # made its own. Writing ours would silently undo theirs.
+        stale = []
+        for account, base in self._base.items():
+            current = self._records.get(account)
+            if current != base:
+                stale.append((DELETE, account, None) if current is None else (SET, account, current))
+        return stale
+
+    def _write(self):
+        while self._changes:
+            stale = self._stale()
+            if stale:
+                # Those transactions are undone in the manager, the others
+                # still go out
+                taken = {change[1] for change in stale}
+                base = self._drop(taken)
+                revert = _restore({a: r for a, r in base.items() if a not in taken})
+                self._outbox.put((revert + stale, VaultConflictError(stale, [])))
+                continue
+            changes = list(self._changes.values())
+            base = dict(self._base)
+            apply_changes(self._records, changes)
+            try:
+                # Time spent waiting in the queue isn't the user's problem; the
+                # write itself, on a slow drive, might be
+                with metrics.span("writer.write", changes=len(changes), retry=self._error is not None):
+                    foreign = self.inner.apply(changes, self._records, base)
+            except VaultConflictError as error:
+                # Nothing was written. Our copy goes back to the disk state,
+                # with the other writer's values for the conflicting accounts;
+                # their transactions are undone in the manager too, and the
+                # rest of the batch goes out again.
+                taken = {change[1] for change in error.changes}
+                dropped = self._drop(taken)
+                ours = _restore({a: r for a, r in base.items() if a not in taken})
+                apply_changes(self._records, ours + error.changes)
+                revert = _restore({a: r for a, r in dropped.items() if a not in taken})
+                self._outbox.put((revert + error.changes + error.foreign, error))
+                continue
+            except Exception as error:
+                # Kept for the next attempt; our copy goes back to the disk state
+                apply_changes(self._records, _restore(base))
+                self._failed(error)
+                return
+            self._changes.clear()
+            self._base.clear()
+            self._groups.clear()
+            if self._compact_every is not None and self.inner.pending_changes >= self._compact_every:
+                self._compact_due = True
+            self._succeeded(foreign)
+
+    def _save(self, items):
+        # The vault ends up exactly as the owner had it when it asked, even
+        # if other writers changed it meanwhile, like a synchronous save.
+        # Returns (whether it did, the error if not), like _compact().
+        current = dict(items)
+        base = {}
+        try:
+            self.inner.refresh(self._records)
+            changes = [(SET, account, value) for account, value in items]
+            changes += [
+                (DELETE, account, None) for account in self._records if account not in current
+            ]
+            base = {change[1]: self._records.get(change[1]) for change in changes}
+            apply_changes(self._records, changes)
+            self.inner.save(self._records)
+        except Exception as error:
+            # Our copy goes back to the disk state, as the owner's will
+            apply_changes(self._records, _restore(base))
+            metrics.count("writer.failures", error=type(error).__name__)
+            return False, error
+        self._compact_due = False
+        self._succeeded([])
+        return True, None
+
+    def _compact(self):
+        # Not with changes still to write: the file would lack them, and the
+        # manager's records are about to be reloaded from it
+        self._compact_due = False  # Due again after the next write, if skipped
+        if self._compact_every is None or self._changes:
+            return False, None
+        try:
+            with self.inner.locked():
+                foreign = self.inner.refresh(self._records)
+                self.inner.compact(self._records)
+        except Exception as error:
+            # Nothing lost, the journal just stays long; tried again later
+            metrics.count("storage.compact_failures", error=type(error).__name__)
+            self.inner.compaction_error = error
+            return False, None
+        self.inner.compaction_error = None
+        self._outbox.put((foreign, None))
+        return True, None
@@ -0,0 +1,222 @@
+import tkinter as tk
+
+
+class VirtualListbox:
+    """A Listbox stand-in that only materializes the rows around the viewport.
+
+    The items live in a plain Python list; the underlying tk.Listbox only ever
+    holds the visible rows plus `buffer` rows above and below them, and is
+    refilled as the view moves. Indices passed to and returned from this class
+    (curselection, get, insert, delete, selection_set...) refer to the full
+    list, so it can be used where a tk.Listbox was. Wire a Scrollbar to it the
+    usual way: Scrollbar(command=vlist.yview) and vlist.config(yscrollcommand=sb.set).
+
+    The items may also be lazy, like search_index.SearchResults (anything
+    sliceable with a `complete` attribute): rows are then pulled from it only
+    as far as the view reaches, and the scrollbar grows as more are found.
+    """
+
+    def __init__(self, master, items=(), buffer=50, **options):
+        self.items = []
+        self._more = None        # Lazy items not pulled into self.items yet
+        self.buffer = buffer
+        self.listbox = tk.Listbox(master, exportselection=False, **options)
+        self.rows = max(1, int(self.listbox.cget("height")))
+        self.top = 0
+        self._window = None      # (start, end) of the items in the Listbox
+        self._selected = None    # selected index in self.items
+        self._yscrollcommand = None
+        self._take(items)
+
+        # The Listbox reports its own scrolling (wheel, keys, drag-select)
+        # here, so the window follows it whatever moved it.
+        self.listbox.configure(yscrollcommand=self._on_listbox_scroll)
+        self.listbox.bind("<<ListboxSelect>>", self._on_listbox_select, add="+")
+        self.listbox.bind("<Configure>", self._on_configure, add="+")
+        self._show(0)
+
+    # Geometry and event binding go straight to the Listbox
+    def grid(self, **options):
+        self.listbox.grid(**options)
+
+    def bind(self, sequence=None, func=None, add=None):
+        return self.listbox.bind(sequence, func, add)
+
+    def focus_set(self):
+        self.listbox.focus_set()
+
+    def config(self, yscrollcommand=None, **options):
+        if yscrollcommand is not None:
+            self._yscrollcommand = yscrollcommand
+            self._notify_scroll()
+        if options:
+            self.listbox.configure(**options)
+
+    configure = config
+
+    # Model access, mirroring the tk.Listbox methods the app uses
+    def size(self):
+        return len(self.items)
+
+    def _index(self, index):
+        if index == tk.END:
+            self._load(None)
+            return len(self.items)
+        index = int(index)
+        self._load(index + 1)
+        return index
+
+    def get(self, first, last=None):
+        if last is None:
+            return self.items[self._index(first)]
+        return tuple(self.items[self._index(first):self._index(last) + 1])
+
+    def set_items(self, items):
+        """Replace the whole model, e.g. with search results or another vault."""
+        self._take(items)
+        self._selected = None
+        self._window = None
+        self._show(0)
+
+    def _take(self, items):
+        if hasattr(items, "complete"):
+            self.items = []
+            self._more = items
+        else:
+            self.items = list(items)
+            self._more = None
+
+    def _load(self, count):
+        # Pull lazy items until there are `count` (None: all of them)
+        if self._more is None or count is not None and count <= len(self.items):
+            return
+        self.items.extend(self._more[len(self.items):count])
+        if self._more.complete:
+            self._more = None
+
+    def insert(self, index, *items):
+        index = self._index(index)
+        self.items[index:index] = items
+        if self._selected is not None and self._selected >= index:
+            self._selected += len(items)
+        self._refresh()
+
+    def delete(self, first, last=None):
+        first = self._index(first)
+        last = first if last is None else min(self._index(last), len(self.items) - 1)
+        if last < first:
+            return
+        del self.items[first:last + 1]
+        if self._selected is not None:
+            if first <= self._selected <= last:
+                self._selected = None
+            elif self._selected > last:
+                self._selected -= last - first + 1
+        self._refresh()
+
+    def curselection(self):
+        return () if self._selected is None else (self._selected,)
+
+    def selection_clear(self, first=0, last=None):
+        self._selected = None
+        self.listbox.selection_clear(0, tk.END)
+
+    def selection_set(self, index, last=None):
+        index = self._index(index)
+        if not 0 <= index < len(self.items):
+            return
+        self._selected = index
+        self._highlight()
+
+    def see(self, index):
+        index = self._index(index)
+        if index < self.top:
+            self._show(index)
+        elif index >= self.top + self.rows:
+            self._show(index - self.rows + 1)
+
+    # Scrollbar protocol
+    def yview(self, *args):
+        count = self._count()
+        if not args:
+            return self._fractions()
+        if args[0] == tk.MOVETO:
+            self._show(int(float(args[1]) * count))
+        elif args[0] == tk.SCROLL:
+            step = int(args[1])
+            if args[2] == tk.PAGES:
+                step *= self.rows
+            self._show(self.top + step)
+
+    def _count(self):
+        # While there are more lazy items, room for another page of them
+        return len(self.items) + (self.rows if self._more is not None else 0)
+
+    def _fractions(self):
+        count = self._count()
+        if not count:
+            return 0.0, 1.0
+        return self.top / count, min(1.0, (self.top + self.rows) / count)
+
+    def _notify_scroll(self):
+        if self._yscrollcommand is not None:
+            self._yscrollcommand(*self._fractions())
+
+    # Rendering
+    def _show(self, top):
+        self._load(max(0, top) + self.rows + self.buffer)
+        count = len(self.items)
+        top = max(0, min(top, count - self.rows))
+        start = max(0, top - self.buffer)
+        end = min(count, top + self.rows + self.buffer)
+        if (start, end) != self._window:
+            self._window = (start, end)
+            self.listbox.delete(0, tk.END)
+            if end > start:
+                self.listbox.insert(tk.END, *self.items[start:end])
+            self._highlight()
+        self.top = top
+        self.listbox.yview(top - start)
+        self._notify_scroll()
+
+    def _refresh(self):
+        self._window = None
+        self._show(self.top)
+
+    def _highlight(self):
+        start, end = self._window
+        self.listbox.selection_clear(0, tk.END)
+        if self._selected is not None and start <= self._selected < end:
+            self.listbox.selection_set(self._selected - start)
+
+    def _on_listbox_scroll(self, first, last):
+        if self._window is None:
+            return
+        start, end = self._window
+        top = start + self.listbox.nearest(0)
+        if top != self.top:
+            # Re-center the window once the view gets within a few rows of
+            # either edge of what has been materialized.
+            margin = min(self.buffer // 2, 10)
+            near_start = start > 0 and top - start < margin
+            more = end < len(self.items) or self._more is not None
+            near_end = more and end - (top + self.rows) < margin
+            if near_start or near_end:
+                self._show(top)
+                return
+            self.top = top
+        self._notify_scroll()
+
+    def _on_listbox_select(self, event=None):
+        selection = self.listbox.curselection()
+        if selection and self._window is not None:
+            self._selected = self._window[0] + selection[0]
+
+    def _on_configure(self, event=None):
+        if not self.items or self._window is None:
+            return
+        # Visible rows = rows between the top and the bottom edge of the widget
+        visible = self.listbox.nearest(self.listbox.winfo_height()) - self.listbox.nearest(0) + 1
+        if visible > 0 and visible != self.rows:
+            self.rows = visible
+            self._refresh()